@@ -0,0 +1,111 @@
+"""
+Pieces shared by the benchmarks (and tests) that drive server.py in-process.
+
+  FakeViewer    a WebSocketResponse stand-in to hand to a hub or session
+  ticker        samples how late the event loop wakes a sleeping task
+  scratch_tmux  runs the caller against its own tmux server
+
+Import with ``from bench.common import ...`` once server/ is on sys.path.
+"""
+
+import asyncio
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from types import SimpleNamespace
+
+
+class NullTransport:
+    """Accepts writes and counts bytes."""
+
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+    def is_closing(self):
+        return False
+
+
+class NullProtocol:
+    _paused = False
+
+    async def _drain_helper(self):
+        pass
+
+
+class FakeViewer:
+    """Just enough of a WebSocketResponse for ClientWriter and TerminalSession.
+
+    Frames sent through send_str/send_bytes (ClientWriter's fallback path)
+    are counted in ``frames`` and ``received``; ``first`` is set by the
+    first one. A binary client's join snapshot is a control message followed
+    by the screen, so ``screen_at`` (a perf_counter time) and ``screen`` are
+    set when frame ``screen_frame`` arrives.
+
+    With ``compress`` (a deflate level, or 0), the viewer looks like a
+    prepared response with a null transport instead, so ClientWriter takes
+    its raw frame path and the bytes written are in
+    ``_writer.transport.written``.
+    """
+
+    closed = False
+
+    def __init__(self, protocol: str = None, compress: int = None, screen_frame: int = 2):
+        self.ws_protocol = protocol
+        self.frames = 0
+        self.received = 0
+        self.first = asyncio.Event()
+        self.screen = asyncio.Event()
+        self.screen_at = None
+        self.screen_frame = screen_frame
+        if compress is not None:
+            self._writer = SimpleNamespace(transport=NullTransport(), protocol=NullProtocol(),
+                                           compress=compress)
+
+    async def send_str(self, data):
+        await self.send_bytes(data)
+
+    async def send_bytes(self, data):
+        self.frames += 1
+        self.received += len(data)
+        self.first.set()
+        if self.frames == self.screen_frame:
+            self.screen_at = time.perf_counter()
+            self.screen.set()
+
+    async def close(self, **kwargs):
+        self.closed = True
+
+
+async def ticker(stop: asyncio.Event, lags: list, period: float = 0.005):
+    """Append how late each ``period`` sleep wakes up (seconds) to lags until stop is set."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(period)
+        lags.append(loop.time() - start - period)
+
+
+@contextmanager
+def scratch_tmux():
+    """Point tmux at a temp dir for the duration, so real sessions are never touched.
+
+    TMUX_TMPDIR is set to a fresh directory (yielded as a Path, also usable
+    for scratch files) and TMUX is unset, so tmux commands from this process
+    and its children start and talk to a server of their own. That server is
+    killed and the directory removed on exit.
+    """
+    tmpdir = tempfile.mkdtemp(prefix="termlinkky-bench-")
+    os.environ["TMUX_TMPDIR"] = tmpdir
+    os.environ.pop("TMUX", None)
+    try:
+        yield Path(tmpdir)
+    finally:
+        subprocess.run(["tmux", "kill-server"], capture_output=True)
+        shutil.rmtree(tmpdir, ignore_errors=True)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Bytes per minute sent to a raw-stream client vs a screen-diff client.
+
+Runs typical workloads (top, an npm-install-style progress log, scrolling
+in vim) in the shared session on a scratch tmux server, with one raw viewer
+and one ?transport=diff viewer attached. Both viewers' final screens are compared to check the
+diff client ends up showing the same thing.
+
+Usage: python3 bench/diff_bandwidth.py [--seconds 20] [--fps 10]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from bench.common import scratch_tmux  # noqa: E402
+
+SESSION = "diffbench"
+
+# An npm install lookalike: spinner and progress bar redraws plus log lines
+NPM_SCRIPT = r"""
+import itertools, sys, time
+spinner = itertools.cycle("⠋⠙⠹⠸⠼⠴⠦⠧⠇⠏")
+for i in itertools.count():
+    done = i % 400
+    bar = "#" * (done // 20) + "." * (20 - done // 20)
+    sys.stdout.write(f"\r{next(spinner)} [{bar}] reify:pkg-{done}\x1b[K")
+    if i % 12 == 0:
+        sys.stdout.write(f"\r\x1b[Knpm http fetch GET 200 /pkg-{i} 41ms\n")
+    sys.stdout.flush()
+    time.sleep(0.04)
+"""
+
+
+class Viewer:
+    """Counts bytes and keeps a pyte screen of what it was sent."""
+
+    def __init__(self, server, cols, rows):
+        import pyte
+        self.ws_protocol = server.BINARY_PROTOCOL
+        self.closed = False
+        self.bytes = 0
+        self.screen = pyte.Screen(cols, rows)
+        self._stream = pyte.ByteStream(self.screen)
+
+    async def send_str(self, data):
+        self.bytes += len(data.encode())
+
+    async def send_bytes(self, data):
+        self.bytes += len(data)
+        if not data.startswith(b'{"type"'):
+            self._stream.feed(data)
+
+
+async def workload(server, hub, name: str, command: str, keys, seconds: float):
+    await server.tmux("respawn-pane", "-k", "-t", f"={SESSION}:", command)
+    await asyncio.sleep(1)
+    raw = Viewer(server, 48, 30)
+    diff = Viewer(server, 48, 30)
+    await hub.add_client(raw, remote="raw")
+    await hub.add_client(diff, remote="diff", transport="diff")
+    await asyncio.sleep(0.5)
+    raw.bytes = diff.bytes = 0
+    loop = asyncio.get_running_loop()
+    end = loop.time() + seconds
+    while loop.time() < end:
+        if keys:
+            await hub.write(keys)
+        await asyncio.sleep(0.05)
+    # Stop the workload so both viewers settle on the same screen
+    await server.tmux("send-keys", "-t", f"={SESSION}:", "Escape" if keys else "C-c")
+    await asyncio.sleep(2)
+    same = raw.screen.display == diff.screen.display
+
+    per_minute = 60 / seconds
+    print(f"{name:>6} {raw.bytes * per_minute / 1024:10.1f} {diff.bytes * per_minute / 1024:10.1f}"
+          f" {raw.bytes / max(diff.bytes, 1):7.1f}x  {'yes' if same else 'NO'}")
+    hub.remove_client(raw)
+    hub.remove_client(diff)
+
+
+async def run(seconds: float, fps: float):
+    import server
+
+    server.IDLE_DETACH_SECONDS = 60
+    server.DIFF_FPS = fps
+    if not server.SCREEN_MODEL:
+        sys.exit("the diff transport needs pyte (pip install pyte)")
+    scratch = Path(os.environ["TMUX_TMPDIR"])
+    (scratch / "npm.py").write_text(NPM_SCRIPT)
+    (scratch / "long.txt").write_text("".join(f"{i:5} the quick brown fox jumps over the lazy dog\n"
+                                              for i in range(20000)))
+    await server.tmux("new-session", "-d", "-s", SESSION, "-x", "48", "-y", "30")
+    await server.tmux("set-option", "-t", SESSION, "status", "off")
+    await server.tmux("set-option", "-t", SESSION, "remain-on-exit", "on")
+    hub = server.SharedTerminalSession.acquire(SESSION)
+    await hub.add_client(Viewer(server, 48, 30), remote="keepalive")
+
+    print(f"{'':>6} {'raw KB/min':>10} {'diff KB/min':>10} {'saving':>8}  same screen")
+    await workload(server, hub, "top", "top -d 0.5", None, seconds)
+    await workload(server, hub, "npm", f"{sys.executable} {scratch / 'npm.py'}", None, seconds)
+    await workload(server, hub, "vim", f"vim -u NONE -n {scratch / 'long.txt'}", b"j", seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=20.0, help="seconds per workload")
+    parser.add_argument("--fps", type=float, default=10.0, help="diff frames per second cap")
+    args = parser.parse_args()
+
+    with scratch_tmux():
+        asyncio.run(run(args.seconds, args.fps))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Keystroke-to-echo latency and idle CPU for the PTY read path.
+
+Compares the legacy select()+sleep polling loop against the event-driven
+PtyReader used by server.py. A `cat` child on a PTY provides the echo, so
+the numbers measure only the server-side read path.
+
+Usage: python3 bench/echo_latency.py [--keys 200] [--idle 5]
+"""
+
+import argparse
+import asyncio
+import os
+import pty
+import resource
+import select
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from server import PtyReader  # noqa: E402
+
+
+def spawn_cat():
+    pid, fd = pty.fork()
+    if pid == 0:
+        os.execvp("cat", ["cat"])
+    return pid, fd
+
+
+async def legacy_reader(fd, on_data, stop: asyncio.Event):
+    """The pre-PtyReader loop: blocking select() then a fixed sleep."""
+    while not stop.is_set():
+        r, _, _ = select.select([fd], [], [], 0.05)
+        if r:
+            data = os.read(fd, 4096)
+            if data:
+                on_data(data)
+        await asyncio.sleep(0.01)
+
+
+async def loop_lag_probe(stop: asyncio.Event, samples: list):
+    """Record how late a 1 ms timer fires, i.e. how long the loop was blocked."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        samples.append(time.perf_counter() - start - 0.001)
+
+
+async def run(mode: str, keys: int, idle: float) -> dict:
+    pid, fd = spawn_cat()
+    stop = asyncio.Event()
+    received = asyncio.Event()
+    lag = []
+    
+    def on_data(data):
+        received.set()
+    
+    if mode == "legacy":
+        task = asyncio.create_task(legacy_reader(fd, on_data, stop))
+        reader = None
+    else:
+        reader = PtyReader(fd, on_data, lambda reason: None)
+        reader.start()
+        task = None
+    
+    await asyncio.sleep(0.2)
+    probe_stop = asyncio.Event()
+    probe = asyncio.create_task(loop_lag_probe(probe_stop, lag))
+    
+    latencies = []
+    for _ in range(keys):
+        received.clear()
+        start = time.perf_counter()
+        os.write(fd, b"x")
+        await received.wait()
+        latencies.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.005)
+    probe_stop.set()
+    await probe
+    
+    # Idle: nothing is written, only the read path runs
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_before = time.process_time()
+    await asyncio.sleep(idle)
+    cpu = time.process_time() - cpu_before
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    
+    stop.set()
+    if task:
+        await task
+    if reader:
+        reader.stop()
+    os.close(fd)
+    os.kill(pid, 9)
+    os.waitpid(pid, 0)
+    
+    latencies.sort()
+    return {
+        "mode": mode,
+        "echo_p50_ms": statistics.median(latencies),
+        "echo_p99_ms": latencies[int(len(latencies) * 0.99) - 1],
+        "loop_lag_max_ms": max(lag) * 1000,
+        "idle_cpu_pct": cpu / idle * 100,
+        "idle_ctx_switches_per_s": (
+            (usage_after.ru_nvcsw + usage_after.ru_nivcsw)
+            - (usage_before.ru_nvcsw + usage_before.ru_nivcsw)
+        ) / idle,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--keys", type=int, default=200, help="keystrokes per mode")
+    parser.add_argument("--idle", type=float, default=5.0, help="idle seconds per mode")
+    args = parser.parse_args()
+    
+    print(f"{'mode':<8} {'p50 ms':>8} {'p99 ms':>8} {'lag max':>8} {'idle cpu':>9} {'ctxsw/s':>8}")
+    for mode in ("legacy", "watch"):
+        r = asyncio.run(run(mode, args.keys, args.idle))
+        print(f"{r['mode']:<8} {r['echo_p50_ms']:>8.2f} {r['echo_p99_ms']:>8.2f} "
+              f"{r['loop_lag_max_ms']:>8.2f} {r['idle_cpu_pct']:>8.2f}% "
+              f"{r['idle_ctx_switches_per_s']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
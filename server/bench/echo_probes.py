@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Keystroke-to-echo latency, split into where the time goes.
+
+Sends --probes echo probes ({"type": "probe"} control messages, see
+EchoProbes in server.py) one every --interval seconds, as a typist would,
+and reports for each stage the p50 and p99 in ms:
+
+  queue     received by the server to written to the PTY (event loop, input
+            scheduling)
+  echo      written to the PTY to the echo being read back (tmux, the shell)
+  output    echo read to handed to the socket (coalescing, client queue)
+  network   the client's round trip minus the server's share
+
+By default the server's handlers run in this process, over TLS, against a
+scratch tmux server, and a client in a child process probes the shared
+session and a private shell. With --url the client probes a running server
+instead (certificates are not checked).
+
+Usage: python3 bench/echo_probes.py [--probes 50] [--interval 0.1] [--url https://host:8443]
+"""
+
+import argparse
+import asyncio
+import json
+import ssl
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from bench.common import scratch_tmux  # noqa: E402
+
+STAGES = ("queue", "echo", "output", "network")
+
+
+def percentile(samples: list, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def probe_endpoint(http, url: str, probes: int, interval: float) -> dict:
+    """Probe one endpoint; returns stage -> samples in ms, and the timeouts."""
+    import aiohttp
+
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    ws = await http.ws_connect(url, ssl=ctx, protocols=("termlinkky.binary",))
+    samples = {stage: [] for stage in STAGES + ("round_trip",)}
+    timeouts = 0
+
+    async def settle():
+        # Let the prompt (and anything else) arrive before and after probing
+        while True:
+            try:
+                await ws.receive(timeout=0.5)
+            except asyncio.TimeoutError:
+                return
+
+    await settle()
+    for i in range(probes):
+        sent = time.perf_counter()
+        await ws.send_str(json.dumps({"type": "probe", "id": i, "data": "x"}))
+        while True:
+            msg = await ws.receive(timeout=5)
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                reply = json.loads(msg.data)
+                if reply.get("type") == "probe" and reply.get("id") == i:
+                    break
+            elif msg.type != aiohttp.WSMsgType.BINARY:
+                raise ConnectionError(f"connection closed ({msg.type})")
+        round_trip = (time.perf_counter() - sent) * 1000
+        if reply.get("timeout"):
+            timeouts += 1
+        else:
+            for stage, ms in reply["stages_ms"].items():
+                samples[stage].append(ms)
+            samples["network"].append(round_trip - reply["server_ms"])
+            samples["round_trip"].append(round_trip)
+        await asyncio.sleep(interval)
+    await ws.send_bytes(b"\x15")  # Clear the probed line
+    await settle()
+    await ws.close()
+    return {"samples": samples, "timeouts": timeouts}
+
+
+async def client(base: str, probes: int, interval: float):
+    import aiohttp
+
+    print(f"{'endpoint':>18} {'stage':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    async with aiohttp.ClientSession() as http:
+        for path in ("/terminal", "/terminal/private"):
+            result = await probe_endpoint(http, base + path, probes, interval)
+            for stage, samples in result["samples"].items():
+                if samples:
+                    print(f"{path:>18} {stage:>10} {percentile(samples, 0.5):8.2f} "
+                          f"{percentile(samples, 0.99):8.2f}")
+            if result["timeouts"]:
+                print(f"{path:>18} {result['timeouts']} probes timed out")
+
+
+async def serve_and_probe(probes: int, interval: float, workdir: Path):
+    import server
+    from aiohttp import web
+
+    server._shell_pool = server.ShellPool(size=1)
+    server.get_shell_pool().fill_soon()
+    await server.tmux("new-session", "-d", "-s", server.SHARED_SESSION, "-x", "80", "-y", "24")
+    cert, key = workdir / "server.crt", workdir / "server.key"
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-keyout", str(key),
+                    "-out", str(cert), "-days", "1", "-nodes", "-subj", "/CN=bench"],
+                   check=True, capture_output=True)
+    ssl_ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    ssl_ctx.load_cert_chain(str(cert), str(key))
+
+    app = web.Application()
+    app.router.add_get("/terminal", server.websocket_handler)
+    app.router.add_get("/terminal/private", server.websocket_private_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0, ssl_context=ssl_ctx)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, __file__, "--url", f"https://127.0.0.1:{port}",
+        "--probes", str(probes), "--interval", str(interval),
+        stdout=subprocess.PIPE,
+    )
+    report, _ = await proc.communicate()
+    await runner.cleanup()
+    server.get_shell_pool().close()
+    print(report.decode(), end="")  # After the server's own log lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--probes", type=int, default=50, help="probes per endpoint")
+    parser.add_argument("--interval", type=float, default=0.1, help="seconds between probes")
+    parser.add_argument("--url", help="probe a running server instead, e.g. https://host:8443")
+    args = parser.parse_args()
+    if args.url:
+        asyncio.run(client(args.url.rstrip("/"), args.probes, args.interval))
+        return
+
+    with scratch_tmux() as tmpdir:
+        asyncio.run(serve_and_probe(args.probes, args.interval, tmpdir))
+
+
+if __name__ == "__main__":
+    main()
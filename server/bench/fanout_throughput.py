@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Shared-session fan-out throughput with 1, 10 and 100 simulated viewers.
+
+Compares aiohttp's per-client send (each viewer frames and deflates the
+same chunk separately) with the server's encode-once OutputFrame path.
+Viewers are fake transports, so only server-side CPU is measured.
+
+Usage: python3 bench/fanout_throughput.py [--chunks 500] [--no-compress]
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from aiohttp.http_websocket import WebSocketWriter  # noqa: E402
+from server import OutputFrame  # noqa: E402
+
+
+class NullTransport:
+    """Accepts writes and counts bytes."""
+    
+    def __init__(self):
+        self.written = 0
+    
+    def write(self, data):
+        self.written += len(data)
+    
+    def is_closing(self):
+        return False
+
+
+class NullProtocol:
+    _paused = False
+    
+    async def _drain_helper(self):
+        pass
+
+
+def terminal_chunks(count: int, size: int = 4096):
+    """Colored build-log style output, cut into PTY-sized chunks."""
+    rng = random.Random(0)
+    words = ["compiling", "src/server.py", "warning:", "unused", "variable", "ok",
+             "[1/120]", "linking", "target", "release", "\x1b[32mPASS\x1b[0m",
+             "\x1b[1;31merror\x1b[0m", "\x1b[33m~\x1b[0m"]
+    text = "\r\n".join(
+        " ".join(rng.choice(words) for _ in range(rng.randint(4, 14)))
+        for _ in range(count * size // 60)
+    ).encode()
+    return [text[i:i + size] for i in range(0, count * size, size)]
+
+
+async def per_client(chunks, viewers: int, compress: int):
+    writers = [WebSocketWriter(NullProtocol(), NullTransport(), compress=compress)
+               for _ in range(viewers)]
+    for chunk in chunks:
+        for writer in writers:
+            await writer.send_frame(chunk, 0x2)
+
+
+async def encode_once(chunks, viewers: int, compress: int):
+    transports = [NullTransport() for _ in range(viewers)]
+    for chunk in chunks:
+        frame = OutputFrame(chunk)
+        for transport in transports:
+            transport.write(frame.wire(compress))
+
+
+def measure(fn, chunks, viewers, compress) -> dict:
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    asyncio.run(fn(chunks, viewers, compress))
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - start_cpu
+    total = sum(len(c) for c in chunks)
+    return {
+        "viewers": viewers,
+        "mode": fn.__name__,
+        "pty_mb_per_s": total / wall / 1e6,
+        "cpu_us_per_chunk": cpu / len(chunks) * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=500, help="4 KB chunks per run")
+    parser.add_argument("--no-compress", action="store_true", help="disable permessage-deflate")
+    args = parser.parse_args()
+    compress = 0 if args.no_compress else 15
+    chunks = terminal_chunks(args.chunks)
+    
+    print(f"permessage-deflate: {'off' if not compress else 'on'}")
+    print(f"{'viewers':>7} {'mode':<11} {'PTY MB/s':>9} {'cpu us/chunk':>13}")
+    for viewers in (1, 10, 100):
+        for fn in (per_client, encode_once):
+            r = measure(fn, chunks, viewers, compress)
+            print(f"{r['viewers']:>7} {r['mode']:<11} {r['pty_mb_per_s']:>9.2f} "
+                  f"{r['cpu_us_per_chunk']:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
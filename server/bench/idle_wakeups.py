@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Idle CPU and wakeups/sec for a shared session hub, before and after hibernation.
+
+Runs a SharedTerminalSession against a scratch tmux server whose pane
+prints a line every second, like a build or log tail nobody is watching. Three phases are measured:
+
+  viewing     one (fake) viewer connected
+  grace       viewer gone, hub still attached for the resume window
+  hibernated  hub detached from tmux after TERMLINKKY_IDLE_DETACH
+
+CPU and context switches are summed over this process, its tmux attach
+client (if any) and the tmux server.
+
+Usage: python3 bench/idle_wakeups.py [--phase 10] [--control]
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from bench.common import FakeViewer, scratch_tmux  # noqa: E402
+
+SESSION = "idlebench"
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def proc_counters(pid: int) -> tuple:
+    """(cpu seconds, context switches) for another process, or zeros if it is gone."""
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+        switches = 0
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if "ctxt_switches:" in line:
+                switches += int(line.split()[1])
+        return cpu, switches
+    except (FileNotFoundError, ProcessLookupError, IndexError):
+        return 0.0, 0
+
+
+def counters(pids) -> tuple:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = usage.ru_utime + usage.ru_stime
+    switches = usage.ru_nvcsw + usage.ru_nivcsw
+    for pid in pids:
+        c, s = proc_counters(pid)
+        cpu += c
+        switches += s
+    return cpu, switches
+
+
+async def measure(label: str, seconds: float, hub, tmux_pid: int) -> dict:
+    pids = [tmux_pid] + ([hub._pid] if hub._pid else [])
+    cpu0, sw0 = counters(pids)
+    await asyncio.sleep(seconds)
+    cpu1, sw1 = counters(pids)
+    result = {
+        "phase": label,
+        "attached": hub._running,
+        "cpu_pct": (cpu1 - cpu0) / seconds * 100,
+        "wakeups_per_sec": (sw1 - sw0) / seconds,
+    }
+    print(f"{label:>11}  attached={str(result['attached']):5}  "
+          f"cpu {result['cpu_pct']:5.2f}%  wakeups {result['wakeups_per_sec']:7.1f}/s")
+    return result
+
+
+async def run(phase: float) -> list:
+    import server
+
+    server.IDLE_DETACH_SECONDS = phase
+    await server.tmux("new-session", "-d", "-s", SESSION, "-x", "80", "-y", "24",
+                      "sh -c 'while sleep 1; do date; done'")
+    tmux_pid = int((await server.tmux("display-message", "-p", "#{pid}")).stdout.strip())
+
+    viewer = FakeViewer()
+    hub = server.SharedTerminalSession.acquire(SESSION)
+    await hub.add_client(viewer, remote="bench")
+    await asyncio.sleep(1)  # let the initial snapshot settle
+
+    results = [await measure("viewing", phase, hub, tmux_pid)]
+    hub.remove_client(viewer)
+    server.SharedTerminalSession.release(hub)
+    results.append(await measure("grace", phase * 0.9, hub, tmux_pid))
+    await asyncio.sleep(phase * 0.2)
+    results.append(await measure("hibernated", phase, hub, tmux_pid))
+    print(f"viewer received {viewer.received} bytes")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--phase", type=float, default=10.0, help="seconds per phase")
+    parser.add_argument("--control", action="store_true",
+                        help="follow output through tmux control mode instead of attach")
+    args = parser.parse_args()
+
+    os.environ["TERMLINKKY_TMUX_OUTPUT"] = "control" if args.control else "attach"
+    with scratch_tmux():
+        asyncio.run(run(args.phase))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Input scheduling across several typists sharing one session.
+
+Drives an InputScheduler into a simulated PTY that accepts input at a fixed
+rate (the real tmux attach PTY takes roughly 0.3-0.6 MB/s, see
+paste_throughput.py) and reports:
+
+  burst     writes per keystroke when a macro sends keys as separate messages
+  paste     keystroke latency for one typist while another pastes, with turns
+            (per-client queues) vs one shared FIFO as before the scheduler
+  rate      time for a client to get through input under a rate limit
+
+Usage: python3 bench/input_fairness.py [--pty-mbps 0.5] [--paste 262144]
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+class FakePty:
+    """Delivery target that takes bytes at a fixed rate and notes when each write lands."""
+
+    def __init__(self, bytes_per_sec: float):
+        self.bytes_per_sec = bytes_per_sec
+        self.writes = []  # (time written, data)
+
+    async def deliver(self, data: bytes):
+        await asyncio.sleep(len(data) / self.bytes_per_sec)
+        self.writes.append((asyncio.get_running_loop().time(), data))
+
+
+async def burst(server, pty_rate: float) -> str:
+    pty = FakePty(pty_rate)
+    scheduler = server.InputScheduler(pty.deliver)
+    keys = 0
+    for _ in range(50):
+        # A macro: one WebSocket message per key, sent back to back
+        for key in b"git status --short\r":
+            await scheduler.push("macro", bytes([key]))
+            keys += 1
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.2)
+    scheduler.close()
+    return f"burst: {keys} keystrokes in {len(pty.writes)} writes ({len(pty.writes) / keys:.2f} per key)"
+
+
+async def paste_vs_typist(server, pty_rate: float, paste_size: int, shared_fifo: bool) -> list:
+    pty = FakePty(pty_rate)
+    scheduler = server.InputScheduler(pty.deliver)
+    loop = asyncio.get_running_loop()
+    sent = {}
+
+    async def paster():
+        data = b"x" * 63 + b"\r"
+        block = data * (16 * 1024 // len(data))
+        for _ in range(paste_size // len(block)):
+            await scheduler.push(None if shared_fifo else "paster", block)
+
+    async def typist():
+        # Types (a letter, then an arrow key) until the paste is all taken
+        i = 0
+        while not paste_task.done() or scheduler.queue_depth:
+            key = bytes([0x41 + i % 26]) + b"\x1b[A"
+            sent[key + bytes([i % 256])] = loop.time()
+            await scheduler.push(None if shared_fifo else "typist", key)
+            await asyncio.sleep(0.02)
+            i += 1
+
+    paste_task = asyncio.create_task(paster())
+    await asyncio.sleep(0.01)
+    await typist()
+    await asyncio.sleep(0.05)
+    scheduler.close()
+    # Match each keystroke to the write that carried it
+    latencies = []
+    position = 0
+    stream = b"".join(data for _, data in pty.writes)
+    ends, total = [], 0
+    for at, data in pty.writes:
+        total += len(data)
+        ends.append((total, at))
+    for key, at in sent.items():
+        index = stream.find(key[:-1], position)
+        position = index + 1
+        landed = next(when for end, when in ends if end > index)
+        latencies.append((landed - at) * 1000)
+    return latencies
+
+
+async def rate_limit(server, rate: float, burst_bytes: int, size: int) -> str:
+    pty = FakePty(10e6)
+    scheduler = server.InputScheduler(pty.deliver, rate=rate, burst=burst_bytes)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    for _ in range(size // 1024):
+        await scheduler.push("client", b"y" * 1024)
+    while scheduler.queue_depth:
+        await asyncio.sleep(0.01)
+    elapsed = loop.time() - start
+    scheduler.close()
+    expected = max(0, size - burst_bytes) / rate
+    return (f"rate: {size} bytes at {rate:.0f} B/s with a {burst_bytes} byte burst took "
+            f"{elapsed:.2f}s (expected {expected:.2f}s)")
+
+
+async def run(pty_rate: float, paste_size: int):
+    import server
+
+    print(await burst(server, pty_rate))
+    for shared in (True, False):
+        latencies = sorted(await paste_vs_typist(server, pty_rate, paste_size, shared))
+        label = "shared FIFO" if shared else "turns"
+        print(f"paste {paste_size // 1024} KB, {len(latencies):3} keystrokes meanwhile, latency with "
+              f"{label:>11}: p50 {statistics.median(latencies):6.1f} ms  max {latencies[-1]:6.1f} ms")
+    print(await rate_limit(server, rate=20000, burst_bytes=16384, size=65536))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pty-mbps", type=float, default=0.5, help="simulated PTY input rate, MB/s")
+    parser.add_argument("--paste", type=int, default=256 * 1024, help="paste size in bytes")
+    args = parser.parse_args()
+    asyncio.run(run(args.pty_mbps * 1e6, args.paste))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Time from a viewer joining the shared session to its first screen frame.
+
+Compares snapshots drawn from the server-side screen model against asking
+tmux (capture-pane), with increasing amounts of scrollback in the pane, on a
+scratch tmux server.
+
+Usage: python3 bench/join_latency.py [--joins 50] [--history 0,1000,10000]
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from bench.common import FakeViewer, scratch_tmux  # noqa: E402
+
+SESSION = "joinbench"
+
+
+async def join_times(server, hub, joins: int) -> list:
+    times = []
+    for _ in range(joins):
+        viewer = FakeViewer(server.BINARY_PROTOCOL)
+        start = time.perf_counter()
+        await hub.add_client(viewer, remote="bench")
+        await asyncio.wait_for(viewer.screen.wait(), 5)
+        times.append((viewer.screen_at - start) * 1000)
+        hub.remove_client(viewer)
+    return times
+
+
+async def run(joins: int, histories: list):
+    import server
+
+    server.IDLE_DETACH_SECONDS = 0
+    if not server.SCREEN_MODEL:
+        print("pyte is not installed; only the tmux path can be measured")
+    await server.tmux("new-session", "-d", "-s", SESSION, "-x", "80", "-y", "24")
+    await server.tmux("set-option", "-t", SESSION, "history-limit", str(max(histories) + 100))
+    hub = server.SharedTerminalSession.acquire(SESSION)
+    await hub.add_client(FakeViewer(server.BINARY_PROTOCOL), remote="bench")
+
+    print(f"{'history':>8} {'source':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    filled = 0
+    for history in histories:
+        if history > filled:
+            await hub.write(f"clear; seq 1 {history - filled}\r".encode())
+            filled = history
+            await asyncio.sleep(1 + history / 20000)
+        for source in ("model", "tmux"):
+            server.SCREEN_MODEL = source == "model" and server.pyte is not None
+            if source == "tmux":
+                hub._screen = None
+            else:
+                hub._rebuild_screen_later(quiet=0)
+                await asyncio.sleep(0.5)
+                if not hub.has_screen:
+                    continue
+            times = sorted(await join_times(server, hub, joins))
+            p99 = times[min(len(times) - 1, int(len(times) * 0.99))]
+            print(f"{history:>8} {source:>7} {statistics.median(times):8.2f} {p99:8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--joins", type=int, default=50, help="joins per measurement")
+    parser.add_argument("--history", default="0,1000,10000",
+                        help="comma-separated scrollback line counts")
+    args = parser.parse_args()
+
+    with scratch_tmux():
+        asyncio.run(run(args.joins, [int(n) for n in args.history.split(",")]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+"""
+Load generation against a real server.py process, with results as JSON.
+
+Starts server.py on a free local port with its TLS certificate generated
+into a temp dir and its tmux server on a scratch socket (TMUX_TMPDIR), so
+nothing touches the real server or sessions. Simulated viewers and typists
+then connect over WebSockets and run these workloads in turn:
+
+  echo        --typists typists send echo probes every --interval while
+              --viewers viewers watch: round trip and the server's stages
+              (see EchoProbes), on /terminal and on /terminal/private
+  bulk        `seq 1 --lines` in the shared session with --viewers viewers:
+              time until every viewer has it all, and bytes/s delivered
+  paste       a --paste-size paste into the shared session while a typist
+              probes a private shell: paste MB/s and the typist's round trip
+  join        --joiners viewers connect to /terminal at once: time to each
+              one's first screen
+  flood       --viewers viewers on /terminal/private, each running `seq`:
+              private-session throughput
+
+For each workload the server's and the tmux server's CPU (% of one core)
+and the server's peak RSS are reported too. Results are printed and written
+to --out as JSON, and --compare prints the change from an earlier run.
+
+Usage: python3 bench/loadgen.py [--viewers 10] [--typists 4] [--only echo,bulk]
+                                [--out results.json] [--compare base.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SERVER = Path(__file__).resolve().parent.parent / "server.py"
+WORKLOADS = ("echo", "bulk", "paste", "join", "flood")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentiles(samples: list) -> dict:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    pick = lambda fraction: round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))], 3)
+    return {"p50": pick(0.5), "p99": pick(0.99), "max": round(ordered[-1], 3), "count": len(ordered)}
+
+
+class ProcessMonitor:
+    """CPU time and peak RSS of a set of processes, from /proc or ps."""
+
+    def __init__(self, pids: dict):
+        self.pids = pids  # name -> pid
+        self.peak_rss = {name: 0 for name in pids}
+        self._task = None
+
+    def cpu(self) -> dict:
+        return {name: self._sample(pid)[0] for name, pid in self.pids.items()}
+
+    def _sample(self, pid: int) -> tuple:
+        """(CPU seconds, RSS bytes) of a process."""
+        stat = Path(f"/proc/{pid}/stat")
+        if stat.exists():
+            fields = stat.read_text().rsplit(")", 1)[1].split()
+            ticks = os.sysconf("SC_CLK_TCK")
+            return (int(fields[11]) + int(fields[12])) / ticks, int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+        out = subprocess.run(["ps", "-o", "rss=,time=", "-p", str(pid)],
+                             capture_output=True, text=True).stdout.split()
+        if len(out) < 2:
+            return 0.0, 0
+        seconds = 0.0
+        days, _, clock = out[1].rpartition("-")
+        for part in clock.split(":"):
+            seconds = seconds * 60 + float(part)
+        return seconds + int(days or 0) * 86400, int(out[0]) * 1024
+
+    async def _watch(self):
+        while True:
+            for name, pid in self.pids.items():
+                self.peak_rss[name] = max(self.peak_rss[name], self._sample(pid)[1])
+            await asyncio.sleep(0.2)
+
+    def start(self):
+        self.peak_rss = {name: 0 for name in self.pids}
+        self._task = asyncio.create_task(self._watch())
+
+    def stop(self):
+        self._task.cancel()
+
+
+class Viewer:
+    """A binary-mode client that counts what it receives and watches for a marker."""
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.bytes = 0
+        self.frames = 0
+        self.first_screen = asyncio.Event()
+        self.controls = asyncio.Queue()
+        self._tail = b""
+        self._marker = None
+        self._seen = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        import aiohttp
+
+        async for msg in self.ws:
+            if msg.type == aiohttp.WSMsgType.BINARY:
+                self.bytes += len(msg.data)
+                self.frames += 1
+                self.first_screen.set()
+                if self._marker:
+                    window = self._tail + msg.data
+                    if self._marker in window:
+                        self._seen.set()
+                    self._tail = window[-len(self._marker):]
+            elif msg.type == aiohttp.WSMsgType.TEXT:
+                await self.controls.put(json.loads(msg.data))
+
+    def expect(self, marker: bytes):
+        self._marker = marker
+        self._tail = b""
+        self._seen.clear()
+
+    async def seen(self, timeout: float):
+        await asyncio.wait_for(self._seen.wait(), timeout)
+
+    async def close(self):
+        await self.ws.close()
+        self._task.cancel()
+
+
+class Bench:
+    def __init__(self, base: str, monitor: ProcessMonitor, args):
+        self.base = base
+        self.monitor = monitor
+        self.args = args
+        self.http = None
+        self.ssl = ssl.create_default_context()
+        self.ssl.check_hostname = False
+        self.ssl.verify_mode = ssl.CERT_NONE
+
+    async def connect(self, path: str) -> Viewer:
+        ws = await self.http.ws_connect(f"{self.base}{path}?cols=120&rows=40", ssl=self.ssl,
+                                        protocols=("termlinkky.binary",), max_msg_size=0)
+        return Viewer(ws)
+
+    async def measured(self, name: str, workload) -> dict:
+        """Run a workload coroutine with CPU and RSS measured around it."""
+        loop = asyncio.get_running_loop()
+        self.monitor.start()
+        cpu, started = self.monitor.cpu(), loop.time()
+        result = await workload
+        elapsed = loop.time() - started
+        cpu_after = self.monitor.cpu()
+        self.monitor.stop()
+        result["seconds"] = round(elapsed, 3)
+        for proc, seconds in cpu_after.items():
+            result[f"{proc}_cpu_pct"] = round((seconds - cpu[proc]) / elapsed * 100, 1)
+            result[f"{proc}_peak_rss_mb"] = round(self.monitor.peak_rss[proc] / 1e6, 1)
+        print(f"{name}: {json.dumps(result)}", flush=True)
+        return result
+
+    async def probe(self, viewer: Viewer, probe_id: int, key: str) -> tuple:
+        """Send an echo probe; returns (round trip ms, the server's reply)."""
+        started = time.perf_counter()
+        await viewer.ws.send_str(json.dumps({"type": "probe", "id": probe_id, "data": key}))
+        while True:
+            reply = await asyncio.wait_for(viewer.controls.get(), 10)
+            if reply.get("type") == "probe" and reply.get("id") == probe_id:
+                return (time.perf_counter() - started) * 1000, reply
+
+    async def typist(self, viewer: Viewer, key: str, probes: int, stop: asyncio.Event = None) -> dict:
+        samples = {"round_trip": [], "queue": [], "echo": [], "output": [], "network": []}
+        timeouts = 0
+        i = 0
+        while (stop is None and i < probes) or (stop is not None and not stop.is_set()):
+            round_trip, reply = await self.probe(viewer, i, key)
+            if reply.get("timeout"):
+                timeouts += 1
+            else:
+                samples["round_trip"].append(round_trip)
+                samples["network"].append(round_trip - reply["server_ms"])
+                for stage, ms in reply["stages_ms"].items():
+                    samples[stage].append(ms)
+            i += 1
+            await asyncio.sleep(self.args.interval)
+        await viewer.ws.send_bytes(b"\x15")  # Clear the line
+        return {"samples": samples, "timeouts": timeouts}
+
+    @staticmethod
+    def merge(results: list) -> dict:
+        merged = {}
+        for result in results:
+            for stage, samples in result["samples"].items():
+                merged.setdefault(stage, []).extend(samples)
+        summary = {f"{stage}_ms": percentiles(samples) for stage, samples in merged.items()}
+        summary["timeouts"] = sum(result["timeouts"] for result in results)
+        return summary
+
+    async def echo(self, path: str) -> dict:
+        args = self.args
+        watchers = [await self.connect("/terminal") for _ in range(args.viewers)]
+        typists, opened = [], []
+        for _ in range(args.typists):
+            started = time.perf_counter()
+            typist = await self.connect(path)
+            await asyncio.wait_for(typist.first_screen.wait(), 30)
+            opened.append((time.perf_counter() - started) * 1000)
+            typists.append(typist)
+        await asyncio.sleep(1)
+        # A letter each, so one typist's probe doesn't match another's echo
+        results = await asyncio.gather(*(
+            self.typist(typist, chr(ord("a") + i % 26), args.probes) for i, typist in enumerate(typists)))
+        for viewer in watchers + typists:
+            await viewer.close()
+        return {"typists": args.typists, "viewers": args.viewers, "first_output_ms": percentiles(opened),
+                **self.merge(results)}
+
+    async def bulk(self) -> dict:
+        args = self.args
+        viewers = [await self.connect("/terminal") for _ in range(args.viewers)]
+        for viewer in viewers:
+            await asyncio.wait_for(viewer.first_screen.wait(), 30)
+        await asyncio.sleep(1)
+        # The marker is computed by the shell, so the echoed command line doesn't match it
+        for viewer in viewers:
+            viewer.expect(b"BULK-2-DONE")
+        received = [viewer.bytes for viewer in viewers]
+        started = time.perf_counter()
+        await viewers[0].ws.send_bytes(f"seq 1 {args.lines}; echo BULK-$((1+1))-DONE\r".encode())
+        done = []
+        for viewer in viewers:
+            await viewer.seen(120)
+            done.append((time.perf_counter() - started) * 1000)
+        elapsed = time.perf_counter() - started
+        delivered = sum(viewer.bytes - before for viewer, before in zip(viewers, received))
+        await viewers[0].ws.send_bytes(b"clear\r")
+        for viewer in viewers:
+            await viewer.close()
+        return {"viewers": args.viewers, "lines": args.lines, "done_ms": percentiles(done),
+                "delivered_mb_per_s": round(delivered / elapsed / 1e6, 3),
+                "frames": sum(viewer.frames for viewer in viewers)}
+
+    async def paste(self) -> dict:
+        args = self.args
+        size = args.paste_size
+        paster = await self.connect("/terminal")
+        typist = await self.connect("/terminal/private")
+        await asyncio.wait_for(paster.first_screen.wait(), 30)
+        await asyncio.wait_for(typist.first_screen.wait(), 30)
+        await asyncio.sleep(1)
+        # head reads exactly the paste on a raw, non-echoing tty; wc's count marks the end
+        paster.expect(f"PASTED {size}".encode())
+        await paster.ws.send_bytes(
+            f"stty raw -echo; printf 'PASTED %s\\n' $(head -c {size} | wc -c); stty sane\r".encode())
+        await asyncio.sleep(0.5)
+        stop = asyncio.Event()
+        typing = asyncio.create_task(self.typist(typist, "p", 0, stop))
+        block = (b"x" * 63 + b"\r") * 256
+        started = time.perf_counter()
+        for offset in range(0, size, len(block)):
+            await paster.ws.send_bytes(block[:size - offset])
+        await paster.seen(120)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        result = await typing
+        await paster.close()
+        await typist.close()
+        return {"paste_bytes": size, "paste_mb_per_s": round(size / elapsed / 1e6, 3),
+                **{f"typist_{key}": value for key, value in self.merge([result]).items()}}
+
+    async def join(self) -> dict:
+        args = self.args
+
+        async def join_one():
+            started = time.perf_counter()
+            viewer = await self.connect("/terminal")
+            await asyncio.wait_for(viewer.first_screen.wait(), 60)
+            return viewer, (time.perf_counter() - started) * 1000
+
+        joined = await asyncio.gather(*(join_one() for _ in range(args.joiners)))
+        for viewer, _ in joined:
+            await viewer.close()
+        return {"joiners": args.joiners, "first_screen_ms": percentiles([ms for _, ms in joined])}
+
+    async def flood(self) -> dict:
+        args = self.args
+        viewers = [await self.connect("/terminal/private") for _ in range(args.viewers)]
+        for viewer in viewers:
+            await asyncio.wait_for(viewer.first_screen.wait(), 30)
+            viewer.expect(b"FLOOD-2-DONE")
+        await asyncio.sleep(1)
+        received = [viewer.bytes for viewer in viewers]
+        started = time.perf_counter()
+        for viewer in viewers:
+            await viewer.ws.send_bytes(f"seq 1 {args.lines}; echo FLOOD-$((1+1))-DONE\r".encode())
+        done = []
+        for viewer in viewers:
+            await viewer.seen(120)
+            done.append((time.perf_counter() - started) * 1000)
+        elapsed = time.perf_counter() - started
+        delivered = sum(viewer.bytes - before for viewer, before in zip(viewers, received))
+        for viewer in viewers:
+            await viewer.close()
+        return {"sessions": args.viewers, "lines": args.lines, "done_ms": percentiles(done),
+                "delivered_mb_per_s": round(delivered / elapsed / 1e6, 3)}
+
+    async def run(self, only: list) -> dict:
+        import aiohttp
+
+        results = {}
+        async with aiohttp.ClientSession() as self.http:
+            for name in only:
+                if name == "echo":
+                    results["echo_shared"] = await self.measured("echo_shared", self.echo("/terminal"))
+                    results["echo_private"] = await self.measured(
+                        "echo_private", self.echo("/terminal/private"))
+                else:
+                    results[name] = await self.measured(name, getattr(self, name)())
+                await asyncio.sleep(1)
+        return results
+
+
+def start_server(workdir: Path, port: int, shell: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.pop("TMUX", None)
+    env.update({
+        "TMUX_TMPDIR": str(workdir),
+        "TERMLINKKY_HOST": "127.0.0.1",
+        "TERMLINKKY_PORT": str(port),
+        "TERMLINKKY_CERT_DIR": str(workdir / "certs"),
+        "TERMLINKKY_BONJOUR": "0",
+        "SHELL": shell,
+        "PYTHONUNBUFFERED": "1",
+    })
+    log = open(workdir / "server.log", "w")
+    return subprocess.Popen([sys.executable, str(SERVER)], env=env, stdout=log,
+                            stderr=subprocess.STDOUT, cwd=SERVER.parent)
+
+
+async def wait_healthy(base: str, proc: subprocess.Popen, timeout: float = 60):
+    import aiohttp
+
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as http:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError("server exited during startup")
+            try:
+                async with http.get(f"{base}/health", ssl=ctx) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("server did not become healthy")
+
+
+def tmux_server_pid(workdir: Path) -> int:
+    env = dict(os.environ, TMUX_TMPDIR=str(workdir))
+    env.pop("TMUX", None)
+    out = subprocess.run(["tmux", "display-message", "-p", "#{pid}"], env=env,
+                         capture_output=True, text=True).stdout.strip()
+    return int(out) if out.isdigit() else None
+
+
+def git_revision() -> dict:
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=SERVER.parent, capture_output=True,
+                              text=True).stdout.strip()
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain", "--", "."))}
+
+
+def compare(base: dict, results: dict):
+    """Print each number that changed from the base run, with the change in %."""
+    def leaves(tree, prefix=""):
+        for key, value in (tree or {}).items():
+            if isinstance(value, dict):
+                yield from leaves(value, f"{prefix}{key}.")
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield f"{prefix}{key}", value
+
+    old = dict(leaves(base["results"]))
+    print(f"\ncompared with {base['meta']['git']['commit'][:12]}:")
+    for key, value in leaves(results):
+        if key in old and old[key] != value:
+            change = f"{(value - old[key]) / old[key] * 100:+.1f}%" if old[key] else "new"
+            print(f"  {key:<45} {old[key]:>12} -> {value:<12} {change}")
+
+
+async def main_async(args, workdir: Path) -> dict:
+    import aiohttp
+
+    port = free_port()
+    base = f"https://127.0.0.1:{port}"
+    proc = start_server(workdir, port, args.shell)
+    try:
+        await wait_healthy(base, proc)
+        # The shared session (and with it the tmux server) starts with its first viewer
+        bench = Bench(base, None, args)
+        async with aiohttp.ClientSession() as bench.http:
+            viewer = await bench.connect("/terminal")
+            await asyncio.wait_for(viewer.first_screen.wait(), 30)
+            await viewer.close()
+        pids = {"server": proc.pid}
+        tmux_pid = tmux_server_pid(workdir)
+        if tmux_pid:
+            pids["tmux"] = tmux_pid
+        bench.monitor = ProcessMonitor(pids)
+        return await bench.run(args.only)
+    except Exception:
+        print((workdir / "server.log").read_text()[-3000:], file=sys.stderr)
+        raise
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--viewers", type=int, default=10, help="watching viewers / private sessions")
+    parser.add_argument("--typists", type=int, default=4, help="typists sending echo probes")
+    parser.add_argument("--joiners", type=int, default=30, help="viewers joining at once")
+    parser.add_argument("--probes", type=int, default=40, help="echo probes per typist")
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between a typist's probes")
+    parser.add_argument("--lines", type=int, default=200000, help="lines of seq output for bulk/flood")
+    parser.add_argument("--paste-size", type=int, default=1024 * 1024, help="paste size in bytes")
+    parser.add_argument("--shell", default="/bin/sh", help="shell for tmux and private sessions")
+    parser.add_argument("--only", default=",".join(WORKLOADS), help="comma-separated workloads to run")
+    parser.add_argument("--out", help="write results here as JSON")
+    parser.add_argument("--compare", help="results JSON of an earlier run to compare with")
+    args = parser.parse_args()
+    args.only = [name for name in args.only.split(",") if name]
+    unknown = set(args.only) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(sorted(unknown))}")
+
+    workdir = Path(tempfile.mkdtemp(prefix="termlinkky-load-"))
+    try:
+        results = asyncio.run(main_async(args, workdir))
+    finally:
+        env = dict(os.environ, TMUX_TMPDIR=str(workdir))
+        env.pop("TMUX", None)
+        subprocess.run(["tmux", "kill-server"], env=env, capture_output=True)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "git": git_revision(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("out", "compare")},
+        },
+        "results": results,
+    }
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2) + "\n")
+        print(f"results written to {args.out}")
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text()), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Server cost of watching several sessions: one WebSocket each vs one /mux socket.
+
+Starts the server's WebSocket handlers in this process, over TLS with a key
+like the one the server generates (RSA 4096), against a scratch tmux server
+holding --sessions sessions. A client in a child process then opens every
+session, either over its own /terminal/{session} WebSocket or as channels
+of a single /mux WebSocket, waits for each one's snapshot, and keeps the
+connections open for --hold seconds with a WebSocket ping per connection
+every second.
+
+Server CPU (this process) is reported for opening the sessions and per
+second while they are held.
+
+Usage: python3 bench/mux_connections.py [--sessions 8] [--hold 10]
+"""
+
+import argparse
+import asyncio
+import json
+import resource
+import ssl
+import struct
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from bench.common import scratch_tmux  # noqa: E402
+
+SESSION = "muxbench"
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def client(url: str, mode: str, sessions: int, hold: float):
+    """Child process: open the sessions, say "ready", hold, then close."""
+    import aiohttp
+
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    header = struct.Struct("!BH")
+    names = [f"{SESSION}{i}" for i in range(sessions)]
+    start = time.perf_counter()
+    async with aiohttp.ClientSession() as http:
+        sockets = []
+        if mode == "separate":
+            for name in names:
+                ws = await http.ws_connect(f"{url}/terminal/{name}", ssl=ctx, heartbeat=1.0,
+                                           protocols=("termlinkky.binary",))
+                sockets.append(ws)
+                while (await ws.receive()).type != aiohttp.WSMsgType.BINARY:
+                    pass  # Control messages ahead of the snapshot
+        else:
+            ws = await http.ws_connect(f"{url}/mux", ssl=ctx, heartbeat=1.0,
+                                       protocols=("termlinkky.mux.1",))
+            sockets.append(ws)
+            for channel, name in enumerate(names, 1):
+                open_message = json.dumps({"type": "open", "session": name}).encode()
+                await ws.send_bytes(header.pack(1, channel) + open_message)
+            pending = set(range(1, sessions + 1))
+            while pending:
+                msg = await ws.receive()
+                kind, channel = header.unpack_from(msg.data)
+                if kind == 6:  # MUX_SNAPSHOT
+                    pending.discard(channel)
+        print(f"ready {time.perf_counter() - start:.3f}", flush=True)
+
+        async def drain(ws):
+            async for _ in ws:
+                pass
+
+        readers = [asyncio.create_task(drain(ws)) for ws in sockets]
+        await asyncio.sleep(hold)
+        for ws in sockets:
+            await ws.close()
+        await asyncio.gather(*readers, return_exceptions=True)
+
+
+async def measure(url: str, mode: str, sessions: int, hold: float) -> dict:
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, __file__, "--client", url, "--mode", mode,
+        "--sessions", str(sessions), "--hold", str(hold),
+        stdout=subprocess.PIPE,
+    )
+    cpu0 = cpu_seconds()
+    line = (await proc.stdout.readline()).decode().split()
+    cpu1 = cpu_seconds()
+    await proc.wait()
+    cpu2 = cpu_seconds()
+    return {
+        "mode": mode,
+        "connections": sessions if mode == "separate" else 1,
+        "open_s": float(line[1]) if line else None,
+        "open_cpu_ms": (cpu1 - cpu0) * 1000,
+        "hold_cpu_ms_per_s": (cpu2 - cpu1) * 1000 / hold,
+    }
+
+
+async def run(sessions: int, hold: float, workdir: Path):
+    import server
+    from aiohttp import web
+
+    server.IDLE_DETACH_SECONDS = 0
+    for i in range(sessions):
+        await server.tmux("new-session", "-d", "-s", f"{SESSION}{i}", "-x", "80", "-y", "24")
+    cert, key = workdir / "server.crt", workdir / "server.key"
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:4096", "-keyout", str(key),
+                    "-out", str(cert), "-days", "1", "-nodes", "-subj", "/CN=bench"],
+                   check=True, capture_output=True)
+    ssl_ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    ssl_ctx.load_cert_chain(str(cert), str(key))
+
+    app = web.Application()
+    app.router.add_get("/mux", server.websocket_mux_handler)
+    app.router.add_get("/terminal/{session}", server.websocket_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0, ssl_context=ssl_ctx)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f"https://127.0.0.1:{port}"
+
+    print(f"{'mode':>9} {'sockets':>8} {'open s':>7} {'open cpu ms':>12} {'held cpu ms/s':>14}")
+    for mode in ("separate", "mux"):
+        r = await measure(url, mode, sessions, hold)
+        print(f"{r['mode']:>9} {r['connections']:>8} {r['open_s']:7.2f} {r['open_cpu_ms']:12.1f} "
+              f"{r['hold_cpu_ms_per_s']:14.2f}")
+        await asyncio.sleep(1)
+    await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=8, help="sessions to watch")
+    parser.add_argument("--hold", type=float, default=10.0, help="seconds to keep them open")
+    parser.add_argument("--client", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.client:
+        asyncio.run(client(args.client, args.mode, args.sessions, args.hold))
+        return
+
+    with scratch_tmux() as tmpdir:
+        asyncio.run(run(args.sessions, args.hold, tmpdir))
+
+
+if __name__ == "__main__":
+    main()
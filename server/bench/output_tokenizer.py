@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Fuzz and throughput test for OutputTokenizer, which cuts output frames.
+
+The fuzzer builds random terminal output: text, UTF-8 characters from 1 to 4
+bytes, CSI, OSC, DCS and two-byte escapes. It splits the output into
+randomly sized reads, feeds them to the tokenizer, and checks two things:
+  - the frames joined back together equal the input;
+  - no frame ends inside an escape sequence or a UTF-8 character. A
+    byte-at-a-time reference parser decides this. The only exception is a
+    sequence that outgrew max_hold.
+
+The throughput test feeds a few typical kinds of output in PTY-sized reads
+and reports MB/s, with incremental UTF-8 decoding as a yardstick.
+
+Usage: python3 bench/output_tokenizer.py [--cases 2000] [--seed N] [--mb 32]
+"""
+
+import argparse
+import codecs
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+GROUND, UTF8, ESC, ESC_INTERMEDIATE, CSI, CSI_INTERMEDIATE, STRING, STRING_ESC = range(8)
+
+
+def safe_positions(data: bytes) -> list:
+    """safe[i] is True if data can be cut before byte i (reference parser)."""
+    safe = [True] * (len(data) + 1)
+    state, pending = GROUND, 0
+    for i, byte in enumerate(data):
+        if state == UTF8:
+            if 0x80 <= byte <= 0xBF:
+                pending -= 1
+                if pending == 0:
+                    state = GROUND
+                safe[i + 1] = state == GROUND
+                continue
+            state = GROUND  # Invalid sequence; handle the byte afresh
+        if state == GROUND:
+            if byte == 0x1B:
+                state = ESC
+            elif 0xC0 <= byte <= 0xF7:
+                state, pending = UTF8, 1 if byte < 0xE0 else 2 if byte < 0xF0 else 3
+        elif state == ESC:
+            if byte == 0x5B:
+                state = CSI
+            elif byte in b"]PX^_":
+                state = STRING
+            elif 0x20 <= byte <= 0x2F:
+                state = ESC_INTERMEDIATE
+            elif byte != 0x1B:
+                state = GROUND
+        elif state == ESC_INTERMEDIATE:
+            if not 0x20 <= byte <= 0x2F:
+                state = GROUND
+        elif state in (CSI, CSI_INTERMEDIATE):
+            if state == CSI and 0x30 <= byte <= 0x3F:
+                pass
+            elif 0x20 <= byte <= 0x2F:
+                state = CSI_INTERMEDIATE
+            else:
+                state = GROUND
+        elif state == STRING:
+            if byte == 0x07:
+                state = GROUND
+            elif byte == 0x1B:
+                state = STRING_ESC
+        elif state == STRING_ESC:
+            state = GROUND
+        safe[i + 1] = state == GROUND
+    return safe
+
+
+def random_output(rng: random.Random, tokens: int) -> bytes:
+    """Valid terminal output made of random text, characters and sequences."""
+    parts = []
+    for _ in range(tokens):
+        kind = rng.random()
+        if kind < 0.3:
+            parts.append("".join(rng.choice("abcdefgh xyz") for _ in range(rng.randint(1, 20))).encode())
+        elif kind < 0.45:
+            parts.append(rng.choice(["é", "ß", "ж", "€", "中", "文", "█", "🙂", "🚀", "𝄞"]).encode())
+        elif kind < 0.5:
+            parts.append(rng.choice([b"\r\n", b"\r", b"\n", b"\x08", b"\x07", b"\t"]))
+        elif kind < 0.7:
+            params = ";".join(str(rng.randint(0, 255)) for _ in range(rng.randint(0, 5)))
+            private = rng.choice(["", "", "?", ">"])
+            final = rng.choice("mHJKABCDhlrtq")
+            intermediate = rng.choice(["", "", "", " ", "$"])
+            parts.append(f"\x1b[{private}{params}{intermediate}{final}".encode())
+        elif kind < 0.8:
+            title = "".join(rng.choice("title ü🙂") for _ in range(rng.randint(0, 40)))
+            end = rng.choice(["\x07", "\x1b\\"])
+            parts.append(f"\x1b]{rng.choice([0, 2, 8, 52])};{title}{end}".encode())
+        elif kind < 0.85:
+            body = "".join(rng.choice("q#;0123456789") for _ in range(rng.randint(0, 60)))
+            parts.append(f"\x1bP{body}\x1b\\".encode())
+        else:
+            parts.append(rng.choice([b"\x1b7", b"\x1b8", b"\x1b=", b"\x1b>", b"\x1b(B",
+                                     b"\x1b)0", b"\x1bM", b"\x1bD", b"\x1bc", b"\x1b#8"]))
+    return b"".join(parts)
+
+
+def split_randomly(rng: random.Random, data: bytes) -> list:
+    reads, pos = [], 0
+    while pos < len(data):
+        size = rng.choice([1, 2, 3, rng.randint(1, 64), rng.randint(1, 4096)])
+        reads.append(data[pos:pos + size])
+        pos += size
+    return reads
+
+
+def fuzz(server, cases: int, seed: int) -> int:
+    rng = random.Random(seed)
+    failures = 0
+    for case in range(cases):
+        data = random_output(rng, rng.randint(1, 400))
+        max_hold = rng.choice([16, 64, 65536])
+        tokenizer = server.OutputTokenizer(max_hold=max_hold)
+        frames = [tokenizer.feed(chunk) for chunk in split_randomly(rng, data)]
+        frames.append(tokenizer.flush())
+        if b"".join(frames) != data:
+            print(f"case {case}: output differs from input")
+            failures += 1
+            continue
+        safe = safe_positions(data)
+        cut = last_safe = 0
+        for frame in frames[:-1]:
+            for i in range(cut, cut + len(frame) + 1):
+                if safe[i]:
+                    last_safe = i
+            cut += len(frame)
+            if not safe[cut] and cut - last_safe <= max_hold:
+                print(f"case {case}: unsafe cut at {cut}: {data[max(0, cut - 20):cut]!r} | "
+                      f"{data[cut:cut + 20]!r}")
+                failures += 1
+                break
+    return failures
+
+
+def corpus(kind: str, size: int) -> bytes:
+    rng = random.Random(kind)
+    lines = []
+    total = 0
+    while total < size:
+        if kind == "log":
+            line = f"2024-05-01 12:{rng.randint(0, 59):02} INFO worker[{rng.randint(1, 99)}] " \
+                   f"processed request {rng.randint(0, 10**6)} in {rng.random():.3f}s\r\n"
+        elif kind == "color":
+            line = "".join(f"\x1b[{rng.choice([0, 1, 31, 32, 34, 36])};{rng.randint(40, 47)}m"
+                           f"{rng.choice(['src', 'README.md', 'build', 'a.out'])}\x1b[0m  "
+                           for _ in range(6)) + "\r\n"
+        elif kind == "utf8":
+            line = "".join(rng.choice("日本語のテキスト中文字符한국어émoji🙂🚀") for _ in range(40)) + "\r\n"
+        else:  # tui: cursor addressing and line erases, like top or vim redraws
+            line = "".join(f"\x1b[{rng.randint(1, 50)};{rng.randint(1, 80)}H\x1b[K"
+                           f"{rng.randint(0, 9999):>6} {rng.random() * 100:5.1f}" for _ in range(4))
+        encoded = line.encode()
+        lines.append(encoded)
+        total += len(encoded)
+    return b"".join(lines)
+
+
+def throughput(server, megabytes: int):
+    print(f"\n{'output':>8} {'read':>6} {'tokenizer MB/s':>15} {'utf-8 decode MB/s':>18} {'held reads':>11}")
+    for kind in ("log", "color", "utf8", "tui"):
+        data = corpus(kind, megabytes * 1024 * 1024)
+        for read_size in (4096, 65536):
+            reads = [data[i:i + read_size] for i in range(0, len(data), read_size)]
+            tokenizer = server.OutputTokenizer()
+            held = 0
+            start = time.perf_counter()
+            for chunk in reads:
+                tokenizer.feed(chunk)
+                held += tokenizer.held > 0
+            tokenizer_time = time.perf_counter() - start
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            start = time.perf_counter()
+            for chunk in reads:
+                decoder.decode(chunk)
+            decode_time = time.perf_counter() - start
+            mb = len(data) / 1e6
+            print(f"{kind:>8} {read_size:>6} {mb / tokenizer_time:15.0f} {mb / decode_time:18.0f} "
+                  f"{held / len(reads):10.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cases", type=int, default=2000, help="fuzz cases")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--mb", type=int, default=32, help="MB of each kind of output to time")
+    args = parser.parse_args()
+
+    import server
+
+    failures = fuzz(server, args.cases, args.seed)
+    print(f"fuzz: {args.cases} cases, {failures} failures")
+    throughput(server, args.mb)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
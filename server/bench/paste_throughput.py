@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Large pastes into the shared session: integrity, time and event loop stalls.
+
+Each paste is written through SharedTerminalSession.write, either as one
+message or as several, the way a client might send it. The pane runs
+`head -c N` on a raw, non-echoing tty, and the bench checks that the file
+it writes holds exactly the pasted bytes. While the paste is going through,
+a ticker task measures how late the event loop wakes it. Late wakeups are
+what other clients would feel as a frozen terminal. tmux is a scratch
+server.
+
+Usage: python3 bench/paste_throughput.py [--sizes 65536,262144,1048576]
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from bench.common import FakeViewer, scratch_tmux, ticker  # noqa: E402
+
+SESSION = "pastebench"
+
+
+def paste_text(size: int) -> bytes:
+    """Printable lines ending in CR, as a terminal sends a pasted text."""
+    rng = random.Random(size)
+    words = ["paste", "déjà", "vu", "λ", "0123456789", "{json: true}", "日本"]
+    out = bytearray()
+    while len(out) < size:
+        out += " ".join(rng.choice(words) for _ in range(rng.randint(1, 12))).encode() + b"\r"
+    return bytes(out[:size])
+
+
+async def paste(server, hub, size: int, message_size: int, out: Path) -> dict:
+    data = paste_text(size)
+    out.unlink(missing_ok=True)
+    await server.tmux("respawn-pane", "-k", "-t", f"={SESSION}:",
+                      f"stty raw -echo; head -c {size} > {out}")
+    await asyncio.sleep(0.5)
+    stop = asyncio.Event()
+    lags = []
+    tick = asyncio.create_task(ticker(stop, lags))
+    start = time.perf_counter()
+    for i in range(0, size, message_size):
+        await hub.write(data[i:i + message_size])
+    queued = time.perf_counter() - start
+    while not out.exists() or out.stat().st_size < size:
+        await asyncio.sleep(0.01)
+        if time.perf_counter() - start > 60:
+            break
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick
+    received = out.read_bytes() if out.exists() else b""
+    return {
+        "size": size,
+        "message": message_size,
+        "intact": received == data,
+        "queued_ms": queued * 1000,
+        "done_ms": elapsed * 1000,
+        "mb_per_sec": size / elapsed / 1e6,
+        "max_lag_ms": max(lags) * 1000 if lags else 0.0,
+    }
+
+
+async def run(sizes: list, workdir: Path):
+    import server
+
+    server.IDLE_DETACH_SECONDS = 0
+    await server.tmux("new-session", "-d", "-s", SESSION, "-x", "80", "-y", "24")
+    await server.tmux("set-option", "-t", SESSION, "remain-on-exit", "on")
+    hub = server.SharedTerminalSession.acquire(SESSION)
+    await hub.add_client(FakeViewer(), remote="bench")
+    await asyncio.sleep(0.5)
+
+    print(f"{'size':>8} {'message':>8} {'intact':>6} {'queued ms':>10} {'done ms':>8} "
+          f"{'MB/s':>6} {'max loop lag ms':>16}")
+    for size in sizes:
+        for message_size in (size, 16 * 1024):
+            r = await paste(server, hub, size, message_size, workdir / "paste.out")
+            print(f"{r['size']:>8} {r['message']:>8} {str(r['intact']):>6} {r['queued_ms']:10.1f} "
+                  f"{r['done_ms']:8.1f} {r['mb_per_sec']:6.2f} {r['max_lag_ms']:16.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="65536,262144,1048576",
+                        help="comma-separated paste sizes in bytes")
+    args = parser.parse_args()
+
+    with scratch_tmux() as tmpdir:
+        asyncio.run(run([int(n) for n in args.sizes.split(",")], tmpdir))
+
+
+if __name__ == "__main__":
+    main()
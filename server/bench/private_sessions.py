@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Event loop lag as the number of private sessions grows.
+
+Opens --counts private TerminalSessions in turn (each with a fake binary
+client), half of them printing a line every 50 ms and half idle at a
+prompt, and while they run, a ticker task measures how late the event loop
+wakes it. Also reports CPU time (the ticker's included) and the output the
+clients got, per second. Lag that grows with the session count is what
+every other client would feel as a frozen terminal.
+
+Usage: python3 bench/private_sessions.py [--counts 1,5,10,20] [--seconds 5] [--shell /bin/sh]
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import statistics
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from bench.common import FakeViewer, ticker  # noqa: E402
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def measure(server, count: int, seconds: float) -> dict:
+    sessions = []
+    for i in range(count):
+        session = server.TerminalSession(FakeViewer(server.BINARY_PROTOCOL))
+        await session.start()
+        if i % 2 == 0:
+            await session.write(b"while :; do echo tick; sleep 0.05; done\r")
+        sessions.append(session)
+    await asyncio.sleep(1)
+    stop = asyncio.Event()
+    lags = []
+    loop = asyncio.get_running_loop()
+    start, cpu = loop.time(), cpu_seconds()
+    received = sum(session.ws.received for session in sessions)
+    tick = asyncio.create_task(ticker(stop, lags))
+    await asyncio.sleep(seconds)
+    stop.set()
+    await tick
+    elapsed, cpu = loop.time() - start, cpu_seconds() - cpu
+    received = sum(session.ws.received for session in sessions) - received
+    for session in sessions:
+        session.stop()
+    lags = sorted(lag * 1000 for lag in lags)
+    return {
+        "sessions": count,
+        "lag_p50_ms": statistics.median(lags),
+        "lag_p99_ms": lags[int(len(lags) * 0.99)],
+        "lag_max_ms": lags[-1],
+        "cpu_ms_per_s": cpu * 1000 / elapsed,
+        "output_bytes_per_s": received / elapsed,
+    }
+
+
+async def run(counts: list, seconds: float):
+    import server
+
+    server._shell_pool = server.ShellPool(size=0)
+    print(f"shell: {os.environ.get('SHELL', '/bin/bash')}")
+    print(f"{'sessions':>8} {'lag p50 ms':>11} {'lag p99 ms':>11} {'lag max ms':>11} "
+          f"{'cpu ms/s':>9} {'output B/s':>11}")
+    for count in counts:
+        r = await measure(server, count, seconds)
+        print(f"{r['sessions']:>8} {r['lag_p50_ms']:11.2f} {r['lag_p99_ms']:11.2f} "
+              f"{r['lag_max_ms']:11.2f} {r['cpu_ms_per_s']:9.1f} {r['output_bytes_per_s']:11.0f}")
+        await asyncio.sleep(0.5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--counts", default="1,5,10,20", help="comma-separated session counts")
+    parser.add_argument("--seconds", type=float, default=5.0, help="seconds to measure each count")
+    parser.add_argument("--shell", default="/bin/sh", help="shell to start instead of $SHELL")
+    args = parser.parse_args()
+    os.environ["SHELL"] = args.shell
+    asyncio.run(run([int(n) for n in args.counts.split(",")], args.seconds))
+
+
+if __name__ == "__main__":
+    main()
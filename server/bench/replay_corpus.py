@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Replays recorded PTY output through the shared session's output path.
+
+bench/corpus/ holds PTY byte streams recorded from real programs (vim
+scrolling, top, compiler warnings, bulk output) plus a synthetic TUI that
+redraws its bottom lines the way Ink-based CLIs do. Each read is stored with
+the time since the previous one.
+
+Replaying one feeds the reads to a SharedTerminalSession hub with no shell
+or tmux behind it: PTY read accounting, OutputTokenizer chunking, the
+OutputCoalescer, the ring, text decoding, and OutputFrame fan-out to
+--viewers binary viewers and --text-viewers text viewers, whose frames are
+built (and deflated, unless --no-compress) for a null transport. The
+coalescer runs on a virtual clock that follows the recorded gaps, so frame
+counts don't depend on how fast the machine is. For each recording it
+reports:
+
+  MB/s         recorded bytes over the time to replay them (best of --repeat)
+  frames       coalesced frames sent to each viewer, and per MB recorded
+  alloc KB/MB  memory allocated per MB recorded, summed from tracemalloc's
+               peak during each read (CPython has no allocation counter; a
+               buffer freed and reused within one read counts once)
+
+--out writes the results as JSON. --record re-records the corpus (the
+recordings depend on this machine's vim, top and gcc).
+
+Usage: python3 bench/replay_corpus.py [--viewers 10] [--only vim-scroll,top] [--out replay.json]
+       python3 bench/replay_corpus.py --record [--only gcc-warnings]
+"""
+
+import argparse
+import asyncio
+import fcntl
+import gzip
+import heapq
+import json
+import os
+import pty
+import random
+import select
+import struct
+import subprocess
+import sys
+import tempfile
+import termios
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from bench.common import FakeViewer  # noqa: E402
+
+CORPUS = Path(__file__).resolve().parent / "corpus"
+SERVER = Path(__file__).resolve().parent.parent / "server.py"
+RECORD = struct.Struct("!II")  # Microseconds since the previous read, length
+COLS, ROWS = 120, 40
+
+
+def warnings_source(functions: int = 300) -> str:
+    """C that compiles with a warning or two per line under -Wall -Wextra."""
+    lines = ["#include <stdio.h>"]
+    for i in range(functions):
+        lines += [
+            f"int f{i}(int a, unsigned b, char *s) {{",
+            f"    int unused{i};",
+            "    if (a < b) return s;",
+            "    printf(\"%d\\n\", s);",
+            "}",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def tui_redraws(frames: int = 1500, seed: int = 0) -> list:
+    """(delay, bytes) reads of an Ink-style TUI: text streams in above a status area
+    that is erased and redrawn a line at a time on every tick."""
+    rng = random.Random(seed)
+    words = ("the", "server", "output", "frame", "client", "session", "tmux", "buffer",
+             "`OutputCoalescer`", "**note**", "returns", "which", "écran", "→", "✓")
+    spinner = "·✢✳✶✻✽"
+    status_lines = 0
+    reads = []
+    for tick in range(frames):
+        out = []
+        # Ink erases its previous render: up a line and clear, for each line
+        out.append("\x1b[2K\x1b[1A" * status_lines + "\x1b[2K\x1b[G")
+        if rng.random() < 0.3:
+            text = " ".join(rng.choice(words) for _ in range(rng.randint(6, 20)))
+            out.append(f"\x1b[38;5;246m⏺\x1b[39m {text}\r\n")
+        status = [
+            f"\x1b[38;5;174m{spinner[tick % len(spinner)]} Thinking… \x1b[39m"
+            f"\x1b[2m({tick // 20}s · ↑ {tick * 7 % 9000} tokens · esc to interrupt)\x1b[22m",
+            "",
+            "\x1b[2m╭" + "─" * (COLS - 2) + "╮\x1b[22m",
+            "\x1b[2m│\x1b[22m > " + " " * (COLS - 5) + "\x1b[2m│\x1b[22m",
+            "\x1b[2m╰" + "─" * (COLS - 2) + "╯\x1b[22m",
+            "  \x1b[2m? for shortcuts\x1b[22m",
+        ]
+        out.append("\r\n".join(status))
+        status_lines = len(status) - 1
+        reads.append((rng.choice((0.05, 0.08, 0.1)), "".join(out).encode()))
+    return reads
+
+
+# Recorded from a real program in a COLS x ROWS PTY: the command, and keys as
+# (seconds to wait, bytes) typed into it. "files" are created in its cwd.
+RECORDINGS = {
+    "vim-scroll": {
+        "command": ["vim", "-u", "NONE", "-N", "-c", "syntax on", "-c", "set number", "server.py"],
+        "files": {"server.py": lambda: SERVER.read_text()},
+        "keys": [(1.0, b"")] + [(0.03, b"j")] * 200 + [(0.08, b"\x06")] * 60
+                + [(0.08, b"\x02")] * 30 + [(0.5, b":q!\r")],
+    },
+    "top": {
+        "command": ["top", "-d", "0.2"],
+        "keys": [(5.0, b"q")],
+    },
+    "gcc-warnings": {
+        "command": ["gcc", "-Wall", "-Wextra", "-fdiagnostics-color=always", "-fsyntax-only", "warn.c"],
+        "files": {"warn.c": warnings_source},
+    },
+    "seq-bulk": {
+        "command": ["seq", "1", "50000"],
+    },
+    "tui-redraw": {
+        "synthetic": tui_redraws,
+    },
+}
+
+
+def save(name: str, meta: dict, reads: list):
+    data = bytearray((json.dumps(meta) + "\n").encode())
+    for delay, chunk in reads:
+        data += RECORD.pack(int(delay * 1e6), len(chunk)) + chunk
+    CORPUS.mkdir(exist_ok=True)
+    (CORPUS / f"{name}.rec.gz").write_bytes(gzip.compress(bytes(data), mtime=0))
+
+
+def load(path: Path) -> tuple:
+    """(meta, [(delay seconds, bytes)]) from a recording."""
+    data = gzip.decompress(path.read_bytes())
+    header_end = data.index(b"\n") + 1
+    meta = json.loads(data[:header_end])
+    reads = []
+    pos = header_end
+    while pos < len(data):
+        delay, length = RECORD.unpack_from(data, pos)
+        pos += RECORD.size
+        reads.append((delay / 1e6, data[pos:pos + length]))
+        pos += length
+    return meta, reads
+
+
+def record(name: str, spec: dict):
+    if "synthetic" in spec:
+        reads = spec["synthetic"]()
+        save(name, {"name": name, "synthetic": True, "cols": COLS, "rows": ROWS}, reads)
+        return reads
+    with tempfile.TemporaryDirectory() as cwd:
+        for filename, content in spec.get("files", {}).items():
+            Path(cwd, filename).write_text(content())
+        pid, fd = pty.fork()
+        if pid == 0:
+            os.chdir(cwd)
+            os.environ["TERM"] = "xterm-256color"
+            fcntl.ioctl(0, termios.TIOCSWINSZ, struct.pack("HHHH", ROWS, COLS, 0, 0))
+            os.execvp(spec["command"][0], spec["command"])
+        keys = list(spec.get("keys", ()))
+        reads = []
+        last = time.perf_counter()
+        next_key = last + keys[0][0] if keys else None
+        while True:
+            timeout = None if next_key is None else max(0.0, next_key - time.perf_counter())
+            ready, _, _ = select.select([fd], [], [], timeout)
+            now = time.perf_counter()
+            if ready:
+                try:
+                    chunk = os.read(fd, 65536)
+                except OSError:
+                    break
+                if not chunk:
+                    break
+                reads.append((now - last, chunk))
+                last = now
+            elif keys:
+                os.write(fd, keys.pop(0)[1])
+                next_key = now + keys[0][0] if keys else None
+        os.close(fd)
+        os.waitpid(pid, 0)
+    save(name, {"name": name, "command": spec["command"], "cols": COLS, "rows": ROWS}, reads)
+    return reads
+
+
+class VirtualClock:
+    """Stands in for the event loop in an OutputCoalescer: time() and call_at()
+    on a clock that only moves when advance() is called."""
+
+    def __init__(self):
+        self.now = 0.0
+        self._timers = []
+        self._count = 0
+
+    def time(self) -> float:
+        return self.now
+
+    def call_at(self, when: float, callback, *args):
+        handle = SimpleNamespace(callback=callback, args=args, cancelled=False)
+        handle.cancel = lambda: setattr(handle, "cancelled", True)
+        self._count += 1
+        heapq.heappush(self._timers, (when, self._count, handle))
+        return handle
+
+    def advance(self, seconds: float):
+        """Move time forward, running the timers that fall due on the way."""
+        until = self.now + seconds
+        while self._timers and self._timers[0][0] <= until:
+            when, _, handle = heapq.heappop(self._timers)
+            if not handle.cancelled:
+                self.now = max(self.now, when)
+                handle.callback(*handle.args)
+        self.now = until
+
+
+async def replay(server, reads: list, viewers: int, text_viewers: int, compress: int,
+                 trace: bool = False) -> dict:
+    """Push a recording through a fresh hub; returns its counts (and allocations if trace)."""
+    hub = server.SharedTerminalSession("replay")
+    clock = VirtualClock()
+    hub._decoder = server.new_utf8_decoder()
+    hub._coalescer = server.OutputCoalescer(hub._broadcast)
+    hub._coalescer._loop = clock
+    for i in range(viewers + text_viewers):
+        ws = FakeViewer(server.BINARY_PROTOCOL if i < viewers else None, compress)
+        hub._clients[ws] = server.ClientWriter(ws, hub, limit=1 << 40)
+    await asyncio.sleep(0)  # Let the writer tasks start waiting
+
+    allocated = 0
+    started = time.perf_counter()
+    for delay, chunk in reads:
+        if trace:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        clock.advance(delay)
+        hub._on_output(chunk)
+        # The writers hand their frames to the transport
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        if trace:
+            allocated += tracemalloc.get_traced_memory()[1] - before
+    clock.advance(1.0)
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+
+    writers = list(hub._clients.values())
+    for writer in writers:
+        writer.close()
+    binary = writers[0] if viewers else writers[-1]
+    return {
+        "elapsed": elapsed,
+        "allocated": allocated,
+        "frames": binary.sent_frames,
+        "sent_bytes": sum(writer.sent_bytes for writer in writers),
+        "wire_bytes": binary.ws._writer.transport.written,
+        "ring_bytes": hub._ring.seq,
+    }
+
+
+async def run(args) -> dict:
+    import server
+
+    server.ADAPT_PROBE_INTERVAL = 0  # No RTT probes of the fake viewers
+    results = {}
+    print(f"viewers: {args.viewers} binary, {args.text_viewers} text; "
+          f"permessage-deflate: {'off' if args.no_compress else 'on'}")
+    print(f"{'recording':<14} {'MB':>6} {'reads':>7} {'MB/s':>8} {'frames':>7} "
+          f"{'frames/MB':>9} {'alloc KB/MB':>11} {'wire/MB':>8}")
+    compress = 0 if args.no_compress else 15
+    for name in args.only:
+        meta, reads = load(CORPUS / f"{name}.rec.gz")
+        size = sum(len(chunk) for _, chunk in reads)
+        best = None
+        for _ in range(args.repeat):
+            result = await replay(server, reads, args.viewers, args.text_viewers, compress)
+            if best is None or result["elapsed"] < best["elapsed"]:
+                best = result
+        tracemalloc.start()
+        traced = await replay(server, reads, args.viewers, args.text_viewers, compress, trace=True)
+        tracemalloc.stop()
+        if traced["ring_bytes"] != size:
+            raise RuntimeError(f"{name}: {traced['ring_bytes']} of {size} bytes came out")
+        mb = size / 1e6
+        results[name] = {
+            "synthetic": bool(meta.get("synthetic")),
+            "bytes": size,
+            "reads": len(reads),
+            "mb_per_s": round(mb / best["elapsed"], 2),
+            "us_per_read": round(best["elapsed"] / len(reads) * 1e6, 1),
+            "frames": best["frames"],
+            "frames_per_mb": round(best["frames"] / mb, 1),
+            "alloc_kb_per_mb": round(traced["allocated"] / 1e3 / mb, 1),
+            "wire_bytes_per_mb": round(best["wire_bytes"] / mb),
+        }
+        r = results[name]
+        print(f"{name:<14} {mb:6.2f} {r['reads']:>7} {r['mb_per_s']:8.2f} {r['frames']:>7} "
+              f"{r['frames_per_mb']:>9.1f} {r['alloc_kb_per_mb']:>11.1f} "
+              f"{r['wire_bytes_per_mb'] / 1e6:>8.3f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--viewers", type=int, default=10, help="binary viewers to fan out to")
+    parser.add_argument("--text-viewers", type=int, default=1, help="text viewers (decoded output)")
+    parser.add_argument("--repeat", type=int, default=3, help="replays per recording; the fastest counts")
+    parser.add_argument("--no-compress", action="store_true", help="disable permessage-deflate")
+    parser.add_argument("--only", help="comma-separated recordings (default: all)")
+    parser.add_argument("--out", help="write results here as JSON")
+    parser.add_argument("--record", action="store_true", help="re-record the corpus instead")
+    args = parser.parse_args()
+    if args.viewers + args.text_viewers < 1:
+        parser.error("need at least one viewer")
+    names = list(RECORDINGS) if args.record else sorted(
+        path.name[:-len(".rec.gz")] for path in CORPUS.glob("*.rec.gz"))
+    args.only = args.only.split(",") if args.only else names
+    unknown = set(args.only) - set(names)
+    if unknown:
+        parser.error(f"unknown recordings: {', '.join(sorted(unknown))}")
+
+    if args.record:
+        for name in args.only:
+            reads = record(name, RECORDINGS[name])
+            print(f"{name}: {len(reads)} reads, {sum(len(chunk) for _, chunk in reads)} bytes")
+        return
+
+    results = asyncio.run(run(args))
+    if args.out:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=CORPUS.parent,
+                                capture_output=True, text=True).stdout.strip()
+        report = {"meta": {"commit": commit, "python": sys.version.split()[0],
+                           "args": {key: value for key, value in vars(args).items()
+                                    if key not in ("out", "record")}},
+                  "results": results}
+        Path(args.out).write_text(json.dumps(report, indent=2) + "\n")
+        print(f"results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Time to first prompt for private sessions, with and without the shell pool.
+
+Opens private TerminalSessions one after another (each held for --hold
+seconds, as a short visit from a phone would be), with the pool disabled
+and then at --pool shells, and reports how long each waited for its first
+output. Uses $SHELL with the user's rc files, which is what the pool hides.
+
+Usage: python3 bench/shell_pool.py [--sessions 6] [--pool 2] [--hold 1] [--shell /bin/zsh]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from bench.common import FakeViewer  # noqa: E402
+
+
+async def visits(server, pool_size: int, sessions: int, hold: float) -> dict:
+    pool = server._shell_pool = server.ShellPool(size=pool_size)
+    pool.fill_soon()
+    while pool._task is not None:
+        await asyncio.sleep(0.05)
+    for _ in range(sessions):
+        session = server.TerminalSession(FakeViewer(server.BINARY_PROTOCOL))
+        await session.start()
+        await asyncio.wait_for(session.ws.first.wait(), 30)
+        await asyncio.sleep(hold)
+        session.stop()
+    stats = pool.stats()
+    pool.close()
+    return stats
+
+
+async def run(sessions: int, pool_size: int, hold: float):
+    import server
+
+    print(f"shell: {os.environ.get('SHELL', '/bin/bash')}")
+    print(f"{'pool':>5} {'warm':>5} {'warm p50 ms':>12} {'cold':>5} {'cold p50 ms':>12} {'startup p50 ms':>15}")
+    for size in (0, pool_size):
+        stats = await visits(server, size, sessions, hold)
+        warm, cold = stats["first_prompt_ms"]["warm"], stats["first_prompt_ms"]["cold"]
+        startup = stats["shell_startup_ms"]
+        print(f"{size:>5} {warm['count'] if warm else 0:>5} {warm['p50'] if warm else '-':>12} "
+              f"{cold['count'] if cold else 0:>5} {cold['p50'] if cold else '-':>12} "
+              f"{startup['p50'] if startup else '-':>15}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=6, help="private sessions to open")
+    parser.add_argument("--pool", type=int, default=2, help="pool size to compare with no pool")
+    parser.add_argument("--hold", type=float, default=1.0, help="seconds each session stays open")
+    parser.add_argument("--shell", help="shell to start instead of $SHELL")
+    args = parser.parse_args()
+    if args.shell:
+        os.environ["SHELL"] = args.shell
+    asyncio.run(run(args.sessions, args.pool, args.hold))
+
+
+if __name__ == "__main__":
+    main()
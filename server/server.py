@@ -9,13 +9,24 @@ Requirements:
 """
 
 import asyncio
+import codecs
+import errno
+import fcntl
+import json
 import os
 import pty
-import select
+import re
+import secrets
 import signal
+import socket
 import ssl
+import struct
 import subprocess
 import sys
+import termios
+import zlib
+from bisect import bisect_left
+from collections import deque
 from pathlib import Path
 
 try:
@@ -27,11 +38,328 @@ except ImportError:
     from aiohttp import web
     import aiohttp
 
-PORT = 8443
-CERT_DIR = Path(__file__).parent / "certs"
+try:
+    import pyte
+except ImportError:
+    pyte = None  # Join snapshots fall back to tmux capture-pane
+
+# Where to listen and keep the TLS certificate. The defaults suit normal use;
+# the overrides let a benchmark run a scratch server next to the real one.
+HOST = os.environ.get("TERMLINKKY_HOST", "0.0.0.0")
+PORT = int(os.environ.get("TERMLINKKY_PORT", "8443"))
+CERT_DIR = Path(os.environ.get("TERMLINKKY_CERT_DIR") or Path(__file__).parent / "certs")
+BONJOUR = os.environ.get("TERMLINKKY_BONJOUR", "1") != "0"
 CERT_FILE = CERT_DIR / "server.crt"
 KEY_FILE = CERT_DIR / "server.key"
 
+# PTY output handling
+PTY_READ_SIZE = 65536  # Max bytes per read once the PTY is readable
+CLIENT_QUEUE_LIMIT = 256 * 1024  # Unsent bytes per client before it is resynced with a snapshot
+INPUT_QUEUE_LIMIT = 64 * 1024  # Unwritten input per PTY or client before senders are made to wait
+
+# Shared-session input: clients take turns writing up to INPUT_QUANTUM bytes
+# each. TERMLINKKY_INPUT_RATE caps each client's input in bytes/sec (0 = no
+# cap), allowing bursts of up to TERMLINKKY_INPUT_BURST bytes.
+INPUT_QUANTUM = 4096
+INPUT_RATE = float(os.environ.get("TERMLINKKY_INPUT_RATE", "0"))
+INPUT_BURST = int(os.environ.get("TERMLINKKY_INPUT_BURST", str(64 * 1024)))
+
+# Output coalescing: bulk output is batched into frames of up to FRAME_MAX_BYTES
+# or COALESCE_WINDOW seconds, whichever comes first. Small writes after a quiet
+# period (keystroke echo) are sent immediately.
+COALESCE_WINDOW = float(os.environ.get("TERMLINKKY_COALESCE_MS", "12")) / 1000
+FRAME_MAX_BYTES = int(os.environ.get("TERMLINKKY_FRAME_MAX", str(64 * 1024)))
+INTERACTIVE_MAX_BYTES = 512  # Larger reads are treated as bulk output
+
+# Frames are only cut between escape sequences and UTF-8 characters. An
+# incomplete one at the end of a read waits this long without further output
+# (or until it grows past FRAME_MAX_BYTES) before it is sent anyway.
+SEQUENCE_HOLD = 0.02
+
+# Recent shared-session output kept for clients resuming after a reconnect
+RING_BUFFER_BYTES = int(os.environ.get("TERMLINKKY_RING_BYTES", str(1024 * 1024)))
+
+# External commands (tmux etc.) run from async handlers
+COMMAND_CONCURRENCY = 4  # Max child processes in flight at once
+COMMAND_TIMEOUT = 5  # Default seconds before a command is killed
+
+# tmux backend: commands go over one persistent control-mode (-C) client unless
+# disabled. Shared-session output comes from a `tmux attach` PTY by default, or
+# straight from the control client's per-pane %output notifications.
+SHARED_SESSION = "termlinkky"
+# The command client sits in its own hidden session, so running a command never
+# creates, attaches to or revives a session the user can see.
+CONTROL_SESSION = "_termlinkky_control"
+TMUX_CONTROL = os.environ.get("TERMLINKKY_TMUX_CONTROL", "1") != "0"
+TMUX_OUTPUT = os.environ.get("TERMLINKKY_TMUX_OUTPUT", "attach")  # "attach" or "control"
+
+# Seconds a session hub stays attached to tmux after its last viewer leaves.
+# Reconnecting within this window resumes without a snapshot.
+IDLE_DETACH_SECONDS = float(os.environ.get("TERMLINKKY_IDLE_DETACH", "30"))
+
+# Server-side screen model (needs pyte) that join snapshots are drawn from
+SCREEN_MODEL = pyte is not None and os.environ.get("TERMLINKKY_SCREEN_MODEL", "1") != "0"
+SCREEN_FEED_BYTES = 4096  # Output fed to the model per event loop iteration
+SCREEN_MAX_LAG = 64 * 1024  # Further behind than this, the model is rebuilt from tmux
+SCREEN_REBUILD_QUIET = 0.5  # Seconds without output before rebuilding
+
+# Clients connecting with ?transport=diff get screen changes at this rate at most
+DIFF_FPS = float(os.environ.get("TERMLINKKY_DIFF_FPS", "10"))
+
+# Per-client adaptation: each client's RTT and drain rate are measured with a
+# WebSocket ping every ADAPT_PROBE_INTERVAL seconds (0 disables it). Clients
+# with an RTT of ADAPT_FAST_RTT or more get their output batched, and a client
+# is never left more than ADAPT_MAX_LAG seconds of output behind.
+ADAPT_PROBE_INTERVAL = float(os.environ.get("TERMLINKKY_PROBE_INTERVAL", "1"))
+ADAPT_FAST_RTT = 0.03
+ADAPT_MAX_INTERVAL = 0.05  # Longest extra delay a batched client's output waits
+ADAPT_MAX_LAG = float(os.environ.get("TERMLINKKY_MAX_LAG", "1"))
+ADAPT_MIN_QUEUE = 16 * 1024  # Smallest backlog allowed before a snapshot, whatever the drain rate
+ADAPT_RECOVER_PROBES = 5  # Calm probes before an auto client returns from screen diffs
+
+# Terminal size: sessions start at DEFAULT_COLS x DEFAULT_ROWS (phone-sized)
+# until a viewer reports its own. When viewers of a session disagree,
+# TERMLINKKY_SIZE_POLICY picks the size: "smallest" fits every viewer,
+# "largest" suits the biggest screen, "latest" follows whoever resized last.
+# Resizes are applied once they have settled for RESIZE_DEBOUNCE seconds, so
+# a rotation or window drag costs one redraw rather than dozens.
+DEFAULT_COLS = int(os.environ.get("TERMLINKKY_COLS", "48"))
+DEFAULT_ROWS = int(os.environ.get("TERMLINKKY_ROWS", "30"))
+SIZE_POLICY = os.environ.get("TERMLINKKY_SIZE_POLICY", "smallest")
+RESIZE_DEBOUNCE = float(os.environ.get("TERMLINKKY_RESIZE_DEBOUNCE_MS", "150")) / 1000
+MAX_COLS, MAX_ROWS = 1000, 500  # Larger reported sizes are rejected
+
+# Private sessions get a shell from a pool of TERMLINKKY_SHELL_POOL shells
+# started ahead of time (0 starts each one on connect), so they don't wait for
+# rc files. Idle shells older than SHELL_POOL_MAX_AGE are replaced, to pick
+# up changes to those files.
+SHELL_POOL_SIZE = int(os.environ.get("TERMLINKKY_SHELL_POOL", "2"))
+SHELL_POOL_MAX_AGE = 30 * 60
+WARM_SHELL_OUTPUT_LIMIT = 64 * 1024  # Output kept from a shell before it is claimed
+WARM_SHELL_SETTLE = 0.1  # Quiet after its first output before a shell counts as ready
+
+# A private session whose socket goes away keeps its shell for
+# TERMLINKKY_PRIVATE_TTL seconds (0 ends it with the socket), so the client
+# can resume it with its token and get the output it missed from a buffer of
+# PRIVATE_RING_BYTES. At most PRIVATE_MAX_DETACHED are kept; beyond that the
+# longest detached are ended first.
+PRIVATE_DETACH_TTL = float(os.environ.get("TERMLINKKY_PRIVATE_TTL", "600"))
+PRIVATE_MAX_DETACHED = 16
+PRIVATE_RING_BYTES = 256 * 1024
+PRIVATE_SEND_LIMIT = 64 * 1024  # Unsent output before the shell's PTY stops being read
+PRIVATE_REAP_INTERVAL = 10
+
+# WebSocket subprotocol for raw PTY bytes in binary frames. Clients that don't
+# offer it get UTF-8 text frames as before.
+BINARY_PROTOCOL = "termlinkky.binary"
+
+# Multiplexed protocol on /mux: many sessions as channels of one WebSocket.
+# The version is picked from the subprotocols the client offers (newest
+# first). Every message is a binary frame: MUX_HEADER, then the payload.
+MUX_PROTOCOLS = {"termlinkky.mux.1": 1}  # Subprotocol -> version, newest first
+MUX_HEADER = struct.Struct("!BH")  # Message type, channel id
+MUX_SNAPSHOT_HEADER = struct.Struct("!QHHB")  # seq, cols, rows, flags (1 = history)
+MUX_DATA, MUX_CONTROL, MUX_RESIZE, MUX_ACK, MUX_PING, MUX_PONG, MUX_SNAPSHOT = range(7)
+MUX_MAX_CHANNELS = 32  # Open channels per WebSocket
+
+# Echo probes: a binary client can have a keystroke timed on its way through
+# the server (see EchoProbes). A probe not echoed back within PROBE_TIMEOUT
+# seconds is reported with the stages it got through.
+PROBE_TIMEOUT = 2.0
+PROBE_MAX_PENDING = 8  # Probes in flight per client
+
+# /metrics: counters and histograms kept in memory, recorded on the hot paths
+# (a dict lookup and an addition each) and rendered in the Prometheus text
+# format when scraped. The event loop's lag is sampled every LOOP_LAG_INTERVAL
+# while any WebSocket is connected, so an idle server isn't woken for it.
+LOOP_LAG_INTERVAL = 0.25
+ECHO_STAGES = ("queue", "echo", "output")  # See EchoProbes
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class Metric:
+    """A metric family for /metrics.
+    
+    labels() returns the child for one combination of label values, creating
+    it on first use; hot paths keep the child rather than looking it up each
+    time. A metric without labels is its own only child.
+    """
+    
+    kind = "untyped"
+    registry = []  # Every metric, in the order /metrics lists them
+    
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._children = {}  # label values -> child
+        Metric.registry.append(self)
+    
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+    
+    def _new_child(self):
+        return _MetricValue()
+    
+    def _label_text(self, values: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(self.label_names, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+    
+    def children(self) -> dict:
+        return self._children
+    
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self.children().items():
+            lines.extend(self._render_child(values, child))
+        return lines
+    
+    def _render_child(self, values: tuple, child) -> list:
+        return [f"{self.name}{self._label_text(values)} {_format_number(child.value)}"]
+
+
+class _MetricValue:
+    __slots__ = ("value",)
+    
+    def __init__(self, value=0):
+        self.value = value
+    
+    def inc(self, amount=1):
+        self.value += amount
+    
+    def dec(self, amount=1):
+        self.value -= amount
+    
+    def set(self, value):
+        self.value = value
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count")
+    
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Counter(Metric):
+    kind = "counter"
+    
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    """A value that goes up and down, or (with ``collect``) is read when scraped.
+    
+    ``collect()`` returns {label values: value} for the current state, so
+    gauges describing live objects don't keep series for ones that are gone.
+    """
+    
+    kind = "gauge"
+    
+    def __init__(self, name: str, help: str, labels: tuple = (), collect=None):
+        super().__init__(name, help, labels)
+        self._collect = collect
+    
+    def children(self) -> dict:
+        if self._collect is None:
+            return self._children
+        return {values: _MetricValue(value) for values, value in self._collect().items()}
+
+
+class Histogram(Metric):
+    kind = "histogram"
+    
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+    
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+    
+    def observe(self, value: float):
+        self.labels().observe(value)
+    
+    def _render_child(self, values: tuple, child) -> list:
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            total += count
+            le = "+Inf" if bound == float("inf") else _format_number(bound)
+            bucket = self._label_text(values, 'le="' + le + '"')
+            lines.append(f"{self.name}_bucket{bucket} {total}")
+        labels = self._label_text(values)
+        lines.append(f"{self.name}_sum{labels} {_format_number(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in Metric.registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+PTY_READ_BYTES = Counter("termlinkky_pty_read_bytes_total",
+                         "Bytes of terminal output read, by session (private shells together)",
+                         ("session",))
+PTY_READS = Counter("termlinkky_pty_reads_total", "Terminal output reads, by session", ("session",))
+FRAMES_SENT = Counter("termlinkky_frames_sent_total", "WebSocket frames sent to clients, by transport",
+                      ("transport",))
+BYTES_SENT = Counter("termlinkky_sent_bytes_total", "Payload bytes sent to clients, by transport",
+                     ("transport",))
+SEND_SECONDS = Histogram("termlinkky_ws_send_seconds",
+                         "Time to hand output to a client's socket, including waits for it to drain",
+                         ("transport",))
+CLIENT_RESYNCS = Counter("termlinkky_client_resyncs_total",
+                         "Clients that fell behind and had their backlog replaced by a snapshot")
+LOOP_LAG = Histogram("termlinkky_event_loop_lag_seconds",
+                     f"How late the event loop woke a timer, sampled every {LOOP_LAG_INTERVAL}s "
+                     "while clients are connected")
+CONNECTIONS = Counter("termlinkky_connections_total", "WebSocket connections accepted, by endpoint",
+                      ("endpoint",))
+OPEN_CONNECTIONS = Gauge("termlinkky_open_connections", "WebSocket connections open, by endpoint",
+                         ("endpoint",))
+COMMAND_SECONDS = Histogram("termlinkky_command_seconds",
+                            "External commands and tmux control-mode commands, by program, "
+                            "tmux command and how it ran (process or control)",
+                            ("program", "command", "via"))
+ECHO_STAGE_SECONDS = Histogram("termlinkky_echo_stage_seconds",
+                               "Keystroke-to-echo probe time by session and stage: queue (received "
+                               "to written to the PTY), echo (to the echo being read) and output "
+                               "(to it being sent)", ("session", "stage"))
+COMMAND_TIMEOUTS = Counter("termlinkky_command_timeouts_total", "Commands that timed out",
+                           ("program", "command", "via"))
+FIRST_PROMPT_SECONDS = Histogram("termlinkky_private_first_prompt_seconds",
+                                 "Time from a private session connecting to its first output, by "
+                                 "whether its shell came warm from the pool or was started cold",
+                                 ("shell",), buckets=LATENCY_BUCKETS + (10,))
+
 
 def get_tailscale_ip() -> str:
     """Get Tailscale IP address. Returns None if not connected."""
@@ -62,22 +390,67 @@ def get_tailscale_status() -> dict:
     return None
 
 
+_fingerprint_cache = (None, "")  # (certificate mtime, fingerprint)
+
+
+_FINGERPRINT_COMMAND = ["openssl", "x509", "-in", str(CERT_FILE), "-noout", "-fingerprint", "-sha256"]
+
+
+def _certificate_mtime():
+    """Modification time of the certificate, or None if there is none."""
+    try:
+        return CERT_FILE.stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def _store_fingerprint(mtime, result: subprocess.CompletedProcess) -> str:
+    global _fingerprint_cache
+    fingerprint = ""
+    if result.returncode == 0 and "=" in result.stdout:
+        fingerprint = result.stdout.strip().split("=")[1].lower()
+    _fingerprint_cache = (mtime, fingerprint)
+    return fingerprint
+
+
 def get_certificate_fingerprint() -> str:
-    """Calculate SHA-256 fingerprint of the server certificate."""
-    if not CERT_FILE.exists():
+    """Calculate SHA-256 fingerprint of the server certificate.
+    
+    Blocks on openssl; for startup only. Request handlers use
+    certificate_fingerprint(), which shares the cache.
+    """
+    mtime = _certificate_mtime()
+    if mtime is None:
         return ""
-    result = subprocess.run(
-        ["openssl", "x509", "-in", str(CERT_FILE), "-noout", "-fingerprint", "-sha256"],
-        capture_output=True, text=True
-    )
-    if result.returncode == 0 and "=" in result.stdout:
-        return result.stdout.strip().split("=")[1].lower()
-    return ""
+    if _fingerprint_cache[0] == mtime:
+        return _fingerprint_cache[1]
+    return _store_fingerprint(mtime, subprocess.run(_FINGERPRINT_COMMAND, capture_output=True, text=True))
+
+
+async def certificate_fingerprint() -> str:
+    """get_certificate_fingerprint() without blocking the event loop.
+    
+    Cached until the certificate file changes, so openssl only runs again
+    after the certificate is regenerated.
+    """
+    mtime = _certificate_mtime()
+    if mtime is None:
+        return ""
+    if _fingerprint_cache[0] == mtime:
+        return _fingerprint_cache[1]
+    try:
+        result = await run_command(_FINGERPRINT_COMMAND)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        print(f"Certificate fingerprint failed: {e}")
+        return ""
+    return _store_fingerprint(mtime, result)
 
 
-def get_pairing_code() -> str:
+def get_pairing_code(fingerprint: str = None) -> str:
     """Generate 6-digit pairing code from certificate fingerprint."""
-    fingerprint = get_certificate_fingerprint().replace(":", "")
+    if fingerprint is None:
+        fingerprint = get_certificate_fingerprint()
+    fingerprint = fingerprint.replace(":", "")
     if not fingerprint:
         return "000000"
     return f"{int(fingerprint[:6], 16) % 1000000:06d}"
@@ -98,79 +471,2102 @@ def generate_certificate():
     ], check=True)
 
 
+_command_slots = None
+
+
+async def run_command(args: list, timeout: float = COMMAND_TIMEOUT) -> subprocess.CompletedProcess:
+    """Run a command without blocking the event loop.
+    
+    At most COMMAND_CONCURRENCY commands run at once; the rest wait their
+    turn. Returns a CompletedProcess with text stdout/stderr, and raises
+    subprocess.TimeoutExpired (after killing the child) like subprocess.run.
+    """
+    global _command_slots
+    if _command_slots is None:
+        _command_slots = asyncio.Semaphore(COMMAND_CONCURRENCY)
+    program = os.path.basename(args[0])
+    labels = (program, args[1] if program == "tmux" and len(args) > 1 else "", "process")
+    loop = asyncio.get_running_loop()
+    async with _command_slots:
+        started = loop.time()
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            COMMAND_TIMEOUTS.labels(*labels).inc()
+            raise subprocess.TimeoutExpired(args, timeout)
+        finally:
+            COMMAND_SECONDS.labels(*labels).observe(loop.time() - started)
+    return subprocess.CompletedProcess(
+        args, proc.returncode,
+        stdout.decode("utf-8", errors="replace"),
+        stderr.decode("utf-8", errors="replace"),
+    )
+
+
+class TmuxControlError(Exception):
+    """The tmux control-mode client is not connected."""
+
+
+def tmux_quote(arg) -> str:
+    """Quote one argument for a tmux command line."""
+    arg = str(arg)
+    if "\n" in arg:
+        raise ValueError("tmux command arguments cannot contain newlines")
+    return "'" + arg.replace("'", "'\\''") + "'"
+
+
+_OCTAL_ESCAPE = re.compile(rb"\\([0-7]{3})")
+
+
+def unescape_output(data: bytes) -> bytes:
+    """Decode the octal escapes tmux uses in %output notifications."""
+    if b"\\" not in data:
+        return data
+    return _OCTAL_ESCAPE.sub(lambda m: bytes((int(m.group(1), 8),)), data)
+
+
+class TmuxControl:
+    """A long-lived tmux control-mode (-C) client attached to one session.
+    
+    Commands are written to a single pipe and matched, in order, to their
+    %begin/%end (or %error) reply blocks, so running a tmux command doesn't
+    fork a process. %output notifications for panes in the attached session
+    go to per-pane listeners; other notifications go to general listeners
+    as (name, args), with ("%exit", reason) when the client goes away.
+    """
+    
+    def __init__(self, session: str, create: bool = False):
+        self.session = session
+        self.create = create
+        self.commands = 0
+        self._proc = None
+        self._replies = deque()  # Futures for commands awaiting a reply
+        self._block = None  # Lines of the reply block being read
+        self._block_tag = None  # b"<time> <number>" of that block, or None if not ours
+        self._pane_listeners = {}  # pane id -> callback(bytes)
+        self._listeners = []
+        self._exit_reason = "exited"
+        self._output_enabled = True
+        self._closed = False
+    
+    @property
+    def alive(self) -> bool:
+        return self._proc is not None and not self._closed
+    
+    async def start(self):
+        """Attach to the session (creating it if ``create``) and wait until tmux answers."""
+        if self.create:
+            # Nobody types into it; cat just keeps its pane alive cheaply
+            target = ("new-session", "-A", "-s", self.session,
+                      "-x", str(DEFAULT_COLS), "-y", str(DEFAULT_ROWS), "cat")
+        else:
+            target = ("attach-session", "-t", f"={self.session}")
+        self._proc = await asyncio.create_subprocess_exec(
+            "tmux", "-C", *target,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            limit=4 * 1024 * 1024,
+        )
+        asyncio.create_task(self._read_replies())
+        result = await self.command("display-message", "-p", "#{version}")
+        print(f"tmux control mode: attached to {self.session} (tmux {result.stdout.strip()})")
+        self._update_output()
+    
+    async def command(self, *args, timeout: float = COMMAND_TIMEOUT) -> subprocess.CompletedProcess:
+        """Run a tmux command; returns a CompletedProcess like run_command."""
+        if not self.alive:
+            raise TmuxControlError("control client is not running")
+        line = " ".join(tmux_quote(arg) for arg in args) + "\n"
+        loop = asyncio.get_running_loop()
+        reply = loop.create_future()
+        self._replies.append(reply)
+        self._proc.stdin.write(line.encode("utf-8"))
+        self.commands += 1
+        labels = ("tmux", str(args[0]) if args else "", "control")
+        started = loop.time()
+        try:
+            # Shielded so a timeout leaves the future queued for its reply,
+            # keeping later replies matched to the right commands.
+            ok, lines = await asyncio.wait_for(asyncio.shield(reply), timeout)
+        except asyncio.TimeoutError:
+            COMMAND_TIMEOUTS.labels(*labels).inc()
+            raise subprocess.TimeoutExpired(["tmux", *args], timeout)
+        finally:
+            COMMAND_SECONDS.labels(*labels).observe(loop.time() - started)
+        if ok is None:
+            raise TmuxControlError(lines)
+        output = "".join(line + "\n" for line in lines)
+        return subprocess.CompletedProcess(
+            ["tmux", *args], 0 if ok else 1, output if ok else "", "" if ok else output
+        )
+    
+    def listen_pane(self, pane: str, callback):
+        """Send a pane's output bytes to callback (replacing any earlier listener)."""
+        self._pane_listeners[pane] = callback
+        self._update_output()
+    
+    def unlisten_pane(self, pane: str):
+        self._pane_listeners.pop(pane, None)
+        self._update_output()
+    
+    def _update_output(self):
+        """Only take %output while a pane listener needs it, so idle panes don't wake us."""
+        wanted = bool(self._pane_listeners)
+        if wanted != self._output_enabled and self.alive:
+            self._output_enabled = wanted
+            # no-output needs tmux 3.2+; older versions just keep sending output
+            asyncio.ensure_future(self._set_output(wanted))
+    
+    async def _set_output(self, enabled: bool):
+        try:
+            await self.command("refresh-client", "-f", "!no-output" if enabled else "no-output")
+        except (TmuxControlError, subprocess.TimeoutExpired):
+            pass
+    
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+    
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+    
+    def stop(self):
+        """Detach the control client."""
+        if self._proc and self._proc.returncode is None:
+            self._proc.stdin.close()
+    
+    async def _read_replies(self):
+        reason = None
+        try:
+            while True:
+                line = await self._proc.stdout.readline()
+                if not line:
+                    break
+                self._handle_line(line.rstrip(b"\n"))
+        except Exception as e:
+            reason = str(e)
+        self._close(reason or self._exit_reason)
+    
+    def _handle_line(self, line: bytes):
+        if self._block is not None:
+            if line.startswith((b"%end ", b"%error ")):
+                tag = line.split(b" ", 1)[1].rsplit(b" ", 1)[0]
+                if tag == self._block_tag or self._block_tag is None:
+                    lines, ours = self._block, self._block_tag is not None
+                    self._block = self._block_tag = None
+                    if ours and self._replies:
+                        reply = self._replies.popleft()
+                        if not reply.done():
+                            reply.set_result((line.startswith(b"%end"), lines))
+                    return
+            self._block.append(line.decode("utf-8", errors="replace"))
+        elif line.startswith(b"%begin "):
+            fields = line.split(b" ")
+            self._block = []
+            # Flag 1 marks replies to commands from this client
+            self._block_tag = b" ".join(fields[1:3]) if int(fields[3]) & 1 else None
+        elif line.startswith(b"%output "):
+            _, pane, data = (line + b" ").split(b" ", 2)
+            listener = self._pane_listeners.get(pane.decode())
+            if listener:
+                listener(unescape_output(data[:-1]))
+        elif line.startswith(b"%exit"):
+            # tmux closes the pipe right after this
+            self._exit_reason = line[6:].decode("utf-8", errors="replace") or "exited"
+        elif line.startswith(b"%"):
+            name, _, args = line.decode("utf-8", errors="replace").partition(" ")
+            for callback in list(self._listeners):
+                callback(name, args)
+    
+    def _close(self, reason: str):
+        if self._closed:
+            return
+        self._closed = True
+        while self._replies:
+            reply = self._replies.popleft()
+            if not reply.done():
+                reply.set_result((None, reason))
+        self._pane_listeners.clear()
+        for callback in list(self._listeners):
+            callback("%exit", reason)
+        if self._proc and self._proc.returncode is None:
+            try:
+                self._proc.kill()
+            except ProcessLookupError:
+                pass
+        print(f"tmux control mode: client for {self.session} closed ({reason})")
+
+
+_tmux_control = None
+_tmux_control_lock = None
+_tmux_control_retry_at = 0.0
+
+
+async def get_tmux_control():
+    """The shared control-mode client, started on first use. None if unavailable."""
+    global _tmux_control, _tmux_control_lock, _tmux_control_retry_at
+    if not TMUX_CONTROL:
+        return None
+    if _tmux_control and _tmux_control.alive:
+        return _tmux_control
+    if _tmux_control_lock is None:
+        _tmux_control_lock = asyncio.Lock()
+    async with _tmux_control_lock:
+        if _tmux_control and _tmux_control.alive:
+            return _tmux_control
+        loop = asyncio.get_running_loop()
+        if loop.time() < _tmux_control_retry_at:
+            return None
+        control = TmuxControl(CONTROL_SESSION, create=True)
+        try:
+            await control.start()
+        except Exception as e:
+            print(f"tmux control mode unavailable ({e}), using one-shot tmux commands")
+            control._close("failed to start")
+            _tmux_control_retry_at = loop.time() + 30
+            return None
+        _tmux_control = control
+        return control
+
+
+async def tmux(*args, timeout: float = COMMAND_TIMEOUT) -> subprocess.CompletedProcess:
+    """Run a tmux command over the control-mode client, or as its own process."""
+    control = await get_tmux_control()
+    if control:
+        try:
+            return await control.command(*args, timeout=timeout)
+        except TmuxControlError:
+            pass
+    return await run_command(["tmux", *args], timeout=timeout)
+
+
+async def send_keys(target: str, data: bytes):
+    """Type raw bytes into a tmux pane (hex keys, so no quoting issues)."""
+    for i in range(0, len(data), 256):
+        chunk = data[i:i + 256]
+        await tmux("send-keys", "-t", target, "-H", *(f"{b:02x}" for b in chunk), timeout=2)
+
+
+class PtyReader:
+    """Watches a PTY master fd with the event loop and hands output to a callback.
+    
+    Readiness comes from ``loop.add_reader`` so output is picked up the moment
+    the PTY becomes readable, without polling or blocking the loop.
+    """
+    
+    def __init__(self, fd: int, on_data, on_close, read_size: int = PTY_READ_SIZE):
+        self.fd = fd
+        self.on_data = on_data
+        self.on_close = on_close
+        self.read_size = read_size
+        self._loop = None
+        self._watching = False
+        self._paused = False
+        self._closed = False
+    
+    def start(self):
+        """Switch the fd to non-blocking mode and start watching it."""
+        self._loop = asyncio.get_running_loop()
+        os.set_blocking(self.fd, False)
+        self._watch()
+    
+    def pause(self):
+        """Stop reading until resume() is called (used for backpressure)."""
+        self._paused = True
+        self._unwatch()
+    
+    def resume(self):
+        """Resume reading after pause()."""
+        if self._paused:
+            self._paused = False
+            self._watch()
+    
+    def stop(self):
+        """Stop watching the fd. The caller owns closing it."""
+        self._closed = True
+        self._unwatch()
+    
+    def _watch(self):
+        if not self._watching and not self._paused and not self._closed:
+            self._loop.add_reader(self.fd, self._on_readable)
+            self._watching = True
+    
+    def _unwatch(self):
+        if self._watching:
+            self._watching = False
+            try:
+                self._loop.remove_reader(self.fd)
+            except (ValueError, OSError):
+                pass
+    
+    def _on_readable(self):
+        try:
+            data = os.read(self.fd, self.read_size)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            # EIO is expected when the other side of the PTY closes
+            self._close("EIO" if e.errno == errno.EIO else str(e))
+            return
+        if not data:
+            self._close("EOF")
+            return
+        self.on_data(data)
+    
+    def _close(self, reason: str):
+        self.stop()
+        self.on_close(reason)
+
+
+class PtyWriter:
+    """Writes input to a PTY master fd without blocking the event loop.
+    
+    Input is queued and written as far as the PTY will take it; the rest is
+    finished from ``loop.add_writer`` callbacks as the program on the other
+    side reads, so a full PTY buffer or a partial write never loses or
+    reorders bytes. write() waits while more than ``limit`` bytes are queued,
+    which holds up the WebSocket message loop that called it and so pushes
+    back on the sending client.
+    """
+    
+    def __init__(self, fd: int, on_close, limit: int = INPUT_QUEUE_LIMIT):
+        self.fd = fd
+        self.on_close = on_close
+        self.limit = limit
+        self._queue = deque()  # memoryviews of input not yet written
+        self._queued_bytes = 0
+        self._accepted = 0  # Bytes queued in all
+        self._written = 0  # Bytes written in all
+        self._marks = deque()  # (end offset, callback) for write(on_written=...)
+        self._drained = asyncio.Event()  # Set while the queue is within limit
+        self._drained.set()
+        self._loop = asyncio.get_running_loop()
+        self._watching = False
+        self._closed = False
+        os.set_blocking(fd, False)
+    
+    @property
+    def queue_depth(self) -> int:
+        """Bytes queued but not yet written to the PTY."""
+        return self._queued_bytes
+    
+    async def write(self, data: bytes, on_written=None):
+        """Queue input for the PTY, waiting while the queue is over the limit.
+        
+        ``on_written()`` is called once the last of ``data`` is written.
+        """
+        if self._closed:
+            raise BrokenPipeError("PTY is closed")
+        if not data:
+            return
+        self._queue.append(memoryview(data))
+        self._queued_bytes += len(data)
+        self._accepted += len(data)
+        if on_written:
+            self._marks.append((self._accepted, on_written))
+        if not self._watching:
+            self._on_writable()
+        if self._closed:
+            raise BrokenPipeError("PTY is closed")
+        while self._queued_bytes > self.limit:
+            self._drained.clear()
+            await self._drained.wait()
+    
+    def stop(self):
+        """Stop writing and drop queued input. The caller owns closing the fd."""
+        self._closed = True
+        self._queue.clear()
+        self._queued_bytes = 0
+        self._marks.clear()
+        self._drained.set()
+        self._unwatch()
+    
+    def _on_writable(self):
+        while self._queue:
+            chunk = self._queue[0]
+            try:
+                written = os.write(self.fd, chunk)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                self._close("EIO" if e.errno == errno.EIO else str(e))
+                return
+            self._queued_bytes -= written
+            self._written += written
+            if written < len(chunk):
+                self._queue[0] = chunk[written:]
+                break  # PTY buffer is full
+            self._queue.popleft()
+        while self._marks and self._marks[0][0] <= self._written:
+            self._marks.popleft()[1]()
+        if self._queue:
+            if not self._watching:
+                self._loop.add_writer(self.fd, self._on_writable)
+                self._watching = True
+        else:
+            self._unwatch()
+        if self._queued_bytes <= self.limit:
+            self._drained.set()
+    
+    def _unwatch(self):
+        if self._watching:
+            self._watching = False
+            try:
+                self._loop.remove_writer(self.fd)
+            except (ValueError, OSError):
+                pass
+    
+    def _close(self, reason: str):
+        self.stop()
+        self.on_close(reason)
+
+
+class _ClientInput:
+    """One client's queued input and rate-limit bucket in an InputScheduler."""
+    
+    __slots__ = ("queue", "queued_bytes", "pushed", "taken", "marks", "tokens", "refilled", "drained")
+    
+    def __init__(self, burst: float, now: float):
+        self.queue = deque()
+        self.queued_bytes = 0
+        self.pushed = 0  # Bytes queued in all
+        self.taken = 0  # Bytes taken for writes in all
+        self.marks = deque()  # (end offset, callback) for push(on_written=...)
+        self.tokens = burst
+        self.refilled = now
+        self.drained = asyncio.Event()
+        self.drained.set()
+
+
+class InputScheduler:
+    """Merges input from the clients of one session into PTY writes.
+    
+    Each client's messages queue separately and are written by one task.
+    Everything a client has queued goes out as a single write, so a burst
+    of keystrokes costs one syscall, and clients take turns of at most
+    ``quantum`` bytes, so one client's paste or macro delays another's
+    keystrokes by a turn rather than by the whole paste. A message is only
+    split at an OutputTokenizer boundary, which keeps another client's
+    input out of the middle of an escape sequence or character.
+    
+    With a ``rate`` (bytes/sec), each client has a token bucket holding up
+    to ``burst`` bytes. push() waits while more than ``limit`` bytes from
+    that client are queued, pushing back on its WebSocket.
+    """
+    
+    def __init__(self, deliver, quantum: int = INPUT_QUANTUM, rate: float = INPUT_RATE,
+                 burst: int = INPUT_BURST, limit: int = INPUT_QUEUE_LIMIT):
+        self.deliver = deliver  # async callable taking bytes
+        self.quantum = quantum
+        self.rate = rate
+        self.burst = burst
+        self.limit = limit
+        self._clients = {}  # client key -> _ClientInput, in turn order
+        self._wakeup = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._task = None
+        self.writes = 0
+    
+    @property
+    def queue_depth(self) -> int:
+        """Bytes queued across all clients."""
+        return sum(entry.queued_bytes for entry in self._clients.values())
+    
+    async def push(self, client, data: bytes, on_written=None):
+        """Queue input from a client, waiting while it has too much queued.
+        
+        ``on_written()`` is called once the write carrying the last of
+        ``data`` has been delivered; ``deliver`` is then passed an
+        ``on_written`` callback of its own to call when it is written.
+        """
+        if not data:
+            return
+        entry = self._clients.get(client)
+        if entry is None:
+            entry = self._clients[client] = _ClientInput(self.burst, self._loop.time())
+        entry.queue.append(data)
+        entry.queued_bytes += len(data)
+        entry.pushed += len(data)
+        if on_written:
+            entry.marks.append((entry.pushed, on_written))
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+        while entry.queued_bytes > self.limit and self._clients.get(client) is entry:
+            entry.drained.clear()
+            await entry.drained.wait()
+    
+    def remove(self, client):
+        """Forget a client, dropping input it still has queued."""
+        entry = self._clients.pop(client, None)
+        if entry is not None:
+            entry.drained.set()
+    
+    def close(self):
+        for client in list(self._clients):
+            self.remove(client)
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while True:
+                data, retry, marks = self._take_turns()
+                if data:
+                    self.writes += 1
+                    try:
+                        if marks:
+                            await self.deliver(data, on_written=lambda marks=marks: _call_all(marks))
+                        else:
+                            await self.deliver(data)
+                    except Exception as e:
+                        print(f"Error writing to terminal: {e}")
+                elif retry:
+                    await asyncio.sleep(retry)  # Rate limited
+                else:
+                    break
+    
+    def _take_turns(self) -> tuple:
+        """Input for one round of turns, how long to wait if all of it is rate
+        limited, and the on_written callbacks of messages it completes."""
+        now = self._loop.time()
+        parts = []
+        marks = []
+        retry = None
+        for entry in self._clients.values():
+            if not entry.queue:
+                continue
+            allowance = self.quantum
+            if self.rate > 0:
+                entry.tokens = min(self.burst, entry.tokens + (now - entry.refilled) * self.rate)
+                entry.refilled = now
+                # Wait until the next message (or a full turn) can go at once
+                needed = min(len(entry.queue[0]), self.quantum, self.burst)
+                if entry.tokens < needed:
+                    wait = (needed - entry.tokens) / self.rate
+                    retry = wait if retry is None else min(retry, wait)
+                    continue
+                allowance = min(allowance, int(entry.tokens))
+            taken = self._take(entry, allowance)
+            entry.tokens -= len(taken)
+            parts.append(taken)
+            while entry.marks and entry.marks[0][0] <= entry.taken:
+                marks.append(entry.marks.popleft()[1])
+            if entry.queued_bytes <= self.limit:
+                entry.drained.set()
+        return b"".join(parts), retry, marks
+    
+    @staticmethod
+    def _take(entry: _ClientInput, allowance: int) -> bytes:
+        """Up to allowance bytes of whole messages from the client's queue."""
+        taken = []
+        size = 0
+        while entry.queue and size + len(entry.queue[0]) <= allowance:
+            message = entry.queue.popleft()
+            taken.append(message)
+            size += len(message)
+        if not taken:
+            # The next message alone is over the allowance: split it safely
+            message = entry.queue.popleft()
+            tokenizer = OutputTokenizer()
+            head = tokenizer.feed(message[:allowance]) or message[:allowance]
+            entry.queue.appendleft(message[len(head):])
+            taken.append(head)
+            size = len(head)
+        entry.queued_bytes -= size
+        entry.taken += size
+        return taken[0] if len(taken) == 1 else b"".join(taken)
+
+
+def _call_all(callbacks):
+    for callback in callbacks:
+        callback()
+
+
+class OutputRing:
+    """Byte-bounded buffer of recent output, addressed by stream offset.
+    
+    The sequence number of a byte is its offset in the session's output
+    stream, so a client's position is simply how many bytes it has seen.
+    """
+    
+    def __init__(self, limit: int = RING_BUFFER_BYTES, seq: int = 0):
+        self.limit = limit
+        self.seq = seq  # Offset just past the newest byte
+        self._chunks = deque()  # (start offset, bytes)
+        self._size = 0
+    
+    @property
+    def start(self) -> int:
+        """Oldest offset still held."""
+        return self.seq - self._size
+    
+    def append(self, data: bytes):
+        self._chunks.append((self.seq, data))
+        self.seq += len(data)
+        self._size += len(data)
+        while self._size - len(self._chunks[0][1]) >= self.limit:
+            _, old = self._chunks.popleft()
+            self._size -= len(old)
+    
+    def read(self, seq: int, limit: int):
+        """Up to limit bytes from offset seq, or None if seq is not in the buffer."""
+        if seq > self.seq or seq < self.start:
+            return None
+        # Find the chunk holding seq, searching from the newest end
+        first = len(self._chunks) - 1
+        while first > 0 and self._chunks[first][0] > seq:
+            first -= 1
+        parts = []
+        size = 0
+        for i in range(max(first, 0), len(self._chunks)):
+            start, data = self._chunks[i]
+            offset = max(seq - start, 0)
+            part = data[offset:offset + limit - size]
+            parts.append(part)
+            size += len(part)
+            if size >= limit:
+                break
+        return b"".join(parts)
+    
+    def since(self, seq: int):
+        """Bytes from offset seq up to now, or None if seq is not in the buffer."""
+        if seq > self.seq or seq < self.start:
+            return None
+        parts = []
+        for start, data in reversed(self._chunks):
+            if start + len(data) <= seq:
+                break
+            parts.append(data[max(seq - start, 0):])
+        return b"".join(reversed(parts))
+
+
+# A proper prefix of an escape sequence, from ESC to the end of the output
+_ESCAPE_INCOMPLETE = re.compile(
+    rb"\x1b(?:"
+    rb"\[[0-?]*[ -/]*"  # CSI: parameters, intermediates
+    rb"|[\]PX^_][^\x07\x1b]*"  # OSC, DCS, SOS, PM, APC: until BEL or ST
+    rb"|[ -/]*"  # Two-byte escapes, possibly with intermediates
+    rb")\Z"
+)
+_STRING_OPEN = re.compile(rb"\x1b[\]PX^_][^\x07\x1b]*\Z")  # Unterminated OSC/DCS/...
+
+
+class OutputTokenizer:
+    """Finds where PTY output can be cut without splitting a sequence.
+    
+    ``feed()`` returns the longest prefix of the output so far that ends
+    between escape sequences and between UTF-8 characters, and holds back
+    the rest until more output completes it. Only the tail of each chunk is
+    examined (the last ESC and the last few bytes), with C-speed searches,
+    so the cost per byte is tiny. A held tail longer than ``max_hold`` is
+    given up on and released as is.
+    """
+    
+    def __init__(self, max_hold: int = FRAME_MAX_BYTES):
+        self.max_hold = max_hold
+        self._held = b""
+    
+    @property
+    def held(self) -> int:
+        """Bytes held back as the start of an incomplete sequence."""
+        return len(self._held)
+    
+    def feed(self, data: bytes) -> bytes:
+        """Add output; return the part that is safe to send now."""
+        buf = self._held + data if self._held else data
+        end = len(buf)
+        esc = buf.rfind(b"\x1b")
+        if esc >= 0 and _ESCAPE_INCOMPLETE.match(buf, esc):
+            end = esc
+            if esc == len(buf) - 1 and esc > 0:
+                # A lone ESC may start the ST ending an earlier OSC/DCS
+                start = buf.rfind(b"\x1b", 0, esc)
+                if start >= 0 and _STRING_OPEN.match(buf, start, esc):
+                    end = start
+        else:
+            end -= _utf8_incomplete(buf)
+        if len(buf) - end > self.max_hold:
+            end = len(buf)
+        if end == len(buf):
+            self._held = b""
+            return buf
+        self._held = buf[end:]
+        return buf[:end]
+    
+    def flush(self) -> bytes:
+        """Give up on the held tail and return it."""
+        held, self._held = self._held, b""
+        return held
+
+
+def _utf8_incomplete(buf: bytes) -> int:
+    """Length of a truncated UTF-8 character at the end of buf, or 0."""
+    for back in range(1, min(4, len(buf) + 1)):
+        byte = buf[-back]
+        if byte < 0x80:
+            return 0
+        if byte >= 0xC0:
+            needed = 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+            return back if back < needed else 0
+    return 0
+
+
+class OutputCoalescer:
+    """Batches PTY output into fewer, larger frames.
+    
+    A small read that arrives after at least one quiet window is flushed at
+    once, so interactive echo is not delayed. Anything else is buffered
+    until FRAME_MAX_BYTES accumulate or the window expires. Frames are cut
+    at OutputTokenizer boundaries; an incomplete sequence is sent once
+    output has been quiet for SEQUENCE_HOLD.
+    """
+    
+    def __init__(self, on_flush, window: float = COALESCE_WINDOW,
+                 max_bytes: int = FRAME_MAX_BYTES):
+        self.on_flush = on_flush
+        self.window = window
+        self.max_bytes = max_bytes
+        self._tokenizer = OutputTokenizer(max_hold=max_bytes)
+        self._buffer = []
+        self._size = 0
+        self._timer = None
+        self._last_flush = 0.0
+        self._last_push = 0.0
+        self._loop = asyncio.get_running_loop()
+    
+    @property
+    def pending(self) -> int:
+        """Bytes pushed but not yet flushed."""
+        return self._size + self._tokenizer.held
+    
+    def push(self, data: bytes):
+        now = self._loop.time()
+        self._last_push = now
+        data = self._tokenizer.feed(data)
+        if (data and not self._buffer and len(data) <= INTERACTIVE_MAX_BYTES
+                and now - self._last_flush >= self.window):
+            self._last_flush = now
+            self.on_flush(data)
+        elif data:
+            self._buffer.append(data)
+            self._size += len(data)
+            if self._size >= self.max_bytes or self.window <= 0:
+                self._emit()
+        if self._timer is None and (self._buffer or self._tokenizer.held):
+            delay = self.window if self._buffer else SEQUENCE_HOLD
+            self._timer = self._loop.call_at(now + delay, self._expire)
+    
+    def flush(self):
+        """Emit everything buffered as one chunk, including an incomplete sequence."""
+        held = self._tokenizer.flush()
+        if held:
+            self._buffer.append(held)
+            self._size += len(held)
+        self._emit()
+    
+    def _expire(self):
+        self._timer = None
+        if self._tokenizer.held and self._loop.time() - self._last_push >= SEQUENCE_HOLD:
+            self.flush()
+        else:
+            self._emit()
+        if self._tokenizer.held:
+            self._timer = self._loop.call_at(self._last_push + SEQUENCE_HOLD, self._expire)
+    
+    def _emit(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._buffer:
+            return
+        data = self._buffer[0] if len(self._buffer) == 1 else b"".join(self._buffer)
+        self._buffer.clear()
+        self._size = 0
+        self._last_flush = self._loop.time()
+        self.on_flush(data)
+
+
+if pyte is not None:
+    _SGR_NAMED = {}  # (is background, pyte color name) -> SGR code
+    for _codes, _bg in ((pyte.graphics.FG_ANSI, False), (pyte.graphics.FG_AIXTERM, False),
+                        (pyte.graphics.BG_ANSI, True), (pyte.graphics.BG_AIXTERM, True)):
+        for _code, _name in _codes.items():
+            _SGR_NAMED.setdefault((_bg, _name), str(_code))
+    _SGR_256 = {}  # hex color -> 256-color palette index
+    for _index, _hex in enumerate(pyte.graphics.FG_BG_256):
+        _SGR_256.setdefault(_hex, _index)
+
+
+class ScreenModel:
+    """Server-side copy of a session's visible screen, kept by feeding it output.
+    
+    Joining clients are drawn from it (screen, colors, cursor and modes in
+    one frame) instead of asking tmux. ``seq`` is the output stream offset
+    the model has been fed up to. Scrollback is left to tmux, since the
+    attach stream is tmux's rendering and skips lines during fast output.
+    """
+    
+    # Private modes restored on the client along with the screen
+    MODES = (1, 1000, 1002, 1003, 1006, 2004)
+    
+    def __init__(self, cols: int, rows: int, seq: int = 0):
+        self.screen = pyte.Screen(cols, rows)
+        self._stream = pyte.ByteStream(self.screen)
+        self._rows = [()] * rows  # Cells of each row, refreshed from screen.dirty
+        self.seq = seq
+    
+    @property
+    def size(self) -> tuple:
+        return self.screen.columns, self.screen.lines
+    
+    def feed(self, data: bytes):
+        self._stream.feed(data)
+        self.seq += len(data)
+    
+    def render_scrollback(self, lines: list) -> str:
+        """Escape sequences that put lines (as from ``capture-pane -e``) in the scrollback.
+        
+        Goes ahead of render(), which then draws the screen below them.
+        """
+        rows = self.screen.lines
+        # Scroll what is still on screen up after the last line
+        return ("\x1b[0m\x1b[H\x1b[2J" + "\x1b[0m\r\n".join(lines)
+                + f"\x1b[0m\x1b[{rows};1H" + "\n" * min(len(lines), rows))
+    
+    def render(self) -> str:
+        """Escape sequences that redraw the screen on a reset terminal."""
+        text, _ = self.diff(None)
+        return text
+    
+    def diff(self, state):
+        """Escape sequences that bring a client from ``state`` to the current screen.
+        
+        Returns ``(text, state)``; pass the new state to the next call.
+        ``None`` is a reset terminal, so the text is a full redraw. ``text``
+        is empty if nothing visible changed.
+        """
+        rows = self.rows()
+        new = (rows,) + self._render_state()
+        if state is not None and len(state[0]) != len(rows):
+            state = None  # Resized
+        if state is None:
+            out = ["\x1b[0m\x1b[H\x1b[2J"]
+            old = self._reset_state()
+        else:
+            if state == new:
+                return "", state
+            out = []
+            old = state
+        old_rows, old_margins = self._scroll(old[0], rows, old[1], out)
+        for y, row in enumerate(rows):
+            if row != old_rows[y]:
+                out.append(self._render_change(y, old_rows[y], row))
+        _, margins, modes, position, pen, visibility = new
+        if margins != old_margins:
+            out.append(margins)
+        out.extend(mode for mode, old_mode in zip(modes, old[2]) if mode != old_mode)
+        if out or position != old[3]:
+            out.append(position)
+        if pen != old[4] or (out and pen != "\x1b[0m"):
+            out.append(pen)  # Rows are written with the pen reset afterwards
+        if visibility != old[5]:
+            out.append(visibility)
+        return "".join(out), new
+    
+    def rows(self) -> list:
+        """The screen as a tuple of cells per row, without trailing blanks."""
+        screen = self.screen
+        for y in screen.dirty:
+            if y < screen.lines:
+                line = screen.buffer[y]
+                end = screen.columns
+                while end and self._blank(line[end - 1]):
+                    end -= 1
+                self._rows[y] = tuple(line[x] for x in range(end))
+        screen.dirty.clear()
+        return list(self._rows)
+    
+    @staticmethod
+    def _blank(char) -> bool:
+        """True if the cell looks the same as a cleared one."""
+        return (char.data == " " and char.bg == "default"
+                and not (char.reverse or char.underscore or char.strikethrough))
+    
+    def _reset_state(self) -> tuple:
+        """diff() state of a freshly reset terminal."""
+        lines = self.screen.lines
+        return ([()] * lines, f"\x1b[1;{lines}r", tuple(f"\x1b[?{mode}l" for mode in self.MODES),
+                None, "\x1b[0m", "\x1b[?25h")
+    
+    @staticmethod
+    def _scroll(old: list, rows: list, margins: str, out: list) -> tuple:
+        """Scroll the client's rows into place if that saves redrawing them.
+        
+        Looks for the shift of the region above any unchanged bottom rows
+        (e.g. a status line) that lines up the most rows, and appends the
+        escape sequences to out. Returns the rows and margins the client
+        now has.
+        """
+        n = len(rows)
+        while n > 1 and old[n - 1] == rows[n - 1] and rows[n - 1]:
+            n -= 1
+        best, best_matches = 0, sum(1 for y in range(n) if old[y] == rows[y] and rows[y])
+        for shift in range(1, n):
+            matches = sum(1 for y in range(n - shift) if old[y + shift] == rows[y] and rows[y])
+            if matches > best_matches:
+                best, best_matches = shift, matches
+        if not best:
+            return old, margins
+        region = f"\x1b[1;{n}r"
+        out.append("\x1b[0m" + (region if region != margins else "") + f"\x1b[{n};1H" + "\n" * best)
+        return old[best:n] + [()] * best + old[n:], region
+    
+    def _render_state(self) -> tuple:
+        """Margins, modes, cursor position, pen and cursor visibility, to follow the rows."""
+        screen = self.screen
+        cursor = screen.cursor
+        top, bottom = screen.margins or (0, screen.lines - 1)
+        return (
+            f"\x1b[{top + 1};{bottom + 1}r",
+            tuple(f"\x1b[?{mode}{'h' if (mode << 5) in screen.mode else 'l'}" for mode in self.MODES),
+            f"\x1b[{cursor.y + 1};{min(cursor.x, screen.columns - 1) + 1}H",
+            self._sgr(cursor.attrs),
+            "\x1b[?25l" if cursor.hidden else "\x1b[?25h",
+        )
+    
+    def _render_change(self, y: int, old: tuple, new: tuple) -> str:
+        """Redraw the part of row y that differs between old and new cells."""
+        start = 0
+        while start < len(old) and start < len(new) and old[start] == new[start]:
+            start += 1
+        # Never start or end inside a wide character, on either side
+        while start and ((start < len(new) and not new[start].data)
+                         or (start < len(old) and not old[start].data)):
+            start -= 1
+        if len(old) != len(new):
+            end = len(new)
+        else:
+            end = len(new)
+            while end > start and old[end - 1] == new[end - 1]:
+                end -= 1
+            while end < len(new) and not (new[end].data and old[end].data):
+                end += 1
+        out = f"\x1b[{y + 1};{start + 1}H{self._render_cells(new, start, end)}\x1b[0m"
+        if len(old) > len(new):
+            out += "\x1b[K"
+        return out
+    
+    def _render_cells(self, cells: tuple, start: int = 0, end: int = None) -> str:
+        out = []
+        pen = self.screen.default_char
+        for char in cells[start:end]:
+            if not char.data:
+                continue  # Second cell of a wide character
+            if char[1:] != pen[1:]:
+                out.append(self._sgr(char))
+                pen = char
+            out.append(char.data)
+        return "".join(out)
+    
+    @staticmethod
+    def _sgr(char) -> str:
+        codes = ["0"]
+        for attr, code in (("bold", "1"), ("italics", "3"), ("underscore", "4"),
+                           ("blink", "5"), ("reverse", "7"), ("strikethrough", "9")):
+            if getattr(char, attr):
+                codes.append(code)
+        for color, bg in ((char.fg, False), (char.bg, True)):
+            if color == "default":
+                continue
+            named = _SGR_NAMED.get((bg, color))
+            if named:
+                codes.append(named)
+            elif color in _SGR_256:
+                codes.append(f"{48 if bg else 38};5;{_SGR_256[color]}")
+            elif len(color) == 6:
+                r, g, b = (int(color[i:i + 2], 16) for i in (0, 2, 4))
+                codes.append(f"{48 if bg else 38};2;{r};{g};{b}")
+        return "\x1b[" + ";".join(codes) + "m"
+
+
+def new_utf8_decoder():
+    """Incremental UTF-8 decoder that carries split characters across reads."""
+    return codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+
+def wants_binary(ws: web.WebSocketResponse) -> bool:
+    """True if the client negotiated raw binary frames."""
+    return ws.ws_protocol == BINARY_PROTOCOL
+
+
+def parse_control(data: str):
+    """A JSON control message from a binary-mode client's text frame, or None if malformed."""
+    try:
+        message = json.loads(data)
+    except ValueError:
+        return None
+    return message if isinstance(message, dict) else None
+
+
+def parse_size(cols, rows):
+    """(cols, rows) from client-supplied values, or None if they aren't a usable size."""
+    try:
+        cols, rows = int(cols), int(rows)
+    except (TypeError, ValueError):
+        return None
+    if not (1 < cols <= MAX_COLS and 1 < rows <= MAX_ROWS):
+        return None
+    return cols, rows
+
+
+def pick_size(sizes, policy: str = SIZE_POLICY):
+    """The size to give a terminal from its viewers' (cols, rows, reported_at), or None."""
+    sizes = list(sizes)
+    if not sizes:
+        return None
+    if policy == "latest":
+        cols, rows, _ = max(sizes, key=lambda size: size[2])
+        return cols, rows
+    pick = max if policy == "largest" else min
+    return pick(size[0] for size in sizes), pick(size[1] for size in sizes)
+
+
+def set_pty_size(fd: int, cols: int, rows: int):
+    """Set a PTY's window size; the process on it gets SIGWINCH."""
+    fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack("HHHH", rows, cols, 0, 0))
+
+
+class OutputFrame:
+    """A WebSocket message whose wire bytes are built once and shared by every client.
+    
+    Each client's transport gets the exact same bytes, so framing and
+    permessage-deflate cost stays flat as viewers are added. Compressed
+    frames use a fresh compressor per message, which any client that
+    negotiated deflate can decode regardless of its context takeover
+    setting; frames are cached per negotiated window size.
+    """
+    
+    __slots__ = ("payload", "opcode", "_wire")
+    
+    def __init__(self, payload: bytes, opcode: int = aiohttp.WSMsgType.BINARY):
+        self.payload = payload
+        self.opcode = opcode
+        self._wire = {}
+    
+    def __len__(self):
+        return len(self.payload)
+    
+    def wire(self, compress: int = 0) -> bytes:
+        """Complete frame bytes for a client with the given deflate window bits (0 = none)."""
+        frame = self._wire.get(compress)
+        if frame is None:
+            frame = self._wire[compress] = encode_frame(self.payload, self.opcode, compress)
+        return frame
+
+
+def encode_frame(payload: bytes, opcode: int, compress: int = 0) -> bytes:
+    """Build an unmasked server-to-client WebSocket frame."""
+    rsv = 0
+    if compress and payload:
+        compressor = zlib.compressobj(zlib.Z_BEST_SPEED, zlib.DEFLATED, -compress)
+        payload = compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if payload.endswith(b"\x00\x00\xff\xff"):
+            payload = payload[:-4]
+        rsv = 0x40
+    first = 0x80 | rsv | opcode
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", first, length)
+    elif length < 65536:
+        header = struct.pack("!BBH", first, 126, length)
+    else:
+        header = struct.pack("!BBQ", first, 127, length)
+    return header + payload
+
+
+def raw_frame_sink(ws: web.WebSocketResponse):
+    """Transport, protocol and deflate window bits behind a prepared WebSocket.
+    
+    Returns None if this aiohttp version doesn't expose them, in which case
+    frames go out through the public send API instead.
+    """
+    writer = getattr(ws, "_writer", None)
+    transport = getattr(writer, "transport", None)
+    protocol = getattr(writer, "protocol", None)
+    if transport is None or not hasattr(protocol, "_drain_helper"):
+        return None
+    return transport, protocol, getattr(writer, "compress", 0) or 0
+
+
+def reap_child(pid: int, attempts: int = 10):
+    """Collect an exited child without blocking, retrying briefly if it is still alive."""
+    try:
+        done, _ = os.waitpid(pid, os.WNOHANG)
+    except ChildProcessError:
+        return
+    if done == 0 and attempts > 0:
+        asyncio.get_running_loop().call_later(0.5, reap_child, pid, attempts - 1)
+
+
+class LinkMonitor:
+    """Round-trip time and drain rate of one client's connection.
+    
+    Every ADAPT_PROBE_INTERVAL a ping carrying its send time is written
+    behind whatever the client already has in flight, so its RTT includes
+    time spent in socket buffers as well as on the network. When the pong
+    comes back, everything written before the ping has been delivered: the
+    bytes delivered between two pongs over the time between them give a
+    drain rate sample. A sample counts as the link's capacity only if the
+    ping was held up behind queued data; otherwise it can only raise the
+    estimate.
+    
+    The client's current writer is the ``owner`` and has ``adapt()`` called
+    after every probe. Outlives writers when a client changes transport.
+    """
+    
+    def __init__(self, ws: web.WebSocketResponse, transport):
+        self.ws = ws
+        self.owner = None
+        self.rtt = None  # Smoothed RTT in seconds, None before the first pong
+        self.last_rtt = None
+        self.min_rtt = None
+        self.drain_rate = None  # Bytes/sec, None until the link has been seen busy
+        self.wire_bytes = 0  # Written to the transport so far
+        self._transport = transport
+        self._ping = None  # (payload, sent at, wire_bytes at send) of the ping in flight
+        self._delivered = None  # (time, wire_bytes) as of the last pong
+        self._timer = None
+        self._loop = asyncio.get_running_loop()
+    
+    def start(self):
+        if self._timer is None:
+            self._timer = self._loop.call_later(ADAPT_PROBE_INTERVAL, self._probe)
+    
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+    
+    @property
+    def queue_delay(self) -> float:
+        """Seconds the latest RTT (or a ping still in flight) is above the minimum.
+        
+        Zero until the client has answered a ping, so clients that never
+        answer are left alone.
+        """
+        if self.min_rtt is None:
+            return 0.0
+        rtt = self.last_rtt
+        if self._ping is not None:
+            rtt = max(rtt, self._loop.time() - self._ping[1])
+        return max(0.0, rtt - self.min_rtt)
+    
+    def pong(self, payload: bytes):
+        """Handle a pong from the client."""
+        if self._ping is None or payload != self._ping[0]:
+            return
+        _, sent, written = self._ping
+        self._ping = None
+        now = self._loop.time()
+        sample = self.last_rtt = now - sent
+        self.min_rtt = sample if self.min_rtt is None else min(self.min_rtt, sample)
+        self.rtt = sample if self.rtt is None else 0.875 * self.rtt + 0.125 * sample
+        if self._delivered is not None:
+            then, before = self._delivered
+            rate = (written - before) / max(now - then, 1e-3)
+            if sample - self.min_rtt > max(ADAPT_FAST_RTT, self.min_rtt):
+                self.drain_rate = (rate if self.drain_rate is None
+                                   else 0.75 * self.drain_rate + 0.25 * rate)
+            elif self.drain_rate is not None and rate > self.drain_rate:
+                self.drain_rate = rate
+        self._delivered = (now, written)
+    
+    def stats(self) -> dict:
+        return {
+            "rtt_ms": round(self.rtt * 1000, 1) if self.rtt is not None else None,
+            "min_rtt_ms": round(self.min_rtt * 1000, 1) if self.min_rtt is not None else None,
+            "queue_delay_ms": round(self.queue_delay * 1000, 1),
+            "drain_bytes_per_sec": int(self.drain_rate) if self.drain_rate else None,
+        }
+    
+    def _probe(self):
+        self._timer = None
+        if self.ws.closed or self._transport.is_closing():
+            return
+        if self._ping is None:
+            now = self._loop.time()
+            payload = struct.pack("!d", now)
+            self._transport.write(encode_frame(payload, aiohttp.WSMsgType.PING))
+            self._ping = (payload, now, self.wire_bytes)
+        if self.owner is not None:
+            self.owner.adapt()
+        self.start()
+
+
+class EchoProbe:
+    """One keystroke on its way through the server, with loop times of each step."""
+    
+    __slots__ = ("client", "id", "data", "match", "received", "written", "read", "sent",
+                 "target", "frame_set", "timer")
+    
+    def __init__(self, client, probe_id, data: bytes, match: bytes, received: float):
+        self.client = client
+        self.id = probe_id
+        self.data = data
+        self.match = match
+        self.received = received
+        self.written = self.read = self.sent = None
+        self.target = None  # Output stream offset just past the echo, once read
+        self.frame_set = False  # The frame carrying the echo is known
+        self.timer = None
+
+
+class EchoProbes:
+    """Keystroke-to-echo probes in flight for one session.
+    
+    A binary client sends ``{"type": "probe", "id": ID, "data": KEYS}``
+    (optionally with ``"match"``, the output that counts as the echo; KEYS
+    by default). KEYS are typed like any other input, and the probe is
+    stamped when the message is received, when the input is written to the
+    PTY (or sent to tmux), when output containing the match is first read,
+    and when the frame carrying that output is handed to the client's
+    socket. The client then gets ``{"type": "probe", "id": ID, "stages_ms":
+    {"queue": .., "echo": .., "output": ..}, "server_ms": ..}``; its round
+    trip minus ``server_ms`` is the network's share. Stage times also go to
+    ECHO_STAGE_SECONDS and to per-client summaries.
+    """
+    
+    def __init__(self, session: str, on_done):
+        self.pending = []
+        self._on_done = on_done  # callback(probe, message)
+        self._stage_metrics = [ECHO_STAGE_SECONDS.labels(session, stage) for stage in ECHO_STAGES]
+        self._recent = {}  # client -> deque of recent stage times, in ms
+        self._loop = asyncio.get_running_loop()
+    
+    def start(self, client, message: dict):
+        """A probe for the message, or None if it is malformed or the client has too many in flight."""
+        data = message.get("data")
+        match = message.get("match", data)
+        if not isinstance(data, str) or not data or not isinstance(match, str) or not match:
+            return None
+        if sum(1 for probe in self.pending if probe.client is client) >= PROBE_MAX_PENDING:
+            return None
+        probe = EchoProbe(client, message.get("id"), data.encode("utf-8"), match.encode("utf-8"),
+                          self._loop.time())
+        probe.timer = self._loop.call_later(PROBE_TIMEOUT, self._finish, probe)
+        self.pending.append(probe)
+        return probe
+    
+    def written(self, probe: EchoProbe):
+        if probe.written is None:
+            probe.written = self._loop.time()
+    
+    def output(self, data: bytes, position: int):
+        """Look for echoes in output read from the PTY, which starts at stream offset ``position``."""
+        for probe in self.pending:
+            if probe.written is not None and probe.read is None:
+                index = data.find(probe.match)
+                if index >= 0:
+                    probe.read = self._loop.time()
+                    probe.target = position + index + len(probe.match)
+    
+    def due(self, seq: int) -> list:
+        """Probes whose echo is in the output up to stream offset ``seq``, not yet given a frame."""
+        due = [probe for probe in self.pending
+               if probe.target is not None and not probe.frame_set and probe.target <= seq]
+        for probe in due:
+            probe.frame_set = True
+        return due
+    
+    def sent(self, probe: EchoProbe):
+        if probe.sent is None:
+            probe.sent = self._loop.time()
+            self._finish(probe)
+    
+    def remove(self, client):
+        """Forget a client's probes and summaries."""
+        for probe in [probe for probe in self.pending if probe.client is client]:
+            probe.timer.cancel()
+            self.pending.remove(probe)
+        self._recent.pop(client, None)
+    
+    def close(self):
+        for probe in self.pending:
+            probe.timer.cancel()
+        self.pending.clear()
+    
+    def summary(self, client) -> dict:
+        """p50 and max of each stage over the client's recent probes, in ms."""
+        recent = self._recent.get(client)
+        if not recent:
+            return None
+        summary = {"count": len(recent)}
+        for i, stage in enumerate(ECHO_STAGES):
+            ordered = sorted(stages[i] for stages in recent)
+            summary[stage] = {"p50": round(ordered[len(ordered) // 2], 2), "max": round(ordered[-1], 2)}
+        return summary
+    
+    def _finish(self, probe: EchoProbe):
+        if probe not in self.pending:
+            return
+        self.pending.remove(probe)
+        probe.timer.cancel()
+        stamps = (probe.received, probe.written, probe.read, probe.sent)
+        stages = {}
+        for i, stage in enumerate(ECHO_STAGES):
+            if stamps[i + 1] is not None:
+                stages[stage] = round((stamps[i + 1] - stamps[i]) * 1000, 3)
+        message = {"type": "probe", "id": probe.id, "stages_ms": stages}
+        if probe.sent is None:
+            message["timeout"] = True
+        else:
+            message["server_ms"] = round((probe.sent - probe.received) * 1000, 3)
+            for i, metric in enumerate(self._stage_metrics):
+                metric.observe(stamps[i + 1] - stamps[i])
+            recent = self._recent.get(probe.client)
+            if recent is None:
+                recent = self._recent[probe.client] = deque(maxlen=100)
+            recent.append(tuple(stages[stage] for stage in ECHO_STAGES))
+        self._on_done(probe, message)
+
+
+class ClientWriter:
+    """Bounded outbound queue for one WebSocket, drained by its own writer task.
+    
+    The shared session pushes output without awaiting, so a slow client can
+    never hold up the PTY or the other viewers. A client that falls more than
+    CLIENT_QUEUE_LIMIT bytes behind has its backlog dropped and receives a
+    fresh screen snapshot instead.
+    
+    Queued items are OutputFrames shared with the other clients; the writer
+    copies their prebuilt bytes straight to the transport. Once a client is
+    handed to a ClientWriter, all of its data frames must go through it so
+    the client's deflate window stays consistent.
+    
+    ``source`` provides ``snapshot(history)`` (the redraw and the stream
+    offset it is current to), the current stream ``seq``, the terminal
+    ``size`` and ``has_screen``. Binary clients get JSON control
+    messages in text frames; a snapshot is announced with ``{"type":
+    "snapshot", "seq": N, "cols": C, "rows": R}`` and followed by one binary
+    frame, after which each binary frame advances the
+    offset from N. When the source has a screen model, a joining binary
+    client gets the visible screen first and a second snapshot including
+    scrollback once it has caught up with live output.
+    
+    With a LinkMonitor, writes to a client with a slow round trip are
+    batched, the backlog limit shrinks to ADAPT_MAX_LAG seconds at the
+    client's drain rate, and a client that falls further behind than that
+    gets a snapshot once its connection has drained. ``on_transport(ws,
+    mode)``, if given, is asked to move the client to screen diffs instead.
+    """
+    
+    transport = "raw"
+    min_interval = 0.0  # Seconds between writes, before adaptation
+    
+    def __init__(self, ws: web.WebSocketResponse, source, remote: str = None,
+                 on_error=None, limit: int = CLIENT_QUEUE_LIMIT,
+                 link: LinkMonitor = None, on_transport=None):
+        self.ws = ws
+        self.remote = remote
+        self.binary = wants_binary(ws)
+        self.limit = self.max_limit = limit
+        self.interval = self.min_interval
+        self._sink = raw_frame_sink(ws)
+        self._source = source
+        self._on_error = on_error
+        self._on_transport = on_transport
+        self._loop = asyncio.get_running_loop()
+        self._last_write = 0.0
+        if link is None and self._sink is not None and ADAPT_PROBE_INTERVAL > 0:
+            link = LinkMonitor(ws, self._sink[0])
+        self.link = link
+        if link is not None:
+            link.owner = self
+            link.start()
+        self._queue = deque()
+        self._queued_bytes = 0
+        self._resync_history = None  # None, or history flag for the pending snapshot
+        self._history_pending = False  # Scrollback snapshot to send once caught up
+        self._captured = None  # (frame, end seq) pushed while a snapshot is taken
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self.sent_bytes = 0
+        self.sent_frames = 0
+        self.dropped_bytes = 0
+        self.resyncs = 0
+        self._watches = []  # (frame or None, callback) for watch()
+        self._frames_metric = FRAMES_SENT.labels(self.transport)
+        self._bytes_metric = BYTES_SENT.labels(self.transport)
+        self._send_metric = SEND_SECONDS.labels(self.transport)
+        self._task = asyncio.create_task(self._run())
+    
+    @property
+    def queue_depth(self) -> int:
+        """Bytes queued but not yet handed to the socket."""
+        return self._queued_bytes
+    
+    def push(self, frame: OutputFrame):
+        """Queue a frame without blocking."""
+        if self._closed:
+            return
+        if self._resync_history is not None:
+            # A snapshot is pending and will cover this output
+            self.dropped_bytes += len(frame)
+            return
+        if self._queue and self._queued_bytes + len(frame) > self.limit:
+            self.dropped_bytes += self._queued_bytes + len(frame)
+            self.resyncs += 1
+            CLIENT_RESYNCS.inc()
+            if self._on_transport and self._source.has_screen:
+                print(f"Client {self.remote} fell {self._queued_bytes} bytes behind, "
+                      "switching to screen diffs")
+                self._on_transport(self.ws, "diff")
+                return
+            print(f"Client {self.remote} fell {self._queued_bytes} bytes behind, resyncing")
+            self.resync()
+            return
+        self._queue.append(frame)
+        self._queued_bytes += len(frame)
+        if self._captured is not None:
+            self._captured.append((frame, self._source.seq))
+        self._wakeup.set()
+    
+    def resync(self, history: bool = False):
+        """Drop the backlog and send a snapshot before any further output."""
+        self._queue.clear()
+        self._queued_bytes = 0
+        if history and self.binary and self._source.has_screen:
+            # Visible screen now, scrollback once the client has caught up
+            history = False
+            self._history_pending = True
+        self._resync_history = history
+        self._wakeup.set()
+    
+    def send_control(self, message: dict):
+        """Queue a JSON control message (binary-mode clients only)."""
+        if self.binary and not self._closed:
+            frame = OutputFrame(json.dumps(message).encode(), aiohttp.WSMsgType.TEXT)
+            self._queue.append(frame)
+            self._queued_bytes += len(frame)
+            self._wakeup.set()
+    
+    def watch(self, frame, callback):
+        """Call ``callback()`` once ``frame`` (or, if None, the next frame) is handed to the socket."""
+        self._watches.append((frame, callback))
+    
+    def close(self):
+        """Stop the writer task and discard anything still queued."""
+        self._closed = True
+        self._queue.clear()
+        self._queued_bytes = 0
+        self._watches.clear()
+        self._task.cancel()
+        if self.link is not None and self.link.owner is self:
+            self.link.stop()
+    
+    def adapt(self):
+        """Retune batching and the backlog limit from the link measurements."""
+        link = self.link
+        batch = 0.0
+        if link.rtt is not None and link.rtt >= ADAPT_FAST_RTT:
+            batch = min(link.rtt / 4, ADAPT_MAX_INTERVAL)
+        self.interval = max(self.min_interval, batch)
+        if link.drain_rate:
+            self.limit = int(min(self.max_limit,
+                                 max(ADAPT_MIN_QUEUE, link.drain_rate * ADAPT_MAX_LAG)))
+        if link.queue_delay > ADAPT_MAX_LAG:
+            self._fall_behind()
+    
+    def _fall_behind(self):
+        """React to the connection being more than ADAPT_MAX_LAG seconds backed up."""
+        if self._resync_history is not None:
+            return  # A snapshot is coming anyway
+        delay = self.link.queue_delay
+        if self._on_transport and self._source.has_screen:
+            print(f"Client {self.remote} is {delay:.1f}s behind, switching to screen diffs")
+            self._on_transport(self.ws, "diff")
+        elif self._queue:
+            # Already late; skip to a snapshot once the connection drains
+            self.dropped_bytes += self._queued_bytes
+            self.resyncs += 1
+            CLIENT_RESYNCS.inc()
+            print(f"Client {self.remote} is {delay:.1f}s behind, resyncing")
+            self.resync()
+    
+    def stats(self) -> dict:
+        stats = {
+            "remote": self.remote,
+            "transport": self.transport,
+            "queue_bytes": self._queued_bytes,
+            "queue_frames": len(self._queue),
+            "sent_bytes": self.sent_bytes,
+            "sent_frames": self.sent_frames,
+            "dropped_bytes": self.dropped_bytes,
+            "resyncs": self.resyncs,
+            "interval_ms": round(self.interval * 1000, 1),
+            "limit_bytes": self.limit,
+        }
+        if self.link is not None:
+            stats.update(self.link.stats())
+        return stats
+    
+    def _drop_covered(self, captured: list, seq: int):
+        """Unqueue output pushed during a snapshot's capture that the snapshot already shows."""
+        covered = {id(frame) for frame, end in captured if end <= seq}
+        if not covered:
+            return
+        kept = deque()
+        for frame in self._queue:
+            if id(frame) in covered:
+                self._queued_bytes -= len(frame)
+                self.dropped_bytes += len(frame)
+            else:
+                kept.append(frame)
+        self._queue = kept
+    
+    async def _run(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                if self.interval:
+                    # Slow round trip: batch whatever else arrives meanwhile
+                    delay = self._last_write + self.interval - self._loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                self._wakeup.clear()
+                if self._resync_history is not None:
+                    while self.link is not None and self.link.queue_delay > ADAPT_MAX_LAG:
+                        # A snapshot now would only queue behind what is in flight
+                        await asyncio.sleep(ADAPT_PROBE_INTERVAL)
+                    history = self._resync_history
+                    # Output pushed from here on follows the snapshot
+                    self._resync_history = None
+                    self._captured = []
+                    try:
+                        text, seq = await self._source.snapshot(history=history)
+                    finally:
+                        captured, self._captured = self._captured, None
+                    self._drop_covered(captured, seq)
+                    if self.binary:
+                        cols, rows = self._source.size
+                        message = {"type": "snapshot", "seq": seq, "cols": cols, "rows": rows}
+                        if history:
+                            message["history"] = True
+                        await self._send(OutputFrame(json.dumps(message).encode(),
+                                                     aiohttp.WSMsgType.TEXT))
+                        await self._send(OutputFrame(text.encode("utf-8")))
+                    elif text:
+                        await self._send(OutputFrame(text.encode("utf-8"), self.opcode))
+                if self.interval and len(self._queue) > 1:
+                    frames = list(self._queue)
+                    self._queue.clear()
+                    self._queued_bytes = 0
+                    await self._send(*frames)
+                while self._queue:
+                    frame = self._queue.popleft()
+                    self._queued_bytes -= len(frame)
+                    await self._send(frame)
+                    if self._resync_history is not None:
+                        break
+                if self._history_pending and self._resync_history is None and not self._queue:
+                    self._history_pending = False
+                    self._resync_history = True
+                    self._wakeup.set()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Error sending to client {self.remote}: {e}")
+            self._closed = True
+            if self._on_error:
+                self._on_error(self.ws)
+    
+    @property
+    def opcode(self) -> int:
+        return aiohttp.WSMsgType.BINARY if self.binary else aiohttp.WSMsgType.TEXT
+    
+    async def _send(self, *frames: OutputFrame):
+        """Write frames to the client, in a single transport write if there are several."""
+        started = self._loop.time()
+        if self._sink is None:
+            for frame in frames:
+                if frame.opcode == aiohttp.WSMsgType.BINARY:
+                    await self.ws.send_bytes(frame.payload)
+                else:
+                    await self.ws.send_str(frame.payload.decode("utf-8"))
+        else:
+            transport, protocol, compress = self._sink
+            if self.ws.closed or transport.is_closing():
+                raise ConnectionResetError("Cannot write to closing transport")
+            if len(frames) == 1:
+                data = frames[0].wire(compress)
+            else:
+                data = b"".join(frame.wire(compress) for frame in frames)
+            transport.write(data)
+            if self.link is not None:
+                self.link.wire_bytes += len(data)
+            if protocol._paused:
+                # Same flow control aiohttp applies: wait for the socket to drain
+                await protocol._drain_helper()
+        self._last_write = self._loop.time()
+        size = sum(len(frame) for frame in frames)
+        self.sent_bytes += size
+        self.sent_frames += len(frames)
+        self._send_metric.observe(self._last_write - started)
+        self._bytes_metric.inc(size)
+        self._frames_metric.inc(len(frames))
+        if self._watches:
+            watches = self._watches
+            self._watches = [(frame, callback) for frame, callback in watches
+                             if frame is not None and frame not in frames]
+            for frame, callback in watches:
+                if frame is None or frame in frames:
+                    callback()
+
+
+class ScreenDiffWriter(ClientWriter):
+    """ClientWriter that sends screen changes instead of the raw output stream.
+    
+    For slow links, in the style of mosh: at most ``fps`` frames a second,
+    each holding only what changed on screen since the client's last frame.
+    Output that arrives while a frame is being sent or the rate cap holds is
+    folded into the next frame, so a slow client skips intermediate states
+    instead of queueing them. ``source`` also provides ``screen_diff(state)``.
+    
+    With a LinkMonitor, frames are also paced to the client's drain rate and
+    held while its connection is backed up. A client with ``on_transport``
+    goes back to the output stream once output fits comfortably within its
+    drain rate again.
+    """
+    
+    transport = "diff"
+    
+    def __init__(self, ws: web.WebSocketResponse, source, remote: str = None,
+                 on_error=None, fps: float = DIFF_FPS, link: LinkMonitor = None,
+                 on_transport=None):
+        self.min_interval = 1 / fps
+        self._state = None  # What the client shows, for ScreenModel.diff; None redraws
+        self._calm_probes = 0
+        self._probe_seq = None  # (time, source seq) at the last probe
+        super().__init__(ws, source, remote=remote, on_error=on_error, link=link,
+                         on_transport=on_transport)
+    
+    def push(self, frame: OutputFrame):
+        """Note new output; the next frame is built from the screen model."""
+        if not self._closed:
+            self._wakeup.set()
+    
+    def resync(self, history: bool = False):
+        """Redraw the whole screen with the next frame."""
+        self._state = None
+        self._wakeup.set()
+    
+    def _fall_behind(self):
+        pass  # _run holds frames until the connection drains
+    
+    def adapt(self):
+        super().adapt()
+        if not self._on_transport:
+            return
+        link = self.link
+        now, seq = self._loop.time(), self._source.seq
+        if self._probe_seq is not None:
+            then, before = self._probe_seq
+            output_rate = (seq - before) / max(now - then, 1e-3)
+            fits = link.drain_rate is None or output_rate * 2 < link.drain_rate
+            calm = fits and link.queue_delay < ADAPT_MAX_LAG / 4
+            self._calm_probes = self._calm_probes + 1 if calm else 0
+        self._probe_seq = (now, seq)
+        if self._calm_probes >= ADAPT_RECOVER_PROBES:
+            print(f"Client {self.remote} caught up, switching back to the output stream")
+            self._on_transport(self.ws, "raw")
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self.link is not None and self.link.queue_delay > ADAPT_MAX_LAG:
+                    # Backed up: let it drain and send the latest state after
+                    await asyncio.sleep(self.interval)
+                started = loop.time()
+                while self._queue:
+                    frame = self._queue.popleft()
+                    self._queued_bytes -= len(frame)
+                    await self._send(frame)
+                if self._state is None:
+                    cols, rows = self._source.size
+                    message = {"type": "snapshot", "seq": self._source.seq, "cols": cols, "rows": rows}
+                    await self._send(OutputFrame(json.dumps(message).encode(), aiohttp.WSMsgType.TEXT))
+                diff = self._source.screen_diff(self._state)
+                if diff is None:
+                    # No screen model for now (e.g. during bulk output): whole
+                    # redraws from tmux, slowly. The source resyncs us once
+                    # the model is back.
+                    self._state = None
+                    text, _ = await self._source.snapshot()
+                    await self._send(OutputFrame(text.encode("utf-8")))
+                    await asyncio.sleep(SCREEN_REBUILD_QUIET)
+                    continue
+                text, self._state = diff
+                pace = self.interval
+                if text:
+                    data = text.encode("utf-8")
+                    await self._send(OutputFrame(data))
+                    if self.link is not None and self.link.drain_rate:
+                        # Don't send faster than the link takes frames away
+                        pace = max(pace, len(data) / self.link.drain_rate)
+                await asyncio.sleep(pace - (loop.time() - started))
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Error sending to client {self.remote}: {e}")
+            self._closed = True
+            if self._on_error:
+                self._on_error(self.ws)
+
+
+def valid_session_name(name: str) -> bool:
+    """tmux session names clients may target (tmux itself rejects : and .).
+    
+    The server's own control session is never one of them.
+    """
+    if name == CONTROL_SESSION:
+        return False
+    return 0 < len(name) <= 64 and all(c.isprintable() and c not in ":." for c in name)
+
+
 class SharedTerminalSession:
-    """Manages a shared tmux terminal session that multiple clients can connect to."""
+    """Fan-out hub for a tmux session that multiple clients can connect to.
+    
+    Hubs live in a registry keyed by session name and are reference counted
+    with acquire()/release(): the first viewer attaches one PTY reader to the
+    session, which is torn down a grace period after the last one leaves.
+    """
+    
+    _sessions = {}  # session name -> SharedTerminalSession
+    _stream_ends = {}  # session name -> output offset when its hub hibernated
+    
+    @classmethod
+    def acquire(cls, name: str = SHARED_SESSION) -> "SharedTerminalSession":
+        """Get the hub for a session, creating it if needed, and take a reference."""
+        hub = cls._sessions.get(name)
+        if hub is None:
+            hub = cls._sessions[name] = cls(name)
+        hub._refs += 1
+        if hub._idle_timer:
+            hub._idle_timer.cancel()
+            hub._idle_timer = None
+        return hub
+    
+    @classmethod
+    def release(cls, hub: "SharedTerminalSession"):
+        """Drop a reference taken by acquire().
+        
+        After the last one, the hub stays attached for IDLE_DETACH_SECONDS so
+        a reconnecting client can resume, then detaches from tmux.
+        """
+        hub._refs -= 1
+        if hub._refs > 0 or cls._sessions.get(hub.name) is not hub:
+            return
+        if IDLE_DETACH_SECONDS > 0 and hub._running:
+            hub._idle_timer = asyncio.get_running_loop().call_later(
+                IDLE_DETACH_SECONDS, cls._hibernate, hub
+            )
+        else:
+            cls._hibernate(hub)
+    
+    @classmethod
+    def _hibernate(cls, hub: "SharedTerminalSession"):
+        hub._idle_timer = None
+        if hub._refs <= 0 and cls._sessions.get(hub.name) is hub:
+            print(f"No viewers on {hub.name}, detaching from tmux")
+            del cls._sessions[hub.name]
+            # Output produced while detached is never seen, so the next hub
+            # starts past a gap and stale resume offsets get a snapshot.
+            cls._stream_ends[hub.name] = hub.seq + 1
+            hub.close()
+    
+    @classmethod
+    def all(cls) -> list:
+        return list(cls._sessions.values())
+    
+    def __init__(self, name: str):
+        self.name = name
+        self._read_bytes = PTY_READ_BYTES.labels(name)
+        self._reads = PTY_READS.labels(name)
+        self._refs = 0
+        self._idle_timer = None
+        self._clients = {}  # ws -> ClientWriter
+        self._master_fd = None
+        self._pid = None
+        self._running = False
+        self._start_lock = asyncio.Lock()
+        self._reader = None
+        self._input = None  # PtyWriter for the attach PTY
+        self._scheduler = InputScheduler(self._deliver)
+        self._probes = EchoProbes(name, self._probe_done)
+        self._decoder = None
+        self._coalescer = None
+        self._ring = OutputRing(seq=self._stream_ends.get(name, 0))
+        self._control = None  # TmuxControl feeding output, when TMUX_OUTPUT is "control"
+        self._pane = None  # Pane followed in control mode
+        self._tty = None  # Terminal of the attach client, for redraw requests
+        self._screen = None  # ScreenModel, while it is in step with the output
+        self._screen_feeding = False
+        self._screen_rebuild = None  # Task seeding a new ScreenModel from tmux
+        self._sizes = {}  # ws -> (cols, rows, reported at) for viewers that sent a size
+        self._size = (DEFAULT_COLS, DEFAULT_ROWS)  # Size of the attach PTY or control client
+        self._resize_timer = None
+    
+    @property
+    def viewers(self) -> int:
+        return len(self._clients)
+    
+    async def add_client(self, ws: web.WebSocketResponse, remote: str = None,
+                         resume: int = None, transport: str = "raw", size: tuple = None):
+        """Add a client to the shared session.
+        
+        ``size`` is the (cols, rows) the client has room for, if it said;
+        see resize().
+        
+        A binary client passing the last stream offset it saw as ``resume``
+        gets just the output it missed, if that is still buffered; otherwise
+        it gets a snapshot like a new client. With ``transport="diff"`` (and
+        a screen model available) a binary client gets screen diffs instead
+        of the output stream, and can't resume. ``transport="auto"`` starts
+        with the output stream and moves between the two as the client's
+        connection keeps up or falls behind.
+        """
+        if size is not None:
+            self._sizes[ws] = (*size, asyncio.get_running_loop().time())
+        # Start session if not running
+        async with self._start_lock:
+            if not self._running:
+                await self._start_tmux_session()
+        if size is not None and size != self._size:
+            self._resize_soon()
+        
+        if transport == "diff" and SCREEN_MODEL and wants_binary(ws):
+            writer = ScreenDiffWriter(ws, self, remote=remote, on_error=self.remove_client)
+            writer.send_control({"type": "transport", "mode": "diff"})
+            self._clients[ws] = writer
+            return
+        on_transport = self._switch_transport if transport == "auto" and wants_binary(ws) else None
+        writer = ClientWriter(ws, self, remote=remote, on_error=self.remove_client,
+                              on_transport=on_transport)
+        missed = self._ring.since(resume) if resume is not None and writer.binary else None
+        if missed is not None and len(missed) <= writer.limit:
+            writer.send_control({"type": "resume", "seq": resume})
+            writer.send_control(self._size_message())
+            if missed:
+                writer.push(OutputFrame(missed))
+            print(f"Client {remote} resumed at {resume} ({len(missed)} bytes missed)")
+        else:
+            # Send current tmux buffer to new client ahead of live output
+            writer.resync(history=True)
+        self._clients[ws] = writer
+    
+    def remove_client(self, ws: web.WebSocketResponse):
+        """Remove a client from the session."""
+        self._scheduler.remove(ws)
+        self._probes.remove(ws)
+        if self._sizes.pop(ws, None) is not None:
+            self._resize_soon()
+        writer = self._clients.pop(ws, None)
+        if writer:
+            writer.close()
+    
+    def resize(self, ws: web.WebSocketResponse, size: tuple):
+        """Note the (cols, rows) a viewer has room for.
+        
+        The terminal gets the size SIZE_POLICY picks from all viewers that
+        sent one, once resizes have settled for RESIZE_DEBOUNCE. Binary
+        clients are then told ``{"type": "size", "cols": C, "rows": R}``.
+        """
+        self._sizes[ws] = (*size, asyncio.get_running_loop().time())
+        self._resize_soon()
     
-    SESSION_NAME = "termlinkky"
-    _instance = None
-    _clients = []
-    _master_fd = None
-    _pid = None
-    _running = False
-    _read_task = None
+    def _resize_soon(self):
+        if self._resize_timer:
+            self._resize_timer.cancel()
+        self._resize_timer = asyncio.get_running_loop().call_later(RESIZE_DEBOUNCE, self._resize)
     
-    @classmethod
-    def get_instance(cls):
-        if cls._instance is None:
-            cls._instance = cls()
-        return cls._instance
+    def _resize(self):
+        """Give the terminal the size picked from the viewers' sizes, if it changed."""
+        self._resize_timer = None
+        size = pick_size(self._sizes.values())
+        if size is None or size == self._size or not self._running:
+            return  # Without viewer sizes, the terminal keeps the size it has
+        cols, rows = size
+        if self._master_fd is not None:
+            try:
+                set_pty_size(self._master_fd, cols, rows)
+            except OSError as e:
+                print(f"Error resizing {self.name}: {e}")
+                return
+            # tmux redraws at the new size; the model is rebuilt once that settles
+            if self._screen:
+                self._drop_screen()
+        elif self._control is not None:
+            asyncio.create_task(self._resize_control(self._control, cols, rows))
+        self._size = size
+        print(f"Resized {self.name} to {cols}x{rows} ({SIZE_POLICY} of {len(self._sizes)} viewers)")
+        message = self._size_message()
+        for writer in self._clients.values():
+            writer.send_control(message)
     
-    def __init__(self):
-        pass
+    async def _resize_control(self, control: TmuxControl, cols: int, rows: int):
+        """Size the control client, which makes it count towards the window size."""
+        try:
+            await control.command("refresh-client", "-C", f"{cols},{rows}")
+        except Exception as e:
+            print(f"Error resizing {self.name}: {e}")
     
-    async def add_client(self, ws: web.WebSocketResponse):
-        """Add a client to the shared session."""
-        self._clients.append(ws)
-        
-        # Start session if not running
-        if not self._running:
-            await self._start_tmux_session()
+    def _size_message(self) -> dict:
+        cols, rows = self._size
+        return {"type": "size", "cols": cols, "rows": rows}
+    
+    def pong(self, ws: web.WebSocketResponse, payload: bytes):
+        """Pass a client's pong to its link monitor."""
+        writer = self._clients.get(ws)
+        if writer is not None and writer.link is not None:
+            writer.link.pong(payload)
+    
+    def _switch_transport(self, ws: web.WebSocketResponse, transport: str):
+        """Move an auto-transport client between the output stream and screen diffs."""
+        old = self._clients.get(ws)
+        if old is None or old.transport == transport or (transport == "diff" and not self._screen):
+            return
+        cls = ScreenDiffWriter if transport == "diff" else ClientWriter
+        writer = cls(ws, self, remote=old.remote, on_error=self.remove_client,
+                     link=old.link, on_transport=self._switch_transport)
+        for counter in ("sent_bytes", "sent_frames", "dropped_bytes", "resyncs"):
+            setattr(writer, counter, getattr(old, counter))
+        old.close()
+        writer.send_control({"type": "transport", "mode": transport})
+        if transport == "raw":
+            writer.resync()
+        self._clients[ws] = writer
+    
+    async def snapshot(self, history: bool = False) -> tuple:
+        """Redraw of the screen for a joining or resyncing client, with its stream offset.
         
-        # Send current tmux buffer to new client
+        Returns ``(text, seq)``: the redraw shows the screen as of output
+        offset ``seq``, so a client should be sent output after that. The
+        screen is drawn from the screen model when there is one, with up
+        to 1000 lines of scrollback from tmux first if history is set.
+        Without a model, tmux is asked: with history, that returns the
+        scrollback as plain text, and without it a redraw of the visible
+        screen (colors included) that leaves the cursor where tmux has it.
+        """
+        target = ["-t", self._pane or f"={self.name}:"]
+        screen = self._caught_up_screen()
+        if screen is not None:
+            seq = screen.seq
+            if not history:
+                return screen.render(), seq
+            # The screen is drawn as of now; the scrollback above it can lag
+            rendered = screen.render()
+            result = await tmux("capture-pane", *target, "-p", "-e", "-S", "-1000", "-E", "-1",
+                                timeout=2)
+            if result.returncode != 0:
+                return rendered, seq
+            return screen.render_scrollback(result.stdout.rstrip("\n").split("\n")) + rendered, seq
         try:
-            result = subprocess.run(
-                ["tmux", "capture-pane", "-t", self.SESSION_NAME, "-p", "-S", "-1000"],
-                capture_output=True, text=True, timeout=2
+            if history:
+                result = await tmux("capture-pane", *target, "-p", "-S", "-1000", timeout=2)
+                # Output read while tmux captured is already in the capture
+                return (result.stdout if result.returncode == 0 else ""), self.seq
+            result, cursor = await asyncio.gather(
+                tmux("capture-pane", *target, "-p", "-e", timeout=2),
+                tmux("display-message", *target, "-p", "#{cursor_x} #{cursor_y}", timeout=2),
             )
-            if result.returncode == 0 and result.stdout:
-                await ws.send_str(result.stdout)
-        except:
-            pass
+            if result.returncode != 0:
+                return "", self.seq
+            screen = "\x1b[0m\x1b[H\x1b[2J" + result.stdout.rstrip("\n").replace("\n", "\r\n")
+            if cursor.returncode == 0:
+                x, y = cursor.stdout.split()
+                screen += f"\x1b[0m\x1b[{int(y) + 1};{int(x) + 1}H"
+            return screen, self.seq
+        except Exception as e:
+            print(f"Snapshot failed: {e}")
+            return "", self.seq
     
-    def remove_client(self, ws: web.WebSocketResponse):
-        """Remove a client from the session."""
-        if ws in self._clients:
-            self._clients.remove(ws)
+    @property
+    def seq(self) -> int:
+        """Stream offset of the next byte of output."""
+        return self._ring.seq
+    
+    def screen_diff(self, state):
+        """ScreenModel.diff() of the caught-up screen model, or None without one."""
+        screen = self._caught_up_screen()
+        return screen.diff(state) if screen else None
+    
+    @property
+    def size(self) -> tuple:
+        """(cols, rows) of the terminal."""
+        return self._size
+    
+    @property
+    def has_screen(self) -> bool:
+        """True if snapshots are drawn from the screen model rather than tmux."""
+        return self._screen is not None
+    
+    def stats(self) -> dict:
+        """Per-client queue metrics for the stats endpoint."""
+        return {
+            "session": self.name,
+            "running": self._running,
+            "idle": self._idle_timer is not None,
+            "seq": self._ring.seq,
+            "buffered_bytes": self._ring.seq - self._ring.start,
+            "input_queue_bytes": self._scheduler.queue_depth
+                                 + (self._input.queue_depth if self._input else 0),
+            "input_writes": self._scheduler.writes,
+            "size": "{}x{}".format(*self._size),
+            "screen": "{}x{}".format(*self._screen.size) if self._screen else None,
+            "clients": [{**writer.stats(), "echo_ms": self._probes.summary(ws)}
+                        for ws, writer in self._clients.items()],
+        }
     
     async def _start_tmux_session(self):
         """Start or attach to a tmux session."""
         try:
             # Check if session already exists
-            result = subprocess.run(
-                ["tmux", "has-session", "-t", self.SESSION_NAME],
-                capture_output=True,
-                timeout=5
-            )
+            result = await tmux("has-session", "-t", f"={self.name}")
+            self._size = pick_size(self._sizes.values()) or self._size
+            cols, rows = self._size
             
             if result.returncode != 0:
-                # Create new session with phone-friendly size
-                print(f"Creating new tmux session: {self.SESSION_NAME}")
-                subprocess.run([
-                    "tmux", "new-session", "-d", "-s", self.SESSION_NAME,
-                    "-x", "48", "-y", "30"
-                ], timeout=5)
+                # Create the session at the viewers' size (phone-sized by default)
+                print(f"Creating new tmux session: {self.name}")
+                await tmux("new-session", "-d", "-s", self.name, "-x", str(cols), "-y", str(rows))
             else:
-                print(f"Attaching to existing tmux session: {self.SESSION_NAME}")
+                print(f"Attaching to existing tmux session: {self.name}")
             
-            # Open PTY to tmux with phone-friendly size
-            self._master_fd, slave_fd = pty.openpty()
+            if TMUX_OUTPUT == "control":
+                control = await self._control_client()
+                if control:
+                    await self._follow_control(control)
+                    if self._sizes:
+                        await self._resize_control(control, cols, rows)
+                    return
             
-            # Set PTY size to phone dimensions (48 cols x 30 rows)
-            import struct
-            import fcntl
-            import termios
-            winsize = struct.pack('HHHH', 30, 48, 0, 0)  # rows, cols, xpixel, ypixel
-            fcntl.ioctl(self._master_fd, termios.TIOCSWINSZ, winsize)
+            # Open PTY to tmux at the terminal size
+            self._master_fd, slave_fd = pty.openpty()
+            set_pty_size(self._master_fd, cols, rows)
             
             self._pid = os.fork()
             
@@ -178,104 +2574,302 @@ class SharedTerminalSession:
                 # Child process
                 os.close(self._master_fd)
                 os.setsid()
+                # Make the PTY the controlling terminal, so resizes send SIGWINCH
+                fcntl.ioctl(slave_fd, termios.TIOCSCTTY, 0)
                 os.dup2(slave_fd, 0)
                 os.dup2(slave_fd, 1)
                 os.dup2(slave_fd, 2)
                 os.close(slave_fd)
                 # Set TERM so tmux knows terminal capabilities
                 os.environ["TERM"] = "xterm-256color"
-                os.execlp("tmux", "tmux", "attach-session", "-t", self.SESSION_NAME)
+                os.execlp("tmux", "tmux", "attach-session", "-t", f"={self.name}")
             else:
                 # Parent process
+                self._tty = os.ttyname(slave_fd)
                 os.close(slave_fd)
                 self._running = True
-                self._read_task = asyncio.create_task(self._read_output())
+                self._decoder = new_utf8_decoder()
+                self._coalescer = OutputCoalescer(self._broadcast)
+                self._reader = PtyReader(self._master_fd, self._on_output, self._on_pty_closed)
+                self._reader.start()
+                # Kept short so the scheduler's turns, not this queue, set the order
+                self._input = PtyWriter(self._master_fd, self._on_pty_closed, limit=INPUT_QUANTUM)
+                self._rebuild_screen_later(quiet=0)
                 print(f"PTY started: master_fd={self._master_fd}, pid={self._pid}")
         except Exception as e:
             print(f"Error starting tmux session: {e}")
             self._running = False
             raise
     
-    async def _read_output(self):
-        """Read output and broadcast to all clients."""
-        import errno
-        print("PTY read loop started")
-        idle_cycles = 0
-        check_interval = 100  # Check child every ~5 seconds of idle
+    async def _control_client(self):
+        """A control client attached to this session (%output only covers that session)."""
+        control = TmuxControl(self.name)
+        try:
+            await control.start()
+        except Exception as e:
+            print(f"tmux control mode unavailable for {self.name} ({e}), using attach")
+            control._close("failed to start")
+            return None
+        return control
+    
+    async def _follow_control(self, control: TmuxControl):
+        """Take output from the control client's %output for the active pane."""
+        self._control = control
+        self._running = True
+        self._decoder = new_utf8_decoder()
+        self._coalescer = OutputCoalescer(self._broadcast)
+        control.add_listener(self._on_control_notification)
+        await self._follow_active_pane()
+        print(f"Following {self.name} pane {self._pane} via control mode")
+    
+    async def _follow_active_pane(self):
+        """Point output at the session's active pane, resyncing clients if it changed."""
+        control = self._control
+        result = await control.command(
+            "display-message", "-p", "-t", f"={self.name}:", "#{pane_id}"
+        )
+        pane = result.stdout.strip()
+        if not pane or pane == self._pane or control is not self._control:
+            return
+        if self._pane:
+            control.unlisten_pane(self._pane)
+        self._pane = pane
+        control.listen_pane(pane, self._on_output)
+        self._drop_screen(quiet=0)
+        for writer in self._clients.values():
+            writer.resync()
+    
+    def _on_output(self, data: bytes):
+        self._read_bytes.inc(len(data))
+        self._reads.inc()
+        if self._probes.pending:
+            self._probes.output(data, self._ring.seq + self._coalescer.pending)
+        self._coalescer.push(data)
+    
+    def _on_control_notification(self, name: str, args: str):
+        if name == "%exit":
+            self._on_pty_closed(f"tmux control client: {args}")
+        elif name in ("%window-pane-changed", "%session-window-changed", "%session-changed"):
+            asyncio.create_task(self._follow_active_pane())
+        elif name == "%layout-change" and self._screen:
+            # The pane may have been resized under the model
+            self._drop_screen(quiet=0)
+    
+    def _broadcast(self, data: bytes):
+        """Fan a coalesced chunk of PTY output out to every client's queue."""
+        self._ring.append(data)
+        self._feed_screen_soon()
+        # Build each frame once for all clients of that kind. Text is decoded
+        # at most once per chunk, and only if a text client needs it.
+        binary_frame = text_frame = None
+        for writer in self._clients.values():
+            if writer.binary:
+                if binary_frame is None:
+                    binary_frame = OutputFrame(data)
+                writer.push(binary_frame)
+            else:
+                if text_frame is None:
+                    text = self._decoder.decode(data)
+                    text_frame = OutputFrame(text.encode("utf-8"), aiohttp.WSMsgType.TEXT)
+                writer.push(text_frame)
+        if text_frame is None:
+            self._decoder.reset()
+        if self._probes.pending:
+            for probe in self._probes.due(self._ring.seq):
+                writer = self._clients.get(probe.client)
+                if writer is not None:
+                    # Screen diff clients get the echo in whatever frame comes next
+                    frame = None if writer.transport == "diff" else binary_frame if writer.binary else text_frame
+                    writer.watch(frame, lambda probe=probe: self._probes.sent(probe))
+    
+    async def probe(self, client, message: dict):
+        """Type an echo probe's keys for a client (see EchoProbes)."""
+        probe = self._probes.start(client, message)
+        if probe is not None:
+            await self._scheduler.push(client, probe.data,
+                                       on_written=lambda: self._probes.written(probe))
+    
+    def _probe_done(self, probe: EchoProbe, message: dict):
+        writer = self._clients.get(probe.client)
+        if writer is not None:
+            writer.send_control(message)
+    
+    def _feed_screen_soon(self):
+        if self._screen and not self._screen_feeding:
+            self._screen_feeding = True
+            asyncio.get_running_loop().call_soon(self._feed_screen)
+    
+    def _feed_screen(self):
+        """Feed the screen model a bounded slice of new output, then yield to the loop."""
+        self._screen_feeding = False
+        screen = self._screen
+        if screen is None:
+            return
+        data = self._ring.read(screen.seq, SCREEN_FEED_BYTES)
+        if data is None or self._ring.seq - screen.seq > SCREEN_MAX_LAG:
+            # Bulk output is outrunning the model
+            self._drop_screen()
+            return
+        screen.feed(data)
+        if screen.seq < self._ring.seq:
+            self._feed_screen_soon()
+    
+    def _caught_up_screen(self):
+        """The screen model fed up to the latest output, or None if there isn't one."""
+        screen = self._screen
+        if screen is None:
+            return None
+        missed = self._ring.since(screen.seq)
+        if missed is None or len(missed) > SCREEN_MAX_LAG:
+            self._drop_screen()
+            return None
+        screen.feed(missed)
+        return screen
+    
+    def _drop_screen(self, quiet: float = SCREEN_REBUILD_QUIET):
+        """Discard the screen model and rebuild it once output has been quiet for a while."""
+        self._screen = None
+        self._rebuild_screen_later(quiet)
+    
+    def _rebuild_screen_later(self, quiet: float = SCREEN_REBUILD_QUIET):
+        if SCREEN_MODEL and self._running and self._screen_rebuild is None:
+            self._screen_rebuild = asyncio.create_task(self._rebuild_screen(quiet))
+    
+    async def _rebuild_screen(self, quiet: float):
+        """Seed a new screen model once output has been quiet for a moment.
         
-        while self._running:
-            try:
-                if not self._master_fd:
-                    print("PTY master_fd is None, stopping read loop")
+        Through an attach PTY, tmux is asked to redraw the client, which
+        fills in the screen (status line included) via the output stream. In
+        control mode the pane is seeded from capture-pane.
+        """
+        try:
+            while True:
+                seq = self._ring.seq
+                await asyncio.sleep(quiet)
+                if self._ring.seq == seq:
                     break
-                
-                # Short timeout so we can check for new clients etc
-                r, _, _ = select.select([self._master_fd], [], [], 0.05)
-                
-                if r:
-                    try:
-                        data = os.read(self._master_fd, 4096)
-                    except OSError as e:
-                        if e.errno == errno.EIO:
-                            # EIO is expected when PTY closes
-                            print("PTY closed (EIO)")
-                            break
-                        raise
-                    
-                    if data:
-                        text = data.decode("utf-8", errors="replace")
-                        idle_cycles = 0  # Reset idle counter on data
-                        
-                        # Broadcast to all connected clients
-                        dead_clients = []
-                        for client in self._clients:
-                            try:
-                                await client.send_str(text)
-                            except Exception as e:
-                                print(f"Error sending to client: {e}")
-                                dead_clients.append(client)
-                        for dc in dead_clients:
-                            if dc in self._clients:
-                                self._clients.remove(dc)
-                    else:
-                        # Empty read but select said ready - rare but OK
-                        idle_cycles += 1
-                else:
-                    # No data ready (select timeout) - completely normal for tmux
-                    idle_cycles += 1
-                
-                # Only check child status periodically during idle
-                if idle_cycles >= check_interval:
-                    idle_cycles = 0
-                    try:
-                        pid, status = os.waitpid(self._pid, os.WNOHANG)
-                        if pid != 0:
-                            print(f"Child process exited with status {status}")
-                            break
-                    except ChildProcessError:
-                        print("Child process no longer exists")
-                        break
-                
-                await asyncio.sleep(0.01)
-                
-            except (OSError, BrokenPipeError) as e:
-                print(f"PTY error: {e}")
-                break
-            except Exception as e:
-                print(f"Unexpected error in read loop: {e}")
-                import traceback
-                traceback.print_exc()
-                break
-                
-        print("PTY read loop ended")
+                quiet = SCREEN_REBUILD_QUIET
+            if self._tty:
+                screen = ScreenModel(*self._size, seq=self._ring.seq)  # PTY size
+                self._screen = screen
+                await tmux("refresh-client", "-t", self._tty)
+            else:
+                target = ["-t", self._pane or f"={self.name}:"]
+                info, result = await asyncio.gather(
+                    tmux("display-message", *target, "-p",
+                         "#{pane_width} #{pane_height} #{cursor_x} #{cursor_y}", timeout=2),
+                    tmux("capture-pane", *target, "-p", "-e", timeout=2),
+                )
+                if info.returncode != 0 or result.returncode != 0 or not self._running:
+                    return
+                cols, rows, x, y = (int(n) for n in info.stdout.split())
+                # Output up to here is covered by the capture
+                screen = ScreenModel(cols, rows)
+                screen.feed(result.stdout.rstrip("\n").replace("\n", "\x1b[0m\r\n").encode("utf-8")
+                            + f"\x1b[0m\x1b[{y + 1};{x + 1}H".encode())
+                screen.seq = self._ring.seq
+                self._screen = screen
+            self._feed_screen_soon()
+            for writer in self._clients.values():
+                if writer.transport == "diff":
+                    writer.resync()
+        except Exception as e:
+            print(f"Screen model for {self.name} unavailable: {e}")
+        finally:
+            if self._screen_rebuild is asyncio.current_task():
+                self._screen_rebuild = None
+    
+    def _on_pty_closed(self, reason: str):
+        """Tear down the PTY after tmux detaches or exits."""
+        print(f"PTY closed for {self.name} ({reason})")
+        self._detach()
+        if self.name != SHARED_SESSION:
+            asyncio.create_task(self._end_if_session_gone())
+    
+    async def _end_if_session_gone(self):
+        """Disconnect viewers once their tmux session has been killed.
+        
+        The default shared session is recreated on the next keystroke instead.
+        """
+        result = await tmux("has-session", "-t", f"={self.name}")
+        if result.returncode != 0:
+            print(f"tmux session {self.name} ended")
+            for ws in list(self._clients):
+                try:
+                    await ws.close(message=b"session ended")
+                except Exception as e:
+                    print(f"Error closing client of {self.name}: {e}")
+    
+    def close(self):
+        """Detach from tmux and drop all clients (the tmux session keeps running)."""
+        self._detach()
+        self._scheduler.close()
+        for writer in self._clients.values():
+            writer.close()
+        self._clients.clear()
+    
+    def _detach(self):
+        """Stop reading from tmux and release the PTY or control client."""
         self._running = False
+        if self._resize_timer:
+            self._resize_timer.cancel()
+            self._resize_timer = None
+        if self._screen_rebuild:
+            self._screen_rebuild.cancel()
+            self._screen_rebuild = None
+        self._screen = None
+        self._tty = None
+        if self._control:
+            if self._pane:
+                self._control.unlisten_pane(self._pane)
+            self._control.remove_listener(self._on_control_notification)
+            self._control.stop()
+            self._control = None
+            self._pane = None
+        if self._reader:
+            self._reader.stop()
+            self._reader = None
+        if self._input:
+            self._input.stop()
+            self._input = None
+        if self._coalescer:
+            self._coalescer.flush()
+            self._coalescer = None
+        if self._master_fd:
+            try:
+                os.close(self._master_fd)
+            except OSError:
+                pass
+            self._master_fd = None
+        if self._pid:
+            reap_child(self._pid)
+            self._pid = None
     
-    async def write(self, data: str):
-        """Write input to the shared terminal."""
-        # Try PTY write first
-        if self._master_fd and self._running:
+    async def write(self, data, client=None):
+        """Queue input (str from text frames, bytes from binary frames) for the shared terminal.
+        
+        ``client`` identifies the sender for the input scheduler's turns.
+        """
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        await self._scheduler.push(client, data)
+    
+    async def _deliver(self, data: bytes, on_written=None):
+        """Write scheduled input to tmux; ``on_written()`` is called once it is written."""
+        if self._pane and self._running:
+            try:
+                await send_keys(self._pane, data)
+                if on_written:
+                    on_written()
+                return
+            except Exception as e:
+                print(f"Control mode write error: {e}, attempting recovery...")
+                self._on_pty_closed("write error")
+        
+        # Try PTY write first; large pastes are queued and written as the PTY drains
+        if self._input and self._running:
             try:
-                os.write(self._master_fd, data.encode("utf-8"))
+                await self._input.write(data, on_written)
                 return
             except (OSError, BrokenPipeError) as e:
                 print(f"PTY write error: {e}, attempting recovery...")
@@ -283,12 +2877,9 @@ class SharedTerminalSession:
         
         # Fallback: use tmux send-keys (more reliable but less interactive)
         try:
-            # Escape special characters for tmux
-            escaped = data.replace("'", "'\\''")
-            subprocess.run(
-                ["tmux", "send-keys", "-t", self.SESSION_NAME, "-l", data],
-                timeout=2
-            )
+            await send_keys(f"={self.name}:", data)
+            if on_written:
+                on_written()
             print("Used tmux send-keys fallback")
         except Exception as e:
             print(f"tmux send-keys also failed: {e}")
@@ -304,102 +2895,845 @@ class SharedTerminalSession:
         """Restart the PTY connection to tmux."""
         print("Restarting tmux connection...")
         # Clean up old connection
-        if self._master_fd:
-            try:
-                os.close(self._master_fd)
-            except:
-                pass
         if self._pid:
             try:
                 os.kill(self._pid, 9)
             except:
                 pass
+        self._detach()
         # Start new connection
         await self._start_tmux_session()
 
 
+def spawn_shell(size: tuple) -> tuple:
+    """Start the user's shell on a new PTY of (cols, rows); returns (master_fd, pid)."""
+    shell = os.environ.get("SHELL", "/bin/bash")
+    master_fd, slave_fd = pty.openpty()
+    set_pty_size(master_fd, *size)
+    pid = os.fork()
+    if pid == 0:
+        os.close(master_fd)
+        os.setsid()
+        fcntl.ioctl(slave_fd, termios.TIOCSCTTY, 0)
+        os.dup2(slave_fd, 0)
+        os.dup2(slave_fd, 1)
+        os.dup2(slave_fd, 2)
+        os.close(slave_fd)
+        os.execvp(shell, [shell])
+    os.close(slave_fd)
+    return master_fd, pid
+
+
+class WarmShell:
+    """A shell started ahead of time, keeping what it prints (its prompt) until claimed."""
+    
+    def __init__(self, size: tuple, on_close=None):
+        self._loop = asyncio.get_running_loop()
+        self.started = self._loop.time()
+        self.master_fd, self.pid = spawn_shell(size)
+        self.size = size
+        self.output = bytearray()
+        self.output_at = None  # Loop time of the latest output
+        self.alive = True
+        self.claimed = False
+        self._on_close = on_close
+        self._first_output = asyncio.Event()
+        self._reader = PtyReader(self.master_fd, self._on_output, self._closed)
+        self._reader.start()
+    
+    async def ready(self, timeout: float = 5.0) -> float:
+        """Wait for the shell to print its prompt and go quiet; returns seconds since it started."""
+        deadline = self.started + timeout
+        try:
+            await asyncio.wait_for(self._first_output.wait(), timeout)
+            while self.alive and not self.claimed and self._loop.time() < deadline:
+                quiet = self._loop.time() - self.output_at
+                if quiet >= WARM_SHELL_SETTLE:
+                    break
+                await asyncio.sleep(WARM_SHELL_SETTLE - quiet)
+        except asyncio.TimeoutError:
+            pass
+        return (self.output_at or self._loop.time()) - self.started
+    
+    def claim(self) -> bytes:
+        """Stop watching the shell and return its output; the caller owns master_fd and pid."""
+        self.claimed = True
+        self._reader.stop()
+        self._on_close = None
+        self._first_output.set()  # Ends a wait in ready()
+        return bytes(self.output)
+    
+    def close(self):
+        """End the shell (closing the PTY hangs it up)."""
+        self.claim()
+        self.alive = False
+        try:
+            os.close(self.master_fd)
+        except OSError:
+            pass
+        reap_child(self.pid)
+    
+    def _on_output(self, data: bytes):
+        self.output_at = self._loop.time()
+        self._first_output.set()
+        if len(self.output) < WARM_SHELL_OUTPUT_LIMIT:
+            self.output += data
+    
+    def _closed(self, reason: str):
+        self.alive = False
+        self._first_output.set()
+        if self._on_close:
+            self._on_close(self)
+
+
+class ShellPool:
+    """Idle shells kept ready for private sessions, refilled in the background.
+    
+    Shells are started one at a time, each once the previous one has
+    printed its prompt, so refilling doesn't compete with sessions in use.
+    When none is ready, a session takes the one still starting, which has
+    some of its startup behind it already.
+    
+    The pool also keeps time to first prompt, from a private session's
+    connection to its first output, for shells from the pool (warm) and
+    shells started on connect (cold).
+    """
+    
+    def __init__(self, size: int = SHELL_POOL_SIZE, max_age: float = SHELL_POOL_MAX_AGE):
+        self.size = size
+        self.max_age = max_age
+        self._idle = deque()
+        self._warming = None  # Shell being started, not yet ready
+        self._task = None
+        self._recheck = None
+        self.spawned = 0
+        self.claimed = 0
+        self.missed = 0  # Sessions that found the pool empty
+        self.startup_ms = deque(maxlen=100)  # Start to prompt, for pooled shells
+        self.first_prompt_ms = {"warm": deque(maxlen=100), "cold": deque(maxlen=100)}
+    
+    def claim(self):
+        """An idle shell, or None if there isn't one ready."""
+        now = asyncio.get_running_loop().time()
+        shell = None
+        while self._idle:
+            candidate = self._idle.popleft()
+            if candidate.alive and now - candidate.started < self.max_age:
+                shell = candidate
+                self.claimed += 1
+                break
+            candidate.close()
+        if shell is None and self._warming is not None and self._warming.alive:
+            shell, self._warming = self._warming, None
+            self.claimed += 1
+        if shell is None and self.size > 0:
+            self.missed += 1
+        self.fill_soon()
+        return shell
+    
+    def record_first_prompt(self, seconds: float, warm: bool):
+        kind = "warm" if warm else "cold"
+        self.first_prompt_ms[kind].append(seconds * 1000)
+        FIRST_PROMPT_SECONDS.labels(kind).observe(seconds)
+    
+    def fill_soon(self):
+        if self.size > 0 and self._task is None:
+            self._task = asyncio.create_task(self._fill())
+    
+    async def _fill(self):
+        try:
+            loop = asyncio.get_running_loop()
+            for shell in [shell for shell in self._idle
+                          if not shell.alive or loop.time() - shell.started >= self.max_age]:
+                self._idle.remove(shell)
+                shell.close()
+            while len(self._idle) < self.size:
+                shell = self._warming = WarmShell((DEFAULT_COLS, DEFAULT_ROWS),
+                                                  on_close=self._on_shell_closed)
+                self.spawned += 1
+                startup = await shell.ready()
+                if shell.claimed:
+                    continue  # Taken while starting
+                self._warming = None
+                self.startup_ms.append(startup * 1000)
+                if shell.alive:
+                    self._idle.append(shell)
+                else:
+                    shell.close()
+                    break  # The shell won't start; try again on the next claim
+            if self._recheck is None:
+                self._recheck = loop.call_later(self.max_age / 2, self._recheck_pool)
+        except Exception as e:
+            print(f"Error starting a shell for the pool: {e}")
+        finally:
+            self._task = None
+    
+    def _recheck_pool(self):
+        self._recheck = None
+        self.fill_soon()
+    
+    def _on_shell_closed(self, shell: WarmShell):
+        if shell in self._idle:
+            self._idle.remove(shell)
+            shell.close()
+            self.fill_soon()
+    
+    def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._recheck:
+            self._recheck.cancel()
+            self._recheck = None
+        if self._warming:
+            self._warming.close()
+            self._warming = None
+        while self._idle:
+            self._idle.popleft().close()
+    
+    def stats(self) -> dict:
+        def summary(samples):
+            ordered = sorted(samples)
+            if not ordered:
+                return None
+            return {"count": len(ordered), "p50": round(ordered[len(ordered) // 2], 1),
+                    "max": round(ordered[-1], 1)}
+        return {
+            "pool_size": self.size,
+            "idle": len(self._idle),
+            "spawned": self.spawned,
+            "claimed": self.claimed,
+            "missed": self.missed,
+            "shell_startup_ms": summary(self.startup_ms),
+            "first_prompt_ms": {kind: summary(samples) for kind, samples in self.first_prompt_ms.items()},
+        }
+
+
+_shell_pool = None
+
+
+def get_shell_pool() -> ShellPool:
+    """The private-session shell pool (created on first use)."""
+    global _shell_pool
+    if _shell_pool is None:
+        _shell_pool = ShellPool()
+    return _shell_pool
+
+
 class TerminalSession:
-    """Manages a PTY terminal session (legacy non-shared mode)."""
+    """A private shell on its own PTY, which can outlive its WebSocket.
     
-    def __init__(self, ws: web.WebSocketResponse):
-        self.ws = ws
+    Each session has a ``token``. When its client's socket goes away the
+    session is detached: the shell keeps running and its output is kept in
+    a ring buffer, and a client can attach again with the token within
+    PRIVATE_DETACH_TTL, getting the output since the offset it saw last.
+    Binary clients are told ``{"type": "session", "token": T, "seq": N}``
+    when they attach, where N is the stream offset of the output that
+    follows. Detached sessions past their TTL (or beyond
+    PRIVATE_MAX_DETACHED) are reaped on a timer.
+    """
+    
+    _sessions = {}  # token -> TerminalSession
+    _reaper = None  # TimerHandle of the next reap, while any session is detached
+    _read_bytes = PTY_READ_BYTES.labels("private")
+    _reads = PTY_READS.labels("private")
+    _frames_metric = FRAMES_SENT.labels("private")
+    _bytes_metric = BYTES_SENT.labels("private")
+    _send_metric = SEND_SECONDS.labels("private")
+    
+    @classmethod
+    def find(cls, token: str):
+        """The running session with this token, or None."""
+        session = cls._sessions.get(token)
+        return session if session is not None and session.running else None
+    
+    @classmethod
+    def counts(cls) -> dict:
+        detached = sum(1 for session in cls._sessions.values() if session.ws is None)
+        return {"attached": len(cls._sessions) - detached, "detached": detached}
+    
+    def __init__(self, ws: web.WebSocketResponse, size: tuple = None,
+                 on_exit=None, on_replaced=None):
+        self.token = secrets.token_urlsafe(18)
+        self.ws = None
+        self.size = size or (DEFAULT_COLS, DEFAULT_ROWS)
+        self.detached_at = None  # Loop time the session lost its client
+        self._ring = OutputRing(limit=PRIVATE_RING_BYTES)
+        self._client_seq = 0  # Output offset the attached client has been sent up to
+        self._send_lock = asyncio.Lock()
+        self._output_ready = asyncio.Event()
+        self._decoder = new_utf8_decoder()
+        self._coalescer = OutputCoalescer(self._on_output)
+        self._probes = EchoProbes("private", self._probe_done)
+        self._reader = None
+        self._input = None
+        self._resize_timer = None
+        self._on_exit = None
+        self._on_replaced = None
         self.master_fd = None
         self.pid = None
         self.running = False
+        self.warm = False  # The shell came from the pool
+        self._started_at = None  # Until the first output is sent
+        self._bind(ws, on_exit, on_replaced)
     
     async def start(self):
-        """Start the terminal session."""
-        shell = os.environ.get("SHELL", "/bin/bash")
-        self.master_fd, slave_fd = pty.openpty()
-        self.pid = os.fork()
-        
-        if self.pid == 0:
-            os.close(self.master_fd)
-            os.setsid()
-            os.dup2(slave_fd, 0)
-            os.dup2(slave_fd, 1)
-            os.dup2(slave_fd, 2)
-            os.close(slave_fd)
-            os.execvp(shell, [shell])
+        """Start the terminal session, with a shell from the pool if one is ready."""
+        pool = get_shell_pool()
+        self._started_at = asyncio.get_running_loop().time()
+        shell = pool.claim()
+        output = b""
+        if shell is not None:
+            self.warm = True
+            self.master_fd, self.pid = shell.master_fd, shell.pid
+            output = shell.claim()
+            if shell.size != self.size:
+                set_pty_size(self.master_fd, *self.size)
         else:
-            os.close(slave_fd)
-            self.running = True
-            asyncio.create_task(self._read_output())
+            self.master_fd, self.pid = spawn_shell(self.size)
+        self.running = True
+        self._sessions[self.token] = self
+        self._input = PtyWriter(self.master_fd, self._on_input_closed)
+        await self._announce(self.ws, 0)
+        if output:
+            self._coalescer.push(output)
+        self._reader = PtyReader(self.master_fd, self._on_pty_output, self._on_pty_closed)
+        self._reader.start()
+        asyncio.create_task(self._send_output())
     
-    async def _read_output(self):
-        """Read output from PTY and send to WebSocket."""
-        while self.running:
-            try:
-                r, _, _ = select.select([self.master_fd], [], [], 0.1)
-                if r:
-                    data = os.read(self.master_fd, 4096)
-                    if data:
-                        await self.ws.send_str(data.decode("utf-8", errors="replace"))
-                    else:
-                        break
-                await asyncio.sleep(0.01)
-            except (OSError, BrokenPipeError):
+    async def attach(self, ws: web.WebSocketResponse, seq: int = None, size: tuple = None,
+                     on_exit=None, on_replaced=None):
+        """Attach a client, replaying output from offset ``seq``.
+        
+        Without ``seq``, or if it is no longer buffered, everything still
+        buffered is replayed. A client already attached is replaced (its
+        ``on_replaced`` is called): usually it is a socket that has died
+        without the server noticing yet.
+        """
+        old, replaced = self.ws, self._on_replaced
+        async with self._send_lock:
+            self._bind(ws, on_exit, on_replaced)
+            self.detached_at = None
+            if seq is None or self._ring.since(seq) is None:
+                seq = self._ring.start
+            replay, self._client_seq = self._ring.since(seq), self._ring.seq
+            await self._announce(ws, seq)
+            await self._send_to(ws, replay)
+        if self._reader:
+            self._reader.resume()
+        if old is not None and old is not ws and replaced:
+            replaced()
+        if size is not None and size != self.size:
+            self.resize(size)
+        print(f"Private session resumed ({self._ring.seq - seq} bytes replayed)")
+    
+    def detach(self, ws: web.WebSocketResponse):
+        """The client's socket has gone: keep the shell for PRIVATE_DETACH_TTL, or end it."""
+        if self.ws is not ws:
+            return  # Another client has taken over
+        self._probes.remove(ws)
+        self._bind(None, None, None)
+        if PRIVATE_DETACH_TTL <= 0 or not self.running:
+            self.stop()
+            return
+        if self._reader:
+            self._reader.resume()  # Nobody to wait for: output goes to the buffer
+        self.detached_at = asyncio.get_running_loop().time()
+        TerminalSession._reap_soon()
+    
+    def _bind(self, ws, on_exit, on_replaced):
+        self.ws = ws
+        self._decoder = new_utf8_decoder()
+        self._on_exit = on_exit
+        self._on_replaced = on_replaced
+    
+    @property
+    def binary(self) -> bool:
+        # Known once the client's socket is prepared
+        return self.ws is not None and wants_binary(self.ws)
+    
+    @classmethod
+    def _reap_soon(cls):
+        if cls._reaper is None:
+            cls._reaper = asyncio.get_running_loop().call_later(PRIVATE_REAP_INTERVAL, cls._reap)
+    
+    @classmethod
+    def _reap(cls):
+        """End detached sessions past their TTL, and the oldest beyond PRIVATE_MAX_DETACHED."""
+        cls._reaper = None
+        now = asyncio.get_running_loop().time()
+        detached = sorted((session for session in cls._sessions.values() if session.ws is None),
+                          key=lambda session: session.detached_at or 0)
+        excess = len(detached) - PRIVATE_MAX_DETACHED
+        for i, session in enumerate(detached):
+            if i < excess or now - (session.detached_at or 0) >= PRIVATE_DETACH_TTL:
+                print(f"Reaping detached private session (pid {session.pid})")
+                session.stop()
+        if any(session.ws is None for session in cls._sessions.values()):
+            cls._reap_soon()
+    
+    def _on_pty_output(self, data: bytes):
+        self._read_bytes.inc(len(data))
+        self._reads.inc()
+        if self._probes.pending:
+            self._probes.output(data, self._ring.seq + self._coalescer.pending)
+        self._coalescer.push(data)
+    
+    def _on_output(self, data: bytes):
+        """Buffer a chunk of output for the client, if one is attached, to be sent."""
+        self._ring.append(data)
+        self._output_ready.set()
+        if self._reader and self.ws is not None and self._ring.seq - self._client_seq >= PRIVATE_SEND_LIMIT:
+            self._reader.pause()  # Until the client has taken what is pending
+    
+    def _on_pty_closed(self, reason: str):
+        self._coalescer.flush()
+        self.running = False
+        self._output_ready.set()
+    
+    async def _send_output(self):
+        """Send output to the attached client as it comes in, until the shell ends."""
+        while True:
+            await self._output_ready.wait()
+            self._output_ready.clear()
+            async with self._send_lock:
+                ws = self.ws
+                if ws is not None and self._client_seq < self._ring.seq:
+                    if self._started_at is not None:
+                        get_shell_pool().record_first_prompt(
+                            asyncio.get_running_loop().time() - self._started_at, self.warm)
+                        self._started_at = None
+                    data = self._ring.since(self._client_seq)
+                    self._client_seq = self._ring.seq
+                    await self._send_to(ws, data)
+                    if self._probes.pending:
+                        for probe in self._probes.due(self._client_seq):
+                            if probe.client is ws:
+                                self._probes.sent(probe)
+            if not self.running:
                 break
+            if self._reader:
+                self._reader.resume()
+        on_exit = self._on_exit
+        if self.ws is None:
+            self.stop()
+        if on_exit:
+            on_exit()
+    
+    async def _send_to(self, ws, data: bytes):
+        if not data:
+            return
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            if self.binary:
+                await ws.send_bytes(data)
+            else:
+                await ws.send_str(self._decoder.decode(data))
+        except Exception:
+            self.detach(ws)  # The socket is gone; the handler will notice too
+            return
+        self._send_metric.observe(loop.time() - started)
+        self._bytes_metric.inc(len(data))
+        self._frames_metric.inc()
+    
+    async def _announce(self, ws, seq: int):
+        if self.binary:
+            await self._send_control(ws, {"type": "session", "token": self.token, "seq": seq})
+    
+    async def _send_control(self, ws, message: dict):
+        try:
+            await ws.send_str(json.dumps(message))
+        except Exception:
+            self.detach(ws)
+    
+    async def write(self, data, on_written=None):
+        """Write input (str or bytes) to the terminal."""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if self._input and self.running:
+            await self._input.write(data, on_written)
+    
+    async def probe(self, message: dict):
+        """Type an echo probe's keys for the attached client (see EchoProbes)."""
+        probe = self._probes.start(self.ws, message)
+        if probe is not None:
+            await self.write(probe.data, on_written=lambda: self._probes.written(probe))
+    
+    def _probe_done(self, probe: EchoProbe, message: dict):
+        if probe.client is not None and probe.client is self.ws:
+            asyncio.create_task(self._send_control(probe.client, message))
+    
+    def _on_input_closed(self, reason: str):
         self.running = False
+        self._output_ready.set()
     
-    async def write(self, data: str):
-        """Write input to the terminal."""
-        if self.master_fd and self.running:
-            os.write(self.master_fd, data.encode("utf-8"))
+    def resize(self, size: tuple):
+        """Resize the terminal to (cols, rows) once resizes have settled."""
+        self.size = size
+        if self._resize_timer:
+            self._resize_timer.cancel()
+        self._resize_timer = asyncio.get_running_loop().call_later(RESIZE_DEBOUNCE, self._resize)
+    
+    def _resize(self):
+        self._resize_timer = None
+        if self.running:
+            try:
+                set_pty_size(self.master_fd, *self.size)
+            except OSError as e:
+                print(f"Error resizing terminal: {e}")
     
     def stop(self):
-        """Stop the terminal session."""
+        """End the shell and forget the session."""
         self.running = False
+        self._output_ready.set()
+        self._probes.close()
+        if self._sessions.get(self.token) is self:
+            del self._sessions[self.token]
+        if self._resize_timer:
+            self._resize_timer.cancel()
+        if self._reader:
+            self._reader.stop()
+        if self._input:
+            self._input.stop()
         if self.master_fd:
             try:
                 os.close(self.master_fd)
             except OSError:
                 pass
+            self.master_fd = None
         if self.pid:
             try:
                 os.kill(self.pid, signal.SIGTERM)
             except OSError:
                 pass
+            reap_child(self.pid)
+            self.pid = None
+
+
+class MuxChannel:
+    """One terminal carried over a multiplexed WebSocket.
+    
+    Stands in for the WebSocket of a single-session client: the session
+    hub's ClientWriter (or a private TerminalSession) sends to it as it
+    would to a binary-mode client, and it wraps what it is sent in channel
+    frames. Snapshot announcements and the screen frame after them become
+    one MUX_SNAPSHOT message, size changes a MUX_RESIZE, and other control
+    messages go out as MUX_CONTROL JSON.
+    
+    With a ``window``, output stops while that many bytes are unacknowledged
+    by the client's MUX_ACKs, so a busy channel can't crowd the others out
+    of the connection. Output held back queues in the session's ClientWriter,
+    which skips to a snapshot if it grows too far, as for a slow client.
+    """
+    
+    ws_protocol = BINARY_PROTOCOL
+    
+    def __init__(self, mux: "Multiplexer", channel_id: int, window: int = 0):
+        self.mux = mux
+        self.id = channel_id
+        self.window = window
+        self.hub = None  # SharedTerminalSession, for a tmux session
+        self.session = None  # TerminalSession, for a private shell
+        self._closed = False
+        self._snapshot = None  # Packed header of an announced snapshot, awaiting its screen
+        self._sent = 0  # Output payload bytes sent on the channel
+        self._acked = 0
+        self._credit = asyncio.Event()
+    
+    @property
+    def closed(self) -> bool:
+        return self._closed or self.mux.ws.closed
+    
+    async def open(self, message: dict):
+        """Attach to the session the open message asks for; raises ValueError if it can't."""
+        size = parse_size(message.get("cols"), message.get("rows"))
+        if message.get("private"):
+            on_exit = lambda: self.mux.drop(self.id, "exited")
+            on_replaced = lambda: self.mux.drop(self.id, "Resumed elsewhere", end=False)
+            token = message.get("token")
+            if token is None:
+                self.session = TerminalSession(self, size=size, on_exit=on_exit, on_replaced=on_replaced)
+                await self.session.start()
+                return
+            session = TerminalSession.find(token) if isinstance(token, str) else None
+            if session is None:
+                raise ValueError("No such private session")
+            seq = message.get("seq")
+            await session.attach(self, seq=seq if isinstance(seq, int) else None, size=size,
+                                 on_exit=on_exit, on_replaced=on_replaced)
+            self.session = session
+            return
+        name = message.get("session") or SHARED_SESSION
+        if not isinstance(name, str) or not valid_session_name(name):
+            raise ValueError("Invalid session name")
+        if name != SHARED_SESSION:
+            result = await tmux("has-session", "-t", f"={name}")
+            if result.returncode != 0:
+                raise ValueError(f"No such session: {name}")
+        resume = message.get("resume")
+        self.hub = SharedTerminalSession.acquire(name)
+        await self.hub.add_client(
+            self, self.mux.remote, resume=resume if isinstance(resume, int) else None,
+            transport=message.get("transport", "raw"), size=size,
+        )
+    
+    async def write(self, data: bytes):
+        """Input for the channel's terminal."""
+        if self.hub:
+            await self.hub.write(data, client=self)
+        elif self.session:
+            await self.session.write(data)
+    
+    def resize(self, size: tuple):
+        if self.hub:
+            self.hub.resize(self, size)
+        elif self.session:
+            self.session.resize(size)
+    
+    async def probe(self, message: dict):
+        if self.hub:
+            await self.hub.probe(self, message)
+        elif self.session:
+            await self.session.probe(message)
+    
+    def ack(self, received: int):
+        """The client has taken ``received`` bytes of output in all."""
+        self._acked = max(self._acked, received)
+        self._credit.set()
+    
+    async def close(self, message: bytes = b""):
+        """Close the channel as a session closes a WebSocket: detach and tell the client."""
+        self.mux.drop(self.id, message.decode("utf-8", errors="replace") or "closed")
+    
+    def detach(self, end: bool = True):
+        """Detach from the session. A private shell is ended, unless ``end`` is
+        false (the connection dropped), which leaves it to be resumed."""
+        if self._closed:
+            return
+        self._closed = True
+        self._credit.set()
+        if self.hub:
+            self.hub.remove_client(self)
+            SharedTerminalSession.release(self.hub)
+        elif self.session:
+            self.session.detach(self)
+            if end:
+                self.session.stop()
+    
+    async def send_bytes(self, data: bytes):
+        """Output, or the screen frame of an announced snapshot."""
+        if self.closed:
+            raise ConnectionResetError("Channel is closed")
+        if self.window:
+            while self._sent - self._acked >= self.window and not self.closed:
+                self._credit.clear()
+                await self._credit.wait()
+        self._sent += len(data)
+        if self._snapshot is not None:
+            header, self._snapshot = self._snapshot, None
+            await self.mux.send(MUX_SNAPSHOT, self.id, header + data)
+        else:
+            await self.mux.send(MUX_DATA, self.id, data)
+    
+    async def send_str(self, text: str):
+        """A JSON control message for the client."""
+        message = json.loads(text)
+        kind = message.get("type")
+        if kind == "snapshot":
+            self._snapshot = MUX_SNAPSHOT_HEADER.pack(
+                message["seq"], message["cols"], message["rows"], 1 if message.get("history") else 0)
+        elif kind == "size":
+            await self.mux.send(MUX_RESIZE, self.id, struct.pack("!HH", message["cols"], message["rows"]))
+        else:
+            await self.mux.send(MUX_CONTROL, self.id, text.encode("utf-8"))
+
+
+class Multiplexer:
+    """Terminal sessions as channels of one WebSocket (/mux).
+    
+    Each message is a binary frame: a MUX_HEADER (type, channel id) and a
+    payload. Channel 0 is the connection itself; the server opens with a
+    ``{"type": "hello", "version": V}`` control message on it. The client
+    picks the ids of the channels it opens:
+    
+      MUX_CONTROL   JSON. ``{"type": "open", ...}`` attaches a channel to a
+                    tmux session or a private shell and is answered with
+                    ``opened`` or ``closed``; ``{"type": "close"}`` detaches.
+                    Output-stream notices (``resume``, ``transport``) too.
+      MUX_DATA      Input to, or output from, the channel's terminal
+      MUX_RESIZE    !HH cols, rows: the size the client has room for, or
+                    (from the server) the size the terminal now has
+      MUX_SNAPSHOT  MUX_SNAPSHOT_HEADER then a screen redraw
+      MUX_ACK       !Q output bytes received on the channel in all
+      MUX_PING      Answered with a MUX_PONG carrying the same payload
+    
+    Input is handled in order as it arrives, so a session making its
+    sender wait (a large paste) holds up the connection's other input
+    too, as it would over separate connections from one client.
+    """
+    
+    def __init__(self, ws: web.WebSocketResponse, remote: str, version: int):
+        self.ws = ws
+        self.remote = remote
+        self.version = version
+        self._channels = {}  # id -> MuxChannel
+    
+    async def run(self):
+        """Serve the WebSocket until it closes."""
+        await self.send_control(0, {"type": "hello", "version": self.version,
+                                    "max_channels": MUX_MAX_CHANNELS})
+        async for msg in self.ws:
+            if msg.type == aiohttp.WSMsgType.BINARY and len(msg.data) >= MUX_HEADER.size:
+                kind, channel_id = MUX_HEADER.unpack_from(msg.data)
+                try:
+                    await self._handle(kind, channel_id, msg.data[MUX_HEADER.size:])
+                except Exception as e:
+                    print(f"Error on mux channel {channel_id}: {e}")
+            elif msg.type == aiohttp.WSMsgType.ERROR:
+                print(f"WebSocket error: {self.ws.exception()}")
+                break
+    
+    async def _handle(self, kind: int, channel_id: int, payload: bytes):
+        if kind == MUX_PING:
+            await self.send(MUX_PONG, channel_id, payload)
+            return
+        if kind == MUX_CONTROL:
+            message = parse_control(payload)
+            if message and message.get("type") == "open":
+                await self._open(channel_id, message)
+            elif message and message.get("type") == "close":
+                self.drop(channel_id, "closed by client")
+            elif message and message.get("type") == "probe" and channel_id in self._channels:
+                await self._channels[channel_id].probe(message)
+            return
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            return
+        if kind == MUX_DATA:
+            await channel.write(payload)
+        elif kind == MUX_RESIZE and len(payload) == 4:
+            size = parse_size(*struct.unpack("!HH", payload))
+            if size:
+                channel.resize(size)
+        elif kind == MUX_ACK and len(payload) == 8:
+            channel.ack(struct.unpack("!Q", payload)[0])
+    
+    async def _open(self, channel_id: int, message: dict):
+        if channel_id == 0 or channel_id in self._channels:
+            await self.send_control(channel_id, {"type": "closed", "reason": "Channel id in use"})
+            return
+        if len(self._channels) >= MUX_MAX_CHANNELS:
+            await self.send_control(channel_id, {"type": "closed", "reason": "Too many channels"})
+            return
+        window = message.get("window")
+        if window is not None and (type(window) is not int or window <= 0):  # bool is an int
+            await self.send_control(channel_id, {"type": "closed", "reason": "Invalid window"})
+            return
+        channel = MuxChannel(self, channel_id, window=window or 0)
+        self._channels[channel_id] = channel
+        try:
+            await channel.open(message)
+        except Exception as e:
+            self._channels.pop(channel_id, None)
+            channel.detach()
+            await self.send_control(channel_id, {"type": "closed", "reason": str(e)})
+            return
+        name = channel.hub.name if channel.hub else None
+        print(f"Mux client {self.remote} opened channel {channel_id} on {name or 'a private shell'}")
+        await self.send_control(channel_id, {"type": "opened", "session": name})
+    
+    def drop(self, channel_id: int, reason: str, end: bool = True):
+        """Close a channel and tell the client."""
+        channel = self._channels.pop(channel_id, None)
+        if channel is None:
+            return
+        channel.detach(end)
+        if not self.ws.closed:
+            asyncio.create_task(self.send_control(channel_id, {"type": "closed", "reason": reason}))
+    
+    def close(self):
+        for channel in self._channels.values():
+            channel.detach(end=False)
+        self._channels.clear()
+    
+    async def send(self, kind: int, channel_id: int, payload: bytes = b""):
+        await self.ws.send_bytes(MUX_HEADER.pack(kind, channel_id) + payload)
+    
+    async def send_control(self, channel_id: int, message: dict):
+        try:
+            await self.send(MUX_CONTROL, channel_id, json.dumps(message).encode())
+        except ConnectionResetError:
+            pass
+
+
+def connection_opened(endpoint: str):
+    global _open_connections
+    CONNECTIONS.labels(endpoint).inc()
+    OPEN_CONNECTIONS.labels(endpoint).inc()
+    _open_connections += 1
+    if _open_connections == 1:
+        start_loop_monitor()
+
+
+def connection_closed(endpoint: str):
+    global _open_connections
+    OPEN_CONNECTIONS.labels(endpoint).dec()
+    _open_connections -= 1
+    if _open_connections == 0:
+        stop_loop_monitor()
 
 
 async def websocket_handler(request):
-    """Handle WebSocket connections for terminal access (shared session via tmux)."""
-    ws = web.WebSocketResponse()
+    """Handle WebSocket connections for terminal access (shared session via tmux).
+    
+    /terminal joins the default shared session; /terminal/{session} joins any
+    existing tmux session.
+    """
+    name = request.match_info.get("session", SHARED_SESSION)
+    if not valid_session_name(name):
+        return web.json_response({"error": "Invalid session name"}, status=400)
+    if name != SHARED_SESSION:
+        result = await tmux("has-session", "-t", f"={name}")
+        if result.returncode != 0:
+            return web.json_response({"error": f"No such session: {name}"}, status=404)
+    
+    # Pongs are handled here: they carry the RTT probes
+    ws = web.WebSocketResponse(protocols=(BINARY_PROTOCOL,), autoping=False)
     await ws.prepare(request)
-    print(f"✓ Client connected: {request.remote}")
+    print(f"✓ Client connected to {name}: {request.remote}")
     
-    # Use shared tmux session
-    shared_session = SharedTerminalSession.get_instance()
+    connection_opened("terminal")
+    shared_session = SharedTerminalSession.acquire(name)
     try:
-        await shared_session.add_client(ws)
+        resume = request.query.get("resume")
+        await shared_session.add_client(
+            ws, request.remote, resume=int(resume) if resume and resume.isdigit() else None,
+            transport=request.query.get("transport", "raw"),
+            size=parse_size(request.query.get("cols"), request.query.get("rows")),
+        )
+        binary = wants_binary(ws)
         async for msg in ws:
-            if msg.type == aiohttp.WSMsgType.TEXT:
+            if msg.type == aiohttp.WSMsgType.TEXT and binary:
+                # Binary clients type in binary frames; text frames are control messages
+                message = parse_control(msg.data)
+                if message and message.get("type") == "resize":
+                    size = parse_size(message.get("cols"), message.get("rows"))
+                    if size:
+                        shared_session.resize(ws, size)
+                elif message and message.get("type") == "probe":
+                    await shared_session.probe(ws, message)
+            elif msg.type in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
                 try:
-                    await shared_session.write(msg.data)
+                    await shared_session.write(msg.data, client=ws)
                 except Exception as e:
                     print(f"Error writing to terminal: {e}")
                     # Don't break - try to keep connection alive
                     # The write method should handle reconnection
+            elif msg.type == aiohttp.WSMsgType.PING:
+                await ws.pong(msg.data)
+            elif msg.type == aiohttp.WSMsgType.PONG:
+                shared_session.pong(ws, msg.data)
             elif msg.type == aiohttp.WSMsgType.ERROR:
                 print(f"WebSocket error: {ws.exception()}")
                 break
@@ -407,30 +3741,124 @@ async def websocket_handler(request):
         print(f"Error in websocket handler: {e}")
     finally:
         shared_session.remove_client(ws)
-        print(f"✗ Client disconnected: {request.remote}")
+        SharedTerminalSession.release(shared_session)
+        connection_closed("terminal")
+        print(f"✗ Client disconnected from {name}: {request.remote}")
     return ws
 
 
 async def websocket_private_handler(request):
     """Handle WebSocket connections for private terminal sessions."""
-    ws = web.WebSocketResponse()
+    size = parse_size(request.query.get("cols"), request.query.get("rows"))
+    token = request.query.get("resume")
+    session = None
+    if token:
+        session = TerminalSession.find(token)
+        if session is None:
+            return web.json_response({"error": "No such private session"}, status=404)
+    ws = web.WebSocketResponse(protocols=(BINARY_PROTOCOL,))
+    
+    def on_exit():
+        asyncio.create_task(ws.close())
+    
+    def on_replaced():
+        asyncio.create_task(ws.close(message=b"Resumed elsewhere"))
+    
+    if session is None:
+        session = TerminalSession(ws, size=size, on_exit=on_exit, on_replaced=on_replaced)
+    ws.headers["X-TermLinkky-Session"] = session.token
     await ws.prepare(request)
-    print(f"✓ Private client connected: {request.remote}")
+    print(f"✓ Private client {'resumed' if token else 'connected'}: {request.remote}")
     
-    session = TerminalSession(ws)
+    connection_opened("private")
     try:
-        await session.start()
+        if token:
+            seq = request.query.get("seq")
+            await session.attach(ws, seq=int(seq) if seq and seq.isdigit() else None, size=size,
+                                 on_exit=on_exit, on_replaced=on_replaced)
+        else:
+            await session.start()
         async for msg in ws:
-            if msg.type == aiohttp.WSMsgType.TEXT:
+            if msg.type == aiohttp.WSMsgType.TEXT and session.binary:
+                message = parse_control(msg.data)
+                if message and message.get("type") == "resize":
+                    size = parse_size(message.get("cols"), message.get("rows"))
+                    if size:
+                        session.resize(size)
+                elif message and message.get("type") == "probe":
+                    await session.probe(message)
+            elif msg.type in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
                 await session.write(msg.data)
             elif msg.type == aiohttp.WSMsgType.ERROR:
                 break
     finally:
-        session.stop()
+        session.detach(ws)
+        connection_closed("private")
         print(f"✗ Private client disconnected: {request.remote}")
     return ws
 
 
+async def websocket_mux_handler(request):
+    """Handle multiplexed WebSocket connections: any number of sessions over one socket."""
+    ws = web.WebSocketResponse(protocols=tuple(MUX_PROTOCOLS))
+    await ws.prepare(request)
+    version = MUX_PROTOCOLS.get(ws.ws_protocol)
+    if version is None:
+        await ws.close(code=aiohttp.WSCloseCode.PROTOCOL_ERROR,
+                       message=b"Offer a termlinkky.mux.N subprotocol")
+        return ws
+    print(f"✓ Mux client connected: {request.remote} (version {version})")
+    connection_opened("mux")
+    mux = Multiplexer(ws, request.remote, version)
+    try:
+        await mux.run()
+    except Exception as e:
+        print(f"Error in mux handler: {e}")
+    finally:
+        mux.close()
+        connection_closed("mux")
+        print(f"✗ Mux client disconnected: {request.remote}")
+    return ws
+
+
+async def start_shell_pool(app):
+    get_shell_pool().fill_soon()
+
+
+async def stop_shell_pool(app):
+    get_shell_pool().close()
+
+
+_loop_monitor = None
+_open_connections = 0  # WebSockets open on all endpoints; the lag monitor runs while > 0
+
+
+async def monitor_loop_lag():
+    """Sample how late the event loop runs a timer, for LOOP_LAG."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        LOOP_LAG.observe(max(0.0, loop.time() - started - LOOP_LAG_INTERVAL))
+
+
+def start_loop_monitor():
+    global _loop_monitor
+    if _loop_monitor is None:
+        _loop_monitor = asyncio.create_task(monitor_loop_lag())
+
+
+def stop_loop_monitor():
+    global _loop_monitor
+    if _loop_monitor is not None:
+        _loop_monitor.cancel()
+        _loop_monitor = None
+
+
+async def cancel_loop_monitor(app):
+    stop_loop_monitor()
+
+
 async def health_handler(request):
     """Health check endpoint."""
     return web.json_response({"status": "ok", "service": "termlinkky"})
@@ -438,15 +3866,53 @@ async def health_handler(request):
 
 async def info_handler(request):
     """Server info for autodiscovery and pairing."""
-    hostname = subprocess.run(["hostname"], capture_output=True, text=True).stdout.strip()
+    fingerprint = await certificate_fingerprint()
     return web.json_response({
-        "name": hostname,
-        "fingerprint": get_certificate_fingerprint(),
-        "pairingCode": get_pairing_code(),
+        "name": socket.gethostname(),
+        "fingerprint": fingerprint,
+        "pairingCode": get_pairing_code(fingerprint),
         "version": "2.0.0"
     })
 
 
+async def stats_handler(request):
+    """Per-client queue depth and throughput for each attached session, and the shell pool."""
+    return web.json_response({
+        "sessions": [hub.stats() for hub in SharedTerminalSession.all()],
+        "private": {**get_shell_pool().stats(), "sessions": TerminalSession.counts()},
+    })
+
+
+def _client_queues() -> dict:
+    queues = {}
+    for hub in SharedTerminalSession.all():
+        for writer in hub._clients.values():
+            key = (hub.name, writer.remote or "", writer.transport)
+            queues[key] = queues.get(key, 0) + writer.queue_depth
+    return queues
+
+
+CLIENT_QUEUE_BYTES = Gauge("termlinkky_client_queue_bytes",
+                           "Output queued for clients of shared sessions, by session, client address "
+                           "and transport", ("session", "client", "transport"), collect=_client_queues)
+RING_BUFFERED_BYTES = Gauge("termlinkky_ring_buffered_bytes",
+                            "Output kept for resuming clients, by session",
+                            ("session",), collect=lambda: {
+                                (hub.name,): hub._ring.seq - hub._ring.start
+                                for hub in SharedTerminalSession.all()})
+PRIVATE_SESSIONS = Gauge("termlinkky_private_sessions", "Private sessions, by state", ("state",),
+                         collect=lambda: {(state,): count
+                                          for state, count in TerminalSession.counts().items()})
+IDLE_SHELLS = Gauge("termlinkky_pool_idle_shells", "Shells waiting in the pool for private sessions",
+                    collect=lambda: {(): len(get_shell_pool()._idle)})
+
+
+async def metrics_handler(request):
+    """Counters and histograms in the Prometheus text format."""
+    return web.Response(body=render_metrics().encode("utf-8"),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
 async def viewer_handler(request):
     """Serve the web-based terminal viewer."""
     viewer_path = Path(__file__).parent / "viewer.html"
@@ -499,21 +3965,22 @@ async def dashboard_handler(request):
 async def list_sessions_handler(request):
     """List all tmux sessions."""
     try:
-        result = subprocess.run(
-            ["tmux", "list-sessions", "-F", "#{session_name}|#{session_windows}|#{session_created}|#{session_attached}"],
-            capture_output=True, text=True, timeout=5
+        result = await tmux(
+            "list-sessions", "-F", "#{session_name}|#{session_windows}|#{session_created}|#{session_attached}"
         )
         sessions = []
+        hubs = {hub.name: hub for hub in SharedTerminalSession.all()}
         if result.returncode == 0:
             for line in result.stdout.strip().split('\n'):
                 if line:
                     parts = line.split('|')
-                    if len(parts) >= 4:
+                    if len(parts) >= 4 and parts[0] != CONTROL_SESSION:
                         sessions.append({
                             "name": parts[0],
                             "windows": parts[1],
                             "created": parts[2],
-                            "attached": parts[3] == "1"
+                            "attached": parts[3] == "1",
+                            "viewers": hubs[parts[0]].viewers if parts[0] in hubs else 0
                         })
         return web.json_response({"sessions": sessions})
     except Exception as e:
@@ -525,10 +3992,9 @@ async def create_session_handler(request):
         data = await request.json()
         name = data.get("name", f"session-{int(time.time())}")
         name = "".join(c for c in name if c.isalnum() or c in "-_")[:32]
-        subprocess.run(
-            ["tmux", "new-session", "-d", "-s", name, "-x", "48", "-y", "30"],
-            timeout=5
-        )
+        if not valid_session_name(name):
+            return web.json_response({"error": "Invalid session name"}, status=400)
+        await tmux("new-session", "-d", "-s", name, "-x", str(DEFAULT_COLS), "-y", str(DEFAULT_ROWS))
         return web.json_response({"success": True, "name": name})
     except Exception as e:
         return web.json_response({"error": str(e)}, status=500)
@@ -539,7 +4005,9 @@ async def delete_session_handler(request):
         name = request.match_info.get("name")
         if not name:
             return web.json_response({"error": "No session name"}, status=400)
-        subprocess.run(["tmux", "kill-session", "-t", name], timeout=5)
+        if not valid_session_name(name):
+            return web.json_response({"error": "Invalid session name"}, status=400)
+        await tmux("kill-session", "-t", f"={name}")
         return web.json_response({"success": True})
     except Exception as e:
         return web.json_response({"error": str(e)}, status=500)
@@ -554,7 +4022,7 @@ def main():
         print("Install from: https://tailscale.com/download\n")
     
     # Bind to all interfaces for both local and Tailscale access
-    host = "0.0.0.0"
+    host = HOST
     
     generate_certificate()
     print_banner()
@@ -568,42 +4036,51 @@ def main():
     app.router.add_get("/dashboard", dashboard_handler)  # Session manager UI
     app.router.add_get("/terminal", websocket_handler)  # Shared tmux session
     app.router.add_get("/terminal/private", websocket_private_handler)  # Private session
+    app.router.add_get("/mux", websocket_mux_handler)  # Several sessions over one WebSocket
+    app.router.add_get("/terminal/{session}", websocket_handler)  # Any tmux session
     app.router.add_get("/health", health_handler)
     app.router.add_get("/info", info_handler)  # Autodiscovery endpoint
+    app.router.add_get("/api/stats", stats_handler)  # Per-client queue metrics
+    app.router.add_get("/metrics", metrics_handler)  # Prometheus scrape target
     # Session management API
     app.router.add_get("/api/sessions", list_sessions_handler)
     app.router.add_post("/api/sessions", create_session_handler)
     app.router.add_delete("/api/sessions/{name}", delete_session_handler)
+    app.on_startup.append(start_shell_pool)
+    app.on_cleanup.append(stop_shell_pool)
+    app.on_cleanup.append(cancel_loop_monitor)
     
     # Start Bonjour/Zeroconf advertising
     zeroconf_instance = None
     service_info = None
-    try:
-        from zeroconf import Zeroconf, ServiceInfo
-        import socket
-        
-        hostname = socket.gethostname()
-        local_ip = socket.gethostbyname(hostname)
-        
-        service_info = ServiceInfo(
-            "_termlinkky._tcp.local.",
-            f"{hostname}._termlinkky._tcp.local.",
-            addresses=[socket.inet_aton(local_ip)],
-            port=PORT,
-            properties={
-                "version": "2.0.0",
-                "pairing": get_pairing_code()
-            },
-            server=f"{hostname}.local."
-        )
-        
-        zeroconf_instance = Zeroconf()
-        zeroconf_instance.register_service(service_info)
-        print(f"📡 Bonjour: Advertising as {hostname}._termlinkky._tcp.local.")
-    except ImportError:
-        print("📡 Bonjour: zeroconf not installed (pip install zeroconf)")
-    except Exception as e:
-        print(f"📡 Bonjour: Failed to advertise - {e}")
+    if not BONJOUR:
+        print("📡 Bonjour: off (TERMLINKKY_BONJOUR=0)")
+    else:
+        try:
+            from zeroconf import Zeroconf, ServiceInfo
+            
+            hostname = socket.gethostname()
+            local_ip = socket.gethostbyname(hostname)
+            
+            service_info = ServiceInfo(
+                "_termlinkky._tcp.local.",
+                f"{hostname}._termlinkky._tcp.local.",
+                addresses=[socket.inet_aton(local_ip)],
+                port=PORT,
+                properties={
+                    "version": "2.0.0",
+                    "pairing": get_pairing_code()
+                },
+                server=f"{hostname}.local."
+            )
+            
+            zeroconf_instance = Zeroconf()
+            zeroconf_instance.register_service(service_info)
+            print(f"📡 Bonjour: Advertising as {hostname}._termlinkky._tcp.local.")
+        except ImportError:
+            print("📡 Bonjour: zeroconf not installed (pip install zeroconf)")
+        except Exception as e:
+            print(f"📡 Bonjour: Failed to advertise - {e}")
     
     print(f"Starting server on https://{host}:{PORT}")
     
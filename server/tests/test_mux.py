@@ -0,0 +1,129 @@
+"""
+Tests for /mux channels against a scratch tmux server, so real sessions are
+never touched.
+
+Run with: python3 -m unittest discover -s tests  (from server/)
+"""
+
+import asyncio
+import json
+import sys
+import unittest
+from contextlib import ExitStack
+from pathlib import Path
+
+from aiohttp import WSMsgType, web
+from aiohttp.test_utils import TestClient, TestServer
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import server  # noqa: E402
+from bench.common import scratch_tmux  # noqa: E402
+
+_scratch = ExitStack()
+
+
+def setUpModule():
+    _scratch.enter_context(scratch_tmux())
+
+
+def tearDownModule():
+    _scratch.close()
+
+
+class MuxTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        # The control client and hubs belong to the previous test's event loop
+        server._tmux_control = server._tmux_control_lock = None
+        server.SharedTerminalSession._sessions.clear()
+        app = web.Application()
+        app.router.add_get("/mux", server.websocket_mux_handler)
+        app.router.add_get("/terminal/{session}", server.websocket_handler)
+        app.router.add_post("/api/sessions", server.create_session_handler)
+        app.router.add_delete("/api/sessions/{name}", server.delete_session_handler)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        for hub in server.SharedTerminalSession.all():
+            hub.close()
+        server.SharedTerminalSession._sessions.clear()
+        if server._tmux_control:
+            server._tmux_control.stop()
+
+    async def open_mux(self):
+        ws = await self.client.ws_connect("/mux", protocols=("termlinkky.mux.1",))
+        hello = await self.control(ws, 0)
+        self.assertEqual(hello["type"], "hello")
+        return ws
+
+    async def send_control(self, ws, channel_id: int, message: dict):
+        await ws.send_bytes(server.MUX_HEADER.pack(server.MUX_CONTROL, channel_id)
+                            + json.dumps(message).encode())
+
+    async def control(self, ws, channel_id: int) -> dict:
+        """The next control message on a channel, skipping other traffic."""
+        while True:
+            msg = await ws.receive(timeout=10)
+            self.assertEqual(msg.type, WSMsgType.BINARY)
+            kind, got = server.MUX_HEADER.unpack_from(msg.data)
+            if kind == server.MUX_CONTROL and got == channel_id:
+                return json.loads(msg.data[server.MUX_HEADER.size:])
+
+    async def test_killed_session_closes_mux_and_plain_viewers(self):
+        await server.tmux("new-session", "-d", "-s", "foo", "-x", "80", "-y", "24")
+        mux = await self.open_mux()
+        await self.send_control(mux, 1, {"type": "open", "session": "foo"})
+        self.assertEqual((await self.control(mux, 1))["type"], "opened")
+        plain = await self.client.ws_connect("/terminal/foo", protocols=(server.BINARY_PROTOCOL,))
+        while (await plain.receive(timeout=10)).type != WSMsgType.BINARY:
+            pass  # Up to the first screen
+        self.assertEqual(server.SharedTerminalSession._sessions["foo"].viewers, 2)
+
+        response = await self.client.delete("/api/sessions/foo")
+        self.assertEqual((await response.json())["success"], True)
+
+        closed = await self.control(mux, 1)
+        self.assertEqual(closed, {"type": "closed", "reason": "session ended"})
+        while True:
+            msg = await plain.receive(timeout=10)
+            if msg.type in (WSMsgType.CLOSE, WSMsgType.CLOSED, WSMsgType.CLOSING):
+                break
+        self.assertEqual(msg.extra, "session ended")
+        for _ in range(50):
+            hub = server.SharedTerminalSession._sessions.get("foo")
+            if hub is None or hub.viewers == 0:
+                break
+            await asyncio.sleep(0.1)
+        self.assertTrue(hub is None or hub.viewers == 0)
+        await mux.close()
+
+    async def test_open_rejects_invalid_window(self):
+        mux = await self.open_mux()
+        for channel_id, window in enumerate((0, -1, True, "4096", 1.5), start=1):
+            await self.send_control(mux, channel_id, {"type": "open", "window": window})
+            self.assertEqual(await self.control(mux, channel_id),
+                             {"type": "closed", "reason": "Invalid window"}, window)
+        await self.send_control(mux, 9, {"type": "open", "window": 4096})
+        self.assertEqual((await self.control(mux, 9))["type"], "opened")
+        await mux.close()
+
+    async def test_control_session_is_off_limits(self):
+        await server.get_tmux_control()
+        name = server.CONTROL_SESSION
+        mux = await self.open_mux()
+        await self.send_control(mux, 1, {"type": "open", "session": name})
+        self.assertEqual(await self.control(mux, 1),
+                         {"type": "closed", "reason": "Invalid session name"})
+        await mux.close()
+        response = await self.client.get(f"/terminal/{name}")
+        self.assertEqual(response.status, 400)
+        response = await self.client.delete(f"/api/sessions/{name}")
+        self.assertEqual(response.status, 400)
+        response = await self.client.post("/api/sessions", json={"name": name})
+        self.assertEqual(response.status, 400)
+        self.assertEqual((await server.tmux("has-session", "-t", f"={name}")).returncode, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()